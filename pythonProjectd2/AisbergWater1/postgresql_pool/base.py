@@ -0,0 +1,117 @@
+"""
+Бэкенд PostgreSQL с пулом соединений psycopg_pool.
+
+Django 4.2 не умеет держать пул соединений, поэтому стандартный бэкенд
+расширен: соединение берётся из пула процесса при подключении и возвращается
+в пул вместо закрытия в конце запроса. Настройки пула задаются в
+DATABASES[...]['OPTIONS']['pool'] (аргументы psycopg_pool.ConnectionPool);
+без этого ключа бэкенд работает как обычный.
+"""
+import os
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base, creation
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """Создание тестовой базы с учётом пула.
+
+    Пул держит соединения с той базой, которая была задана при его создании, поэтому
+    перед переключением на тестовую базу и перед её удалением пулы закрываются.
+    """
+
+    def create_test_db(self, *args, **kwargs):
+        self.connection.close_pools()
+        return super().create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        self.connection.close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    # Пулы общие для всех потоков процесса, по одному на псевдоним базы
+    _connection_pools = {}
+    _pools_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        pool_options = self.settings_dict['OPTIONS'].get('pool')
+        if not pool_options:
+            return None
+        if self.settings_dict['CONN_MAX_AGE']:
+            raise ImproperlyConfigured('При использовании пула соединений CONN_MAX_AGE должен быть равен 0.')
+        with self._pools_lock:
+            if self.alias not in self._connection_pools:
+                kwargs = self.get_connection_params()
+                kwargs['autocommit'] = True  # Режим транзакций Django выставит сам после получения соединения
+                self._connection_pools[self.alias] = ConnectionPool(
+                    kwargs=kwargs,
+                    open=False,  # Пул открывается при первом подключении, уже в рабочем процессе сервера
+                    check=ConnectionPool.check_connection if self.settings_dict['CONN_HEALTH_CHECKS'] else None,
+                    name=f'django-{self.alias}',
+                    **pool_options,
+                )
+            return self._connection_pools[self.alias]
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = IsolationLevel(
+                IsolationLevel.READ_COMMITTED if isolation_level is None else isolation_level
+            )
+        except ValueError:
+            raise ImproperlyConfigured(
+                f'Некорректный уровень изоляции {isolation_level}: используйте значения psycopg.IsolationLevel.'
+            )
+        pool.open()
+        connection = pool.getconn()
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None and self.pool is not None:
+            # Соединение возвращается в пул; незавершённая транзакция будет откатена пулом
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
+            return None
+        return super()._close()
+
+    @classmethod
+    def close_pools(cls):
+        """Закрывает пулы всех баз (например, перед завершением процесса или в бенчмарке)"""
+        with cls._pools_lock:
+            pools = list(cls._connection_pools.values())
+            cls._connection_pools.clear()
+        for pool in pools:
+            pool.close()
+
+
+# Пулы, унаследованные дочерним процессом после fork: их сокеты принадлежат родителю,
+# поэтому их нельзя ни использовать, ни закрывать (закрытие оборвёт соединения родителя)
+_inherited_pools = []
+
+
+def _forget_pools_in_child():
+    _inherited_pools.extend(DatabaseWrapper._connection_pools.values())
+    DatabaseWrapper._connection_pools = {}
+    DatabaseWrapper._pools_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forget_pools_in_child)
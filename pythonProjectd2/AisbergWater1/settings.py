@@ -35,11 +35,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Триграммный поиск (pg_trgm)
     'sklad1',
     'AisbergWater1'
 ]
 
 MIDDLEWARE = [
+    'sklad1.middleware.SQLInstrumentationMiddleware',  # Первым, чтобы учитывать запросы сессий и авторизации
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,15 +74,132 @@ WSGI_APPLICATION = 'AisbergWater1.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# Пул соединений (AisbergWater1.postgresql_pool) включён по умолчанию; DB_POOL=0 возвращает
+# обычные соединения, которые живут DB_CONN_MAX_AGE секунд
+DB_POOL = os.environ.get('DB_POOL', '1') == '1'
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': 'postgres',
-        'USER': 'postgres',
-        'PASSWORD': '33300673330067a',
-        'HOST': '127.0.0.1',
-        'PORT': '5432',
+        'ENGINE': 'AisbergWater1.postgresql_pool' if DB_POOL else 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'postgres'),
+        'USER': os.environ.get('DB_USER', 'postgres'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', '33300673330067a'),
+        'HOST': os.environ.get('DB_HOST', '127.0.0.1'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        # С пулом соединение возвращается в пул после каждого запроса
+        'CONN_MAX_AGE': 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        # Проверка соединения перед использованием (и в пуле, и для постоянных соединений)
+        'CONN_HEALTH_CHECKS': os.environ.get('DB_HEALTH_CHECKS', '1') == '1',
+        'OPTIONS': {},
+    }
+}
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),  # Ожидание свободного соединения, с
+        'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),  # Закрытие простаивающих соединений, с
+        'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),  # Плановая замена соединений, с
+    }
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# Кэш справочников: локальная память процесса или Redis, если задан REDIS_URL
+# (для Redis нужен пакет redis)
+SHARED_CACHE = bool(os.environ.get('REDIS_URL'))
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
     }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'aisberg-water',
+        }
+    }
+
+# Время жизни закэшированных стартовых страниц (по ролям пользователей), в секундах
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 900))
+
+# Время жизни закэшированных таблиц остатков и справочников; они сбрасываются раньше при любом изменении.
+# Без общего кэша сброс виден только процессу, который изменил данные, поэтому остальные
+# процессы (другие воркеры сервера, run_workers) получают изменения не позже, чем через минуту
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 86400 if SHARED_CACHE else 60))
+REFERENCE_CACHE_TIMEOUT = int(os.environ.get('REFERENCE_CACHE_TIMEOUT', 86400 if SHARED_CACHE else 60))
+
+# Как часто процесс сверяет закэшированные составы продуктов с версией в базе, в секундах.
+# Изменение состава другим процессом попадает в выпуск продукции не позже, чем через это время;
+# процесс, изменивший состав, видит его сразу
+BOM_VERSION_CHECK_INTERVAL = float(os.environ.get('BOM_VERSION_CHECK_INTERVAL', 2))
+
+# Счётчик SQL-запросов и времени в базе на каждый запрос (заголовок Server-Timing);
+# медленные запросы и повторяющиеся одинаковые SQL-запросы (N+1) пишутся в debug.log
+SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '0') == '1'
+
+# Порог медленного запроса, в миллисекундах
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+
+# Сколько раз одинаковый SQL-запрос должен повториться за запрос, чтобы считаться N+1
+REPEATED_QUERY_THRESHOLD = int(os.environ.get('REPEATED_QUERY_THRESHOLD', 10))
+
+# Фоновые задачи (manage.py run_workers): число попыток, отсрочка повторной попытки в секундах
+# (удваивается с каждой попыткой), период сигнала исполнителя и молчание, после которого задача
+# считается брошенной и возвращается в очередь
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 30))
+JOB_HEARTBEAT = int(os.environ.get('JOB_HEARTBEAT', 2))
+JOB_STALE_AFTER = int(os.environ.get('JOB_STALE_AFTER', 60))
+
+# Поток событий складских экранов (/api/events/, только под ASGI): пауза между пустыми комментариями,
+# которые держат соединение открытым, время жизни одного потока в секундах (после него браузер
+# переподключается и получает пропущенные события), число последних событий процесса для такого
+# повтора и очередь одного подписчика, при переполнении которой экран перезагружается целиком
+EVENTS_KEEPALIVE = int(os.environ.get('EVENTS_KEEPALIVE', 15))
+EVENTS_STREAM_TIMEOUT = int(os.environ.get('EVENTS_STREAM_TIMEOUT', 300))
+EVENTS_REPLAY_SIZE = int(os.environ.get('EVENTS_REPLAY_SIZE', 1000))
+EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 1000))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'verbose': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'debug_file': {
+            'class': 'logging.FileHandler',
+            'filename': BASE_DIR / 'debug.log',
+            'encoding': 'utf-8',
+            'delay': True,  # Файл открывается при первой записи
+            'formatter': 'verbose',
+        },
+    },
+    'loggers': {
+        'sklad1.sql': {
+            'handlers': ['debug_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'sklad1.jobs': {
+            'handlers': ['debug_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'sklad1.events': {
+            'handlers': ['debug_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # Password validation
@@ -119,6 +238,9 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
+# Загруженные и сформированные файлы фоновых задач; отдаются только через представления с проверкой входа
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
 from sklad1.views import *
+from sklad1.api import (
+    api_events, api_finished_goods, api_open_batches, api_scan, api_search, api_shipments, api_stock, api_stock_detail,
+)
 
 from django.contrib import admin
 from django.urls import path, include
@@ -18,23 +21,49 @@ urlpatterns = [
     path('add-product/', add_product_to_line, name='add_product_to_line'),  # Изменил название пути
     path('create_batch/', create_batch, name='create_batch'),
     path('view_stock/', view_stock, name='view_stock'),
+    path('view_stock/export/', export_stock, name='export_stock'),
+    path('stock_history/', stock_history, name='stock_history'),
+    path('stock_history/export/', export_stock_history, name='export_stock_history'),
     path('view_finished_goods_stock/', view_finished_goods_stock, name='view_finished_goods_stock'),
     path('lines/', LineListView.as_view(), name='line_list'),
     path('product-list/', product_list, name='product_list'),
     path('batch_list/', batch_list, name='batch_list'),
+    path('batch_list/export/', export_batches, name='export_batches'),
 
     path('create_material/', create_material, name='create_material'),
     path('material_list/', material_list, name='material_list'),
     path('create_product_material/', create_product_material, name='create_product_material'),
+    path('create_product_component/', create_product_component, name='create_product_component'),
     path('product_material_list/', product_material_list, name='product_material_list'),
     path('release_products/', release_products, name='release_products'),
     path('add_stock/', add_stock, name='add_stock'),
+    path('import_masterdata/', import_masterdata_view, name='import_masterdata'),
     path('edit_stock/<int:stock_id>/', edit_stock, name='edit_stock'),
     path('view_and_edit_stock/', view_and_edit_stock, name='view_and_edit_stock'),
     path('create_shipment/', create_shipment, name='create_shipment'),
     path('view_shipments/', view_shipments, name='view_shipments'),
+    path('view_shipments/export/', export_shipments, name='export_shipments'),
+    path('api/shipments/', api_create_shipment, name='api_create_shipment'),
+    path('api/mrp/', api_mrp, name='api_mrp'),
+    path('api/stock/', api_stock, name='api_stock'),
+    path('api/stock/<int:material_id>/', api_stock_detail, name='api_stock_detail'),
+    path('api/finished_goods/', api_finished_goods, name='api_finished_goods'),
+    path('api/batches/open/', api_open_batches, name='api_open_batches'),
+    path('api/shipments/list/', api_shipments, name='api_shipments'),
+    path('api/shipments/pick/', api_pick_batches, name='api_pick_batches'),
+    path('api/search/', api_search, name='api_search'),
+    path('api/scan/', api_scan, name='api_scan'),
+    path('api/events/', api_events, name='api_events'),
+    path('jobs/', job_list, name='job_list'),
+    path('jobs/enqueue/', enqueue_job, name='enqueue_job'),
+    path('jobs/<int:job_id>/', job_detail, name='job_detail'),
+    path('jobs/<int:job_id>/download/', download_job_result, name='download_job_result'),
+    path('api/jobs/<int:job_id>/', api_job, name='api_job'),
     path('check_incoming/', check_incoming, name='check_incoming'),
+    path('reports/', rollup_report, name='rollup_report'),
+    path('cache_stats/', cache_statistics, name='cache_statistics'),
     path('create_counterparty/', create_counterparty, name='create_counterparty'),
     path('counterparty_list/', counterparty_list, name='counterparty_list'),
     path('finished_goods_stock_list/', finished_goods_stock_list, name='finished_goods_stock_list'),
+    path('finished_goods_stock_list/export/', export_finished_goods, name='export_finished_goods'),
 ]
\ No newline at end of file
@@ -0,0 +1,243 @@
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from .events import EVENT_TYPES, event_stream
+from .models import Batch, FinishedGoodsStock, Shipment, Stock
+from .exports import shipment_items
+from .pagination import akeyset_page
+from .picking import PICKING_ORDER
+from .scanning import parse_scan, product_for_gtin
+from .search import DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT, MAX_LIMIT as SEARCH_MAX_LIMIT, SEARCH_KINDS, search
+
+# Асинхронные JSON-представления для опроса остатков сканерами и табло.
+# Под ASGI (например, uvicorn AisbergWater1.asgi:application) ожидание базы
+# не занимает рабочий поток, поэтому один процесс держит много одновременных опросов.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+def async_api_view(view):
+    """Допускает только GET и вошедших пользователей; неавторизованным отвечает 401, а не перенаправлением.
+
+    Декораторы require_GET и login_required в Django 4.2 не поддерживают асинхронные представления.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return HttpResponseNotAllowed(['GET', 'HEAD'])
+        # request.user загружается из сессии синхронным запросом к базе
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return JsonResponse({'errors': ['Требуется вход в систему.']}, status=401)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _limit(request, default=DEFAULT_LIMIT, maximum=MAX_LIMIT):
+    try:
+        return min(max(int(request.GET.get('limit', default)), 1), maximum)
+    except ValueError:
+        return default
+
+
+def _page_response(page, serialize):
+    return JsonResponse({
+        'results': [serialize(obj) for obj in page],
+        'next_cursor': page.next_cursor,
+    })
+
+
+@async_api_view
+async def api_stock(request):
+    """Остатки материалов; постранично через параметр cursor"""
+    stocks = Stock.objects.select_related('material')
+    page = await akeyset_page(request, stocks, ordering=('pk',), per_page=_limit(request))
+    return _page_response(page, lambda stock: {
+        'material': stock.material_id,
+        'name': stock.material.name,
+        'unit': stock.material.unit,
+        'quantity': stock.quantity,
+    })
+
+
+@async_api_view
+async def api_stock_detail(request, material_id):
+    """Остаток одного материала (для сканера)"""
+    try:
+        stock = await Stock.objects.select_related('material').aget(material_id=material_id)
+    except Stock.DoesNotExist:
+        return JsonResponse({'errors': [f'Остаток материала с id {material_id} не найден.']}, status=404)
+    return JsonResponse({
+        'material': stock.material_id,
+        'name': stock.material.name,
+        'unit': stock.material.unit,
+        'quantity': stock.quantity,
+    })
+
+
+@async_api_view
+async def api_finished_goods(request):
+    """Ненулевые остатки готовой продукции по партиям"""
+    items = FinishedGoodsStock.objects.filter(quantity__gt=0).select_related('product', 'batch')
+    product = request.GET.get('product')
+    if product:
+        if not product.isdigit():
+            return JsonResponse({'errors': ['Некорректный продукт.']}, status=400)
+        items = items.filter(product_id=product)
+    page = await akeyset_page(request, items, ordering=('pk',), per_page=_limit(request))
+    return _page_response(page, lambda item: {
+        'id': item.pk,
+        'product': item.product_id,
+        'product_name': item.product.name,
+        'batch': item.batch_id,
+        'batch_number': item.batch.batch_number if item.batch else None,
+        'quantity': item.quantity,
+    })
+
+
+@async_api_view
+async def api_open_batches(request):
+    """Невыпущенные и неиспользованные партии (как на странице проверки поступлений)"""
+    batches = Batch.objects.filter(is_used=False).select_related('product', 'line')
+    page = await akeyset_page(request, batches, ordering=('-production_date', '-pk'), per_page=_limit(request))
+    return _page_response(page, lambda batch: {
+        'id': batch.pk,
+        'batch_number': batch.batch_number,
+        'product': batch.product_id,
+        'product_name': batch.product.name,
+        'line': batch.line_id,
+        'line_name': batch.line.name,
+        'production_date': batch.production_date,
+        'quantity': batch.quantity,
+    })
+
+
+@async_api_view
+async def api_shipments(request):
+    """Отгрузки, по желанию за период start_date..end_date (ГГГГ-ММ-ДД)"""
+    shipments = Shipment.objects.select_related('product', 'batch', 'counterparty').prefetch_related(shipment_items())
+    start_date = request.GET.get('start_date')
+    end_date = request.GET.get('end_date')
+    if start_date and end_date:
+        try:
+            shipments = shipments.filter(
+                shipment_date__range=[date.fromisoformat(start_date), date.fromisoformat(end_date)]
+            )
+        except ValueError:
+            return JsonResponse({'errors': ['Некорректный период.']}, status=400)
+    page = await akeyset_page(request, shipments, ordering=('-shipment_date', '-pk'), per_page=_limit(request))
+    return _page_response(page, lambda shipment: {
+        'id': shipment.pk,
+        'shipment_date': shipment.shipment_date,
+        'counterparty': shipment.counterparty_id,
+        'counterparty_name': shipment.counterparty.name,
+        'product': shipment.product_id,
+        'product_name': shipment.product.name if shipment.product else None,
+        'batch_number': shipment.batch.batch_number if shipment.batch else None,  # Если все строки одной партии
+        'quantity': shipment.quantity,
+        'items': [
+            {
+                'product': item.product_id,
+                'product_name': item.product.name,
+                'batch': item.batch_id,
+                'batch_number': item.batch.batch_number,
+                'quantity': item.quantity,
+            }
+            for item in shipment.items.all()
+        ],
+    })
+
+
+@async_api_view
+async def api_search(request):
+    """Поиск по продуктам, материалам и контрагентам для полей с автодополнением.
+
+    Параметры: q — строка поиска (название или GTIN), kind — справочники через запятую
+    (product, material, counterparty; по умолчанию все), limit — число результатов.
+    """
+    kinds = [kind for kind in request.GET.get('kind', '').split(',') if kind]
+    unknown = [kind for kind in kinds if kind not in SEARCH_KINDS]
+    if unknown:
+        return JsonResponse({'errors': [f'Неизвестный справочник: {kind}.' for kind in unknown]}, status=400)
+    results = await sync_to_async(search)(
+        request.GET.get('q', ''), kinds, _limit(request, SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT)
+    )
+    return JsonResponse({'results': results})
+
+
+@async_api_view
+async def api_scan(request):
+    """Сканирование на складе готовой продукции: продукт и его открытые партии по штрихкоду.
+
+    Параметр code — GTIN или строка GS1; если в ней есть партия (10) или дата производства (11),
+    партии отбираются по ним. Партии упорядочены так, как их подбирает отгрузка (FIFO или FEFO).
+    """
+    try:
+        scan = parse_scan(request.GET.get('code', ''))
+    except ValidationError as e:
+        return JsonResponse({'errors': e.messages}, status=400)
+    product = await sync_to_async(product_for_gtin)(scan.gtin)
+    if product is None:
+        return JsonResponse({'errors': [f'Продукт с GTIN {scan.gtin} не найден.']}, status=404)
+
+    items = FinishedGoodsStock.objects.filter(product=product, is_used=False, quantity__gt=0)
+    if scan.batch_number:
+        items = items.filter(batch_number=scan.batch_number)
+    if scan.production_date:
+        items = items.filter(production_date=scan.production_date)
+    items = items.order_by(*PICKING_ORDER[product.picking_strategy])[:_limit(request)]
+    return JsonResponse({
+        'gtin': scan.gtin,
+        'product': {
+            'id': product.pk,
+            'name': product.name,
+            'line': product.line.name,
+            'picking_strategy': product.picking_strategy,
+        },
+        'batch_number': scan.batch_number,
+        'production_date': scan.production_date,
+        'expiry_date': scan.expiry_date,
+        'batches': [
+            {
+                'id': item.pk,
+                'batch': item.batch_id,
+                'batch_number': item.batch_number,
+                'production_date': item.production_date,
+                'expiry_date': item.expiry_date,
+                'quantity': item.quantity,
+            }
+            async for item in items
+        ],
+    })
+
+
+@async_api_view
+async def api_events(request):
+    """Поток server-sent events об изменениях остатков, партий и отгрузок для складских экранов.
+
+    Параметр types — типы событий через запятую (stock, batch, finished_goods, shipment;
+    по умолчанию все). Каждое событие содержит изменённые строки с новыми значениями;
+    событие reload просит экран перечитать данные целиком. Работает только под ASGI:
+    под WSGI бесконечный поток занял бы рабочий поток сервера.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'errors': ['Поток событий доступен только под ASGI (uvicorn AisbergWater1.asgi:application).']},
+            status=400,
+        )
+    types = [event_type for event_type in request.GET.get('types', '').split(',') if event_type]
+    unknown = [event_type for event_type in types if event_type not in EVENT_TYPES]
+    if unknown:
+        return JsonResponse({'errors': [f'Неизвестный тип события: {event_type}.' for event_type in unknown]}, status=400)
+    response = StreamingHttpResponse(
+        event_stream(set(types or EVENT_TYPES), request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx не должен копить события в буфере
+    return response
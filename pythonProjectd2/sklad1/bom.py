@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import DataVersion, ProductComponent, ProductMaterial
+
+BOM_VERSION = 'bom'
+
+_lock = threading.Lock()
+_cache = None
+_local = threading.local()  # changed: поток изменил составы в текущей транзакции
+
+
+def bom_version():
+    """Текущая версия составов продуктов.
+
+    Версия хранится в базе, а не в кэше Django: с кэшем в памяти процесса другие
+    процессы (веб-серверы, run_workers) не узнали бы об изменении состава и списывали
+    бы материалы по старому составу.
+    """
+    return DataVersion.current(BOM_VERSION)
+
+
+def invalidate_bom():
+    """Сбрасывает закэшированные составы во всех процессах.
+
+    Вызывается в транзакции, изменяющей составы: версия меняется вместе с ними при фиксации.
+    Кэш своего процесса сбрасывается сразу после фиксации, остальные процессы замечают
+    новую версию не позже, чем через BOM_VERSION_CHECK_INTERVAL.
+    """
+    DataVersion.bump(BOM_VERSION)
+    _local.changed = True
+    transaction.on_commit(_forget)
+
+
+def _forget():
+    global _cache
+    _local.changed = False  # Обработчики on_commit выполняются в потоке, который зафиксировал транзакцию
+    with _lock:
+        _cache = None
+
+
+class _BomExplosion:
+    """Составы всех продуктов одной версии с запоминанием развёрнутых составов"""
+
+    def __init__(self, version):
+        self.version = version
+        self.materials = defaultdict(dict)  # продукт -> {материал: количество}
+        self.components = defaultdict(dict)  # продукт -> {полуфабрикат: количество}
+        for product_id, material_id, quantity in ProductMaterial.objects.values_list(
+            'product_id', 'material_id', 'quantity'
+        ):
+            self.materials[product_id][material_id] = quantity
+        for product_id, component_id, quantity in ProductComponent.objects.values_list(
+            'product_id', 'component_id', 'quantity'
+        ):
+            self.components[product_id][component_id] = quantity
+        self._flat = {}
+        self.checked_at = time.monotonic()  # Когда версия последний раз сверялась с базой
+
+    def product_ids(self):
+        return set(self.materials) | set(self.components)
+
+    def explode(self, product_id, path=()):
+        """Разворачивает состав продукта до сырья; повторно посчитанные уровни берутся из памяти"""
+        if product_id in self._flat:
+            return self._flat[product_id]
+        if product_id in path:
+            cycle = ' → '.join(str(item) for item in path[path.index(product_id):] + (product_id,))
+            raise ValidationError(f'Циклическая ссылка в составе продуктов: {cycle}.')
+
+        flat = defaultdict(Decimal)
+        for material_id, quantity in self.materials.get(product_id, {}).items():
+            flat[material_id] += quantity
+        for component_id, quantity in self.components.get(product_id, {}).items():
+            for material_id, per_unit in self.explode(component_id, path + (product_id,)).items():
+                flat[material_id] += per_unit * quantity
+
+        self._flat[product_id] = dict(flat)
+        return self._flat[product_id]
+
+
+def _current():
+    """Составы текущей версии.
+
+    Версия в базе сверяется не чаще раза в BOM_VERSION_CHECK_INTERVAL секунд, поэтому
+    выпуск продукции с прогретым кэшем не делает запросов к составам.
+    """
+    global _cache
+    if getattr(_local, 'changed', False):
+        if connection.in_atomic_block:
+            # Составы изменены в незафиксированной транзакции: они видны только ей и в общий кэш не попадают
+            return _BomExplosion(bom_version())
+        _local.changed = False
+    with _lock:
+        if _cache is not None and time.monotonic() - _cache.checked_at < settings.BOM_VERSION_CHECK_INTERVAL:
+            return _cache
+    version = bom_version()
+    with _lock:
+        if _cache is None or _cache.version != version:
+            _cache = _BomExplosion(version)
+        _cache.checked_at = time.monotonic()
+        return _cache
+
+
+def current_bom_version():
+    """Версия составов, по которой построены составы из flat_bom (без запроса к базе при прогретом кэше)"""
+    return _current().version
+
+
+def flat_bom(product_ids=None):
+    """Возвращает развёрнутые до сырья составы {продукт: {материал: количество на единицу}}.
+
+    Составы загружаются двумя запросами на версию и кэшируются в процессе, поэтому
+    глубина вложенности не добавляет запросов при выпуске продукции, а версия
+    сверяется с базой не при каждом вызове (см. _current).
+    """
+    explosion = _current()
+    if product_ids is None:
+        product_ids = explosion.product_ids()
+    with _lock:
+        return {product_id: explosion.explode(product_id) for product_id in product_ids}
+
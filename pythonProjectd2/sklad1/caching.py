@@ -0,0 +1,110 @@
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.translation import get_language
+
+STOCK_VERSION_KEY = 'sklad1:stock_version'
+STATS_PREFIX = 'sklad1:cache_stats'
+
+# Фрагменты шаблонов, кэшируемые по версии остатков (тег {% stock_cache %})
+CACHED_FRAGMENTS = ('stock_table', 'incoming_table')
+
+# Страницы, закэшированные декоратором cache_per_role (заполняется при импорте представлений)
+CACHED_PAGES = []
+
+
+def stock_version():
+    """Текущая версия данных об остатках (общая для всех процессов через кэш Django)"""
+    return cache.get_or_set(STOCK_VERSION_KEY, 1, timeout=None)
+
+
+def _increment_stock_version():
+    try:
+        cache.incr(STOCK_VERSION_KEY)
+    except ValueError:
+        cache.set(STOCK_VERSION_KEY, 1, timeout=None)
+
+
+def bump_stock_version():
+    """Сбрасывает закэшированные таблицы остатков после фиксации текущей транзакции.
+
+    Если увеличить версию до фиксации, параллельный запрос успеет закэшировать
+    старые данные уже под новой версией.
+    """
+    transaction.on_commit(_increment_stock_version)
+
+
+def record_hit(name, hit):
+    """Учитывает попадание или промах кэша для страницы или фрагмента"""
+    key = f'{STATS_PREFIX}:{name}:{"hits" if hit else "misses"}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:  # Счётчик вытеснен из кэша между add и incr
+            cache.set(key, 1, timeout=None)
+
+
+def cache_stats():
+    """Возвращает количество попаданий и промахов по каждой странице и фрагменту"""
+    names = [f'page:{name}' for name in CACHED_PAGES] + [f'fragment:{name}' for name in CACHED_FRAGMENTS]
+    counters = cache.get_many(
+        [f'{STATS_PREFIX}:{name}:{kind}' for name in names for kind in ('hits', 'misses')]
+    )
+    stats = {}
+    for name in names:
+        hits = counters.get(f'{STATS_PREFIX}:{name}:hits', 0)
+        misses = counters.get(f'{STATS_PREFIX}:{name}:misses', 0)
+        total = hits + misses
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+    return stats
+
+
+def _role(request):
+    if not request.user.is_authenticated:
+        return 'anonymous'
+    return request.user.role or 'none'
+
+
+def cache_per_role(view):
+    """Кэширует страницу отдельно для каждой роли пользователя.
+
+    Страница одинакова для всех пользователей одной роли, поэтому ключ строится по
+    имени представления, роли и языку. Не кэшируются ответы на не-GET запросы,
+    ответы с кодом, отличным от 200, и страницы с ожидающими показа сообщениями —
+    сообщения адресованы конкретному пользователю.
+    """
+    name = view.__name__
+    CACHED_PAGES.append(name)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET' or len(get_messages(request)):
+            return view(request, *args, **kwargs)
+
+        key = f'sklad1:page:{name}:{_role(request)}:{get_language()}'
+        cached = cache.get(key)
+        if cached is not None:
+            record_hit(f'page:{name}', True)
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+        else:
+            record_hit(f'page:{name}', False)
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), settings.PAGE_CACHE_TIMEOUT)
+
+        # Страница зависит от пользователя — общие прокси-кэши хранить её не должны
+        patch_vary_headers(response, ('Cookie',))
+        patch_cache_control(response, private=True)
+        return response
+
+    return wrapper
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import threading
+import uuid
+from collections import deque, namedtuple
+
+import psycopg
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, connections, transaction
+from django.urls import reverse
+from django.utils.formats import date_format, localize
+
+from .models import Batch, FinishedGoodsStock, Shipment, Stock
+from .reference import reference_list
+
+logger = logging.getLogger('sklad1.events')
+
+CHANNEL = 'sklad1_events'
+MAX_PAYLOAD = 7900  # NOTIFY принимает не больше 8000 байт
+RELOAD = 'reload'  # Событие «данных изменилось слишком много, перечитайте экран целиком»
+RECONNECT_DELAY = 5
+
+EventType = namedtuple('EventType', 'queryset key serialize')
+
+
+def _quantity(value, unit=''):
+    """Количество так, как его выводят шаблоны ({{ quantity }} с локализацией)"""
+    return f'{localize(value)} {unit}'.strip()
+
+
+def _related(obj, name):
+    """Связанный объект справочника без запроса к базе: загруженный вместе с obj или из кэша справочников"""
+    field = obj._meta.get_field(name)
+    if field.is_cached(obj):
+        return getattr(obj, name)
+    key = getattr(obj, field.attname)
+    for item in reference_list(field.related_model):
+        if item.pk == key:
+            return item
+    return getattr(obj, name)  # Запись новее кэша справочника (создана в другом процессе)
+
+
+def _name(obj, name):
+    return _related(obj, name).name
+
+
+def _stock_row(stock):
+    material = _related(stock, 'material')
+    return {
+        'id': stock.material_id, 'name': material.name, 'quantity': stock.quantity,
+        'quantity_display': _quantity(stock.quantity, material.get_unit_display()),
+        'edit_url': reverse('edit_stock', args=[stock.pk]),
+    }
+
+
+# Типы событий: записи, по которым строится событие, поле-ключ и строка для экрана.
+# Строки содержат готовые к выводу значения, чтобы обновлённые ячейки не отличались от отрисованных шаблоном;
+# названия справочников берутся без запросов (_related), поэтому строку можно построить прямо в сигнале.
+EVENT_TYPES = {
+    'stock': EventType(
+        lambda: Stock.objects.select_related('material'),
+        'material_id',
+        _stock_row,
+    ),
+    'batch': EventType(
+        lambda: Batch.objects.select_related('product', 'line'),
+        'pk',
+        lambda batch: {
+            'id': batch.pk, 'product': _name(batch, 'product'), 'line': _name(batch, 'line'),
+            'batch_number': batch.batch_number, 'production_date': date_format(batch.production_date, 'd.m.Y'),
+            'quantity': batch.quantity, 'quantity_display': _quantity(batch.quantity),
+            'open': batch.quantity > 0 and not batch.is_used,
+        },
+    ),
+    'finished_goods': EventType(
+        lambda: FinishedGoodsStock.objects.select_related('product'),
+        'pk',
+        lambda item: {
+            'id': item.pk, 'batch': item.batch_id, 'product': _name(item, 'product'), 'batch_number': item.batch_number,
+            'production_date': date_format(item.production_date, 'd.m.Y'),
+            'quantity': item.quantity, 'quantity_display': _quantity(item.quantity),
+            'open': item.quantity > 0 and not item.is_used,
+        },
+    ),
+    'shipment': EventType(
+        lambda: Shipment.objects.select_related('product', 'counterparty'),
+        'pk',
+        lambda shipment: {
+            'id': shipment.pk, 'product': _name(shipment, 'product') if shipment.product_id else None,
+            'counterparty': _name(shipment, 'counterparty'),
+            'shipment_date': date_format(shipment.shipment_date, 'd.m.Y'),
+            'quantity': shipment.quantity, 'quantity_display': _quantity(shipment.quantity),
+        },
+    ),
+}
+
+
+def _payloads(event_type, rows):
+    """JSON событий со строками rows; слишком длинное для NOTIFY событие делится на несколько"""
+    payload = json.dumps({'type': event_type, 'rows': rows}, cls=DjangoJSONEncoder, ensure_ascii=False)
+    if len(payload.encode('utf-8')) <= MAX_PAYLOAD or len(rows) == 1:
+        return [payload]
+    middle = len(rows) // 2
+    return _payloads(event_type, rows[:middle]) + _payloads(event_type, rows[middle:])
+
+
+def _deliver_payloads(payloads):
+    if connection.vendor != 'postgresql':
+        for payload in payloads:
+            broker.publish(payload)
+        return
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload', [CHANNEL, payloads])
+    except DatabaseError:
+        # Изменения уже зафиксированы: без события экраны обновятся при следующем переподключении
+        logger.exception('Не удалось отправить события складским экранам')
+
+
+def _send(payloads):
+    """Отправляет события после фиксации транзакции: экраны не видят неподтверждённых
+    изменений, а откат отбрасывает события вместе с ними"""
+    transaction.on_commit(lambda: _deliver_payloads(payloads))
+
+
+def publish(**changes):
+    """Сообщает складским экранам об изменённых записях: publish(stock=[id материала, ...], batch=[id, ...]).
+
+    Записи перечитываются одним запросом на тип события; ключи, которых больше нет
+    в базе, отправляются как удалённые строки ({'id': ..., 'deleted': True}).
+    """
+    payloads = []
+    for event_type, keys in changes.items():
+        keys = {key for key in keys if key is not None}  # bulk_create на старых SQLite не возвращает id
+        if not keys:
+            continue
+        kind = EVENT_TYPES[event_type]
+        rows = [kind.serialize(obj) for obj in kind.queryset().filter(**{f'{kind.key}__in': keys})]
+        rows += [{'id': key, 'deleted': True} for key in keys - {row['id'] for row in rows}]
+        payloads += _payloads(event_type, rows)
+    if payloads:
+        _send(payloads)
+
+
+def publish_instance(event_type, instance, deleted=False):
+    """Сообщает экранам об изменении одной записи по данным самого объекта, без запроса к базе.
+
+    Используется сигналами сохранения и удаления; массовые изменения публикуются через publish.
+    """
+    kind = EVENT_TYPES[event_type]
+    key = getattr(instance, kind.key)
+    if key is None:
+        return
+    _send(_payloads(event_type, [{'id': key, 'deleted': True} if deleted else kind.serialize(instance)]))
+
+
+def publish_reload():
+    """Просит экраны перечитать данные целиком (после массовых изменений, например загрузки остатков)"""
+    _send([json.dumps({'type': RELOAD})])
+
+
+class Broker:
+    """Рассылает события подписчикам своего процесса.
+
+    Подписчик — asyncio.Queue в цикле событий сервера; публиковать можно из любого потока.
+    Последние события хранятся с порядковыми номерами, чтобы переподключившийся поток
+    получил пропущенное (номер события — «токен-номер», токен меняется, когда события
+    могли быть потеряны, и тогда вместо повтора экран перезагружается).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}  # очередь -> цикл событий
+        self._recent = deque(maxlen=settings.EVENTS_REPLAY_SIZE)
+        self._sequence = 0
+        self._token = uuid.uuid4().hex[:8]
+
+    def publish(self, payload):
+        """Передаёт событие (JSON с полем type) всем подписчикам"""
+        event_type = json.loads(payload)['type']
+        with self._lock:
+            self._sequence += 1
+            event = (f'{self._token}-{self._sequence}', event_type, payload)
+            self._recent.append((self._sequence, event))
+            for queue, loop in self._subscribers.items():
+                loop.call_soon_threadsafe(_deliver, queue, event)
+
+    def reset(self):
+        """Сообщает подписчикам, что события могли быть потеряны (например, при обрыве LISTEN)"""
+        with self._lock:
+            self._token = uuid.uuid4().hex[:8]
+            self._recent.clear()
+            for queue, loop in self._subscribers.items():
+                loop.call_soon_threadsafe(_deliver, queue, (None, RELOAD, '{}'))
+
+    def subscribe(self, last_event_id=None):
+        """Очередь событий для текущего цикла событий.
+
+        last_event_id — номер последнего полученного события (заголовок Last-Event-ID):
+        события после него ставятся в очередь сразу, а если их уже нет — ставится RELOAD.
+        """
+        queue = asyncio.Queue(maxsize=settings.EVENTS_QUEUE_SIZE)
+        with self._lock:
+            if last_event_id:
+                token, _, sequence = last_event_id.partition('-')
+                missed = self._replay(token, sequence)
+                for event in missed if missed is not None else [(None, RELOAD, '{}')]:
+                    _deliver(queue, event)
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def _replay(self, token, sequence):
+        if token != self._token or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence < self._sequence - len(self._recent):
+            return None  # Часть пропущенных событий уже вытеснена
+        return [event for number, event in self._recent if number > sequence]
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+
+def _deliver(queue, event):
+    if queue.full():
+        # Подписчик не успевает читать: вместо накопленных событий — перезагрузка экрана
+        while not queue.empty():
+            queue.get_nowait()
+        event = (None, RELOAD, '{}')
+    queue.put_nowait(event)
+
+
+broker = Broker()
+
+# Слушатель LISTEN: одно соединение на процесс, сколько бы экранов ни было открыто
+_listener = None
+
+
+async def _listen():
+    params = connections['default'].get_connection_params()
+    params.pop('cursor_factory', None)  # Синхронный класс курсора Django асинхронному соединению не подходит
+    connected_before = False
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(autocommit=True, **params) as listener:
+                await listener.execute(f'LISTEN {CHANNEL}')
+                if connected_before:
+                    broker.reset()  # Пока соединения не было, события не доставлялись
+                connected_before = True
+                async for notify in listener.notifies():
+                    broker.publish(notify.payload)
+        except psycopg.Error:
+            logger.exception('Соединение LISTEN %s потеряно, повтор через %s с', CHANNEL, RECONNECT_DELAY)
+        await asyncio.sleep(RECONNECT_DELAY)
+
+
+def ensure_listener():
+    """На PostgreSQL запускает слушателя NOTIFY в текущем цикле событий (один раз на процесс).
+
+    На других базах события приходят в брокер процесса напрямую из publish.
+    """
+    global _listener
+    if connection.vendor != 'postgresql':
+        return
+    loop = asyncio.get_running_loop()
+    if _listener is None or _listener.done() or _listener.get_loop() is not loop:
+        _listener = loop.create_task(_listen())
+
+
+async def event_stream(types, last_event_id=None):
+    """Поток server-sent events с событиями типов types.
+
+    Django 4.2 не сообщает потоковому ответу об отключении клиента, поэтому поток
+    завершается через EVENTS_STREAM_TIMEOUT секунд; EventSource переподключается сам
+    и передаёт Last-Event-ID, по которому брокер повторяет пропущенные события.
+    """
+    ensure_listener()
+    queue = broker.subscribe(last_event_id)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.EVENTS_STREAM_TIMEOUT
+    try:
+        yield 'retry: 3000\n\n'
+        while loop.time() < deadline:
+            try:
+                event_id, event_type, payload = await asyncio.wait_for(
+                    queue.get(), min(settings.EVENTS_KEEPALIVE, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event_type == RELOAD:
+                yield f'event: {RELOAD}\ndata: {{}}\n\n'
+                return
+            if event_type in types:
+                yield f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+    finally:
+        broker.unsubscribe(queue)
@@ -0,0 +1,152 @@
+import csv
+from collections import namedtuple
+from decimal import Decimal
+
+from django.http import StreamingHttpResponse
+
+from django.db.models import Prefetch
+
+from .models import Batch, FinishedGoodsStock, Shipment, ShipmentItem, Stock
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Выгрузка в CSV: имя файла, заголовок, выборка строк по параметрам фильтра и колонка с итогом
+CsvExport = namedtuple('CsvExport', 'filename header rows total_column')
+
+
+class _Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи в файл"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows, total_column=None, total_label='Итого'):
+    """Строки CSV-файла по одной: BOM и заголовок, данные и, если указан total_column, итог"""
+    writer = csv.writer(_Echo(), delimiter=';')
+    yield '\ufeff'  # BOM, чтобы Excel корректно открыл кириллицу
+    yield writer.writerow(header)
+    total = Decimal('0')
+    for row in rows:
+        if total_column is not None:
+            total += row[total_column] or 0
+        yield writer.writerow(row)
+    if total_column is not None:
+        footer = [''] * len(header)
+        footer[0] = total_label
+        footer[total_column] = total
+        yield writer.writerow(footer)
+
+
+def stream_csv(filename, header, rows, total_column=None, total_label='Итого'):
+    """Отдаёт строки в формате CSV потоком, не загружая выборку в память.
+
+    rows — итерируемый набор кортежей (обычно values_list(...).iterator()).
+    Если указан total_column, в конце добавляется строка с суммой этой колонки,
+    посчитанной на сервере по мере выдачи строк.
+    """
+    response = StreamingHttpResponse(
+        csv_lines(header, rows, total_column, total_label), content_type='text/csv; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def filter_batches(params):
+    """Применяет фильтры списка партий по дате и продукту из параметров запроса."""
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    product_id = params.get('product_id')
+
+    # Фильтрация по дате и продукту
+    filters = {}
+    if start_date and end_date:
+        filters['production_date__range'] = [start_date, end_date]
+    if product_id:
+        filters['product_id'] = product_id
+
+    return Batch.objects.filter(**filters)
+
+
+def filter_shipments(params):
+    """Применяет фильтр списка отгрузок по дате из параметров запроса."""
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+
+    if start_date and end_date:
+        return Shipment.objects.filter(shipment_date__range=[start_date, end_date])
+    return Shipment.objects.all()
+
+
+def shipment_items():
+    """Prefetch строк отгрузок с продуктом и номером партии для вывода документов"""
+    return Prefetch(
+        'items',
+        queryset=ShipmentItem.objects.select_related('product', 'batch').only(
+            'shipment_id', 'quantity', 'product__name', 'batch__batch_number'
+        ).order_by('pk'),
+    )
+
+
+def _shipment_rows(params):
+    """Строки отгрузок, отобранных фильтром списка отгрузок.
+
+    Отгрузки, созданные до появления строк документа, хранят продукт, партию
+    и количество в шапке и выгружаются одной строкой.
+    """
+    shipments = filter_shipments(params)
+    items = ShipmentItem.objects.filter(shipment__in=shipments).values_list(
+        'shipment_id', 'shipment__shipment_date', 'product__name', 'batch__batch_number',
+        'shipment__counterparty__name', 'quantity',
+    )
+    legacy = shipments.filter(items__isnull=True, product__isnull=False).values_list(
+        'pk', 'shipment_date', 'product__name', 'batch__batch_number', 'counterparty__name', 'quantity',
+    )
+    # Объединённая выборка сортируется по именам колонок первой
+    return items.union(legacy, all=True).order_by('-shipment__shipment_date', '-shipment_id', 'batch__batch_number')
+
+
+def _finished_goods(params):
+    stock = FinishedGoodsStock.objects.all()
+    product_id = params.get('product_id')
+    if product_id:
+        stock = stock.filter(product_id=product_id)
+    return stock
+
+
+# Выгрузки списков; одни и те же для скачивания потоком и для фоновых задач
+EXPORTS = {
+    'batches': CsvExport(
+        'batches.csv', ['Номер партии', 'Продукт', 'Линия', 'Дата производства', 'Количество'],
+        lambda params: filter_batches(params).order_by('-production_date', '-pk').values_list(
+            'batch_number', 'product__name', 'line__name', 'production_date', 'quantity'
+        ),
+        4,
+    ),
+    'shipments': CsvExport(  # По строке на каждую партию отгрузки
+        'shipments.csv', ['Номер отгрузки', 'Дата отгрузки', 'Продукт', 'Партия', 'Контрагент', 'Количество'],
+        _shipment_rows,
+        5,
+    ),
+    'stock': CsvExport(
+        'stock.csv', ['Материал', 'Количество', 'Единица измерения'],
+        lambda params: Stock.objects.order_by('material__name', 'pk').values_list(
+            'material__name', 'quantity', 'material__unit'
+        ),
+        None,  # Без итога: единицы измерения различаются
+    ),
+    'finished_goods': CsvExport(
+        'finished_goods.csv', ['Продукт', 'Номер партии', 'Дата производства', 'Количество'],
+        lambda params: _finished_goods(params).order_by('-production_date', '-pk').values_list(
+            'product__name', 'batch_number', 'production_date', 'quantity'
+        ),
+        3,
+    ),
+}
+
+
+def stream_export(name, params):
+    """Отдаёт выгрузку из EXPORTS потоком"""
+    export = EXPORTS[name]
+    rows = export.rows(params).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return stream_csv(export.filename, export.header, rows, total_column=export.total_column)
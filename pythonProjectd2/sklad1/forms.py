@@ -3,8 +3,12 @@ from datetime import date
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.shortcuts import redirect, render, get_object_or_404
+from django.urls import reverse_lazy
 
+from .masterdata import IMPORT_KIND_CHOICES
 from .models import *
+from .reference import CachedModelChoiceField
+from .search import SearchModelChoiceField
 # Форма для создания пользователя
 class CustomUserCreationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
@@ -31,18 +35,23 @@ class LineForm(forms.ModelForm):
 class ProductForm(forms.ModelForm):
     class Meta:
         model = Product  # Используем модель Product
-        fields = ['line', 'name', 'gtin', 'volume']  # Поля формы
+        fields = ['line', 'name', 'gtin', 'volume', 'picking_strategy', 'shelf_life_days']  # Поля формы
         labels = {
             'line': 'Выберите линию:',  # Метка для выбора линии
             'name': 'Наименование продукта:',  # Метка для имени продукта
             'gtin': 'GTIN:',  # Метка для кода GTIN
-            'volume': 'Объем:'  # Метка для объема продукта
+            'volume': 'Объем:',  # Метка для объема продукта
+            'picking_strategy': 'Подбор партий при отгрузке:',  # Метка для порядка подбора партий
+            'shelf_life_days': 'Срок годности, дней:',  # Метка для срока годности
         }
+        field_classes = {'line': CachedModelChoiceField}  # Линии берутся из кэша справочников
         widgets = {
             'line': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора линии
             'name': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Введите наименование продукта'}),  # Виджет для имени продукта
             'gtin': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Введите GTIN'}),  # Виджет для кода GTIN
             'volume': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'Введите объем', 'step': '0.1'}),  # Виджет для объема
+            'picking_strategy': forms.Select(attrs={'class': 'form-control'}),  # Виджет для порядка подбора партий
+            'shelf_life_days': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),  # Виджет для срока годности
         }
 
     def clean(self):
@@ -50,6 +59,9 @@ class ProductForm(forms.ModelForm):
         volume = cleaned_data.get('volume')  # Получаем объем
         line = cleaned_data.get('line')  # Получаем линию
 
+        if cleaned_data.get('picking_strategy') == Product.FEFO and not cleaned_data.get('shelf_life_days'):
+            self.add_error('shelf_life_days', 'Для подбора FEFO укажите срок годности.')
+
         # Проверка соответствия объема продукта и объема линии
         if line and volume:
             if volume != line.volume:
@@ -66,6 +78,7 @@ class BatchForm(forms.ModelForm):
             'production_date': 'Дата',  # Метка для даты производства
             'quantity': 'Количество',  # Метка для количества
         }
+        field_classes = {'line': CachedModelChoiceField, 'product': CachedModelChoiceField}  # Справочники из кэша
         widgets = {
             'line': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора линии
             'product': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора продукта
@@ -78,9 +91,12 @@ class BatchForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         # Фильтруем продукты по выбранной линии
         if line_id:
-            self.fields['product'].queryset = Product.objects.filter(line_id=line_id).order_by('name')
+            self.fields['product'].limit(
+                Product.objects.filter(line_id=line_id).order_by('name'),
+                lambda product: str(product.line_id) == str(line_id),
+            )
         else:
-            self.fields['product'].queryset = Product.objects.none()
+            self.fields['product'].limit(Product.objects.none(), lambda product: False)
 
         # Устанавливаем текущую дату по умолчанию для новой записи
         if not self.instance.pk:  # Если это новая запись
@@ -98,21 +114,16 @@ class MaterialForm(forms.ModelForm):
 
 # Форма для связи продукта с материалом
 class ProductMaterialForm(forms.ModelForm):
+    product = SearchModelChoiceField('product')  # Выбор продукта поиском
+    material = SearchModelChoiceField('material')  # Выбор материала поиском
+
     class Meta:
         model = ProductMaterial  # Используем модель ProductMaterial
         fields = ['product', 'material', 'quantity']  # Поля формы
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора продукта
-            'material': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора материала
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),  # Виджет для ввода количества
         }
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Инициализация выборок для продуктов и материалов
-        self.fields['product'].queryset = Product.objects.all()
-        self.fields['material'].queryset = Material.objects.all()
-
     def clean(self):
         cleaned_data = super().clean()
         product = cleaned_data.get('product')  # Получаем продукт
@@ -122,11 +133,27 @@ class ProductMaterialForm(forms.ModelForm):
         if ProductMaterial.objects.filter(product=product, material=material).exists():
             raise forms.ValidationError('Этот материал уже добавлен к продукту.')
 
+# Форма для связи продукта с полуфабрикатом
+class ProductComponentForm(forms.ModelForm):
+    product = SearchModelChoiceField('product', label='Продукт')  # Выбор продукта поиском
+    component = SearchModelChoiceField('product', label='Полуфабрикат')  # Выбор полуфабриката поиском
+
+    class Meta:
+        model = ProductComponent  # Используем модель ProductComponent
+        fields = ['product', 'component', 'quantity']  # Поля формы
+        labels = {
+            'quantity': 'Количество',  # Метка для количества
+        }
+        widgets = {
+            'quantity': forms.NumberInput(attrs={'class': 'form-control'}),  # Виджет для ввода количества
+        }
+
 # Форма для создания/редактирования остатков на складе
 class StockForm(forms.ModelForm):
     class Meta:
         model = Stock  # Используем модель Stock
         fields = ['material', 'quantity']  # Поля формы
+        field_classes = {'material': CachedModelChoiceField}  # Материалы берутся из кэша справочников
         widgets = {
             'material': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора материала
             'quantity': forms.NumberInput(attrs={'class': 'form-control'}),  # Виджет для ввода количества
@@ -135,7 +162,7 @@ class StockForm(forms.ModelForm):
 # Форма для выпуска продукции
 class ReleaseProductsForm(forms.Form):
     batch = forms.ModelChoiceField(
-        queryset=Batch.objects.filter(quantity=0, is_used=False).order_by('batch_number'),
+        queryset=Batch.objects.filter(quantity=0, is_used=False).select_related('product', 'line').order_by('batch_number'),
         label="Выберите партию",  # Метка для выбора партии
         widget=forms.Select(attrs={'class': 'form-control'})
     )
@@ -144,31 +171,42 @@ class ReleaseProductsForm(forms.Form):
         widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
     )
 
+# Список партий, зависящий от выбранного продукта: static/js/batch_select.js
+# подгружает открытые партии продукта из /api/finished_goods/ при смене продукта
+class ProductBatchSelect(forms.Select):
+    class Media:
+        js = ('js/batch_select.js',)
+
+    def __init__(self, product_field, attrs=None):
+        super().__init__(attrs)
+        self.attrs.update({'data-batches-url': reverse_lazy('api_finished_goods'), 'data-product-field': product_field})
+
 # Форма для отгрузки
 class ShipmentForm(forms.ModelForm):
+    product = SearchModelChoiceField(
+        'product', label='Продукт', error_messages={'required': 'Это поле обязательно.'}
+    )  # Выбор продукта поиском
+    counterparty = SearchModelChoiceField(
+        'counterparty', label='Контрагент', error_messages={'required': 'Это поле обязательно.'}
+    )  # Выбор контрагента поиском
+
     class Meta:
         model = Shipment  # Используем модель Shipment
         fields = ['product', 'batch', 'quantity', 'shipment_date', 'counterparty']  # Поля формы
         labels = {
-            'product': 'Продукт',  # Метка для продукта
             'batch': 'Партия',  # Метка для партии
             'quantity': 'Количество',  # Метка для количества
             'shipment_date': 'Дата отгрузки',  # Метка для даты отгрузки
-            'counterparty': 'Контрагент',  # Метка для контрагента
         }
         widgets = {
-            'product': forms.Select(attrs={'class': 'form-control', 'onchange': 'this.form.submit()'}),  # Виджет для выбора продукта с автоматической отправкой формы
-            'batch': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора партии
+            'batch': ProductBatchSelect('id_product', attrs={'class': 'form-control'}),  # Партии выбранного продукта
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'min': '1'}),  # Виджет для ввода количества
             'shipment_date': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),  # Виджет для выбора даты
-            'counterparty': forms.Select(attrs={'class': 'form-control'}),  # Виджет для выбора контрагента
         }
         error_messages = {
-            'product': {
-                'required': 'Это поле обязательно.',  # Сообщение об ошибке для продукта
-            },
             'batch': {
                 'required': 'Это поле обязательно.',  # Сообщение об ошибке для партии
+                'invalid_choice': 'Выберите открытую партию выбранного продукта.',  # Партия другого продукта или закрыта
             },
             'quantity': {
                 'required': 'Это поле обязательно.',  # Сообщение об ошибке для количества
@@ -177,31 +215,38 @@ class ShipmentForm(forms.ModelForm):
                 'required': 'Это поле обязательно.',  # Сообщение об ошибке для даты отгрузки
                 'invalid': 'Введите правильную дату.',  # Сообщение об ошибке для неправильного формата даты
             },
-            'counterparty': {
-                'required': 'Это поле обязательно.',  # Сообщение об ошибке для контрагента
-            },
         }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Инициализация выборок для продуктов и контрагентов
-        self.fields['product'].queryset = Product.objects.all()
-        self.fields['counterparty'].queryset = Counterparty.objects.all()
-
-        # Обновление списка партий в зависимости от выбранного продукта
-        if 'product' in self.data:
-            try:
-                product_id = int(self.data.get('product'))
-                self.fields['batch'].queryset = Batch.objects.filter(product_id=product_id, quantity__gt=0, is_used=False)
-            except (ValueError, TypeError):
-                self.fields['batch'].queryset = Batch.objects.none()
-        else:
-            self.fields['batch'].queryset = Batch.objects.none()
+
+        # Партию можно не выбирать: тогда она подбирается автоматически по FIFO или FEFO
+        self.fields['batch'].required = False
+        self.fields['batch'].empty_label = 'Подобрать автоматически'
+        # В списке только открытые партии выбранного продукта: без продукта список пуст,
+        # а партия другого продукта не пройдёт проверку выбора
+        product = self['product'].value()
+        batches = Batch.objects.filter(
+            finished_goods__quantity__gt=0, finished_goods__is_used=False
+        ).distinct().order_by('pk')
+        self.fields['batch'].queryset = (
+            batches.filter(product_id=product) if str(product).isdigit() else batches.none()
+        )
+        self.fields['batch'].label_from_instance = lambda batch: batch.batch_number
 
         # Устанавливаем текущую дату по умолчанию для новой записи
         if not self.instance.pk:  # Если это новая запись
             self.fields['shipment_date'].initial = date.today()
 
+    def clean(self):
+        cleaned_data = super().clean()
+        product = cleaned_data.get('product')
+        batch = cleaned_data.get('batch')
+
+        if batch is not None and product is not None and batch.product_id != product.pk:
+            self.add_error('batch', 'Партия относится к другому продукту.')
+        return cleaned_data
+
 # Форма для контрагента
 class CounterpartyForm(forms.ModelForm):
     class Meta:
@@ -221,4 +266,22 @@ class CounterpartyForm(forms.ModelForm):
             'name': forms.TextInput(attrs={'class': 'form-control'}),  # Виджет для имени контрагента
             'address': forms.TextInput(attrs={'class': 'form-control'}),  # Виджет для адреса контрагента
             'contact_number': forms.TextInput(attrs={'class': 'form-control'}),  # Виджет для контактного номера
-        }
\ No newline at end of file
+        }
+
+# Форма загрузки справочника из CSV-файла
+class MasterDataImportForm(forms.Form):
+    kind = forms.ChoiceField(
+        choices=IMPORT_KIND_CHOICES,
+        label='Справочник',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+    file = forms.FileField(label='CSV-файл (UTF-8, первая строка — заголовок)')
+    delimiter = forms.ChoiceField(
+        choices=((';', 'Точка с запятой'), (',', 'Запятая'), ('tab', 'Табуляция')),
+        label='Разделитель',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+
+    def clean_delimiter(self):
+        delimiter = self.cleaned_data['delimiter']
+        return '\t' if delimiter == 'tab' else delimiter
@@ -0,0 +1,28 @@
+from django.core.exceptions import ValidationError
+
+GTIN_LENGTHS = (8, 12, 13, 14)
+
+
+def gtin_check_digit(digits):
+    """Контрольная цифра GTIN для кода без неё"""
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(digits)))
+    return str(-total % 10)
+
+
+def normalize_gtin(code):
+    """Проверяет GTIN-8/12/13/14 и приводит его к 14 цифрам, как в уникальном индексе"""
+    code = code.strip()
+    if not (code.isascii() and code.isdigit()) or len(code) not in GTIN_LENGTHS:
+        raise ValidationError(f'GTIN «{code}» должен состоять из 8, 12, 13 или 14 цифр.')
+    if gtin_check_digit(code[:-1]) != code[-1]:
+        raise ValidationError(f'Неверная контрольная цифра GTIN «{code}».')
+    return code.zfill(14)
+
+
+def validate_gtin(value):
+    """Валидатор поля Product.gtin: код должен читаться сканером.
+
+    Уникальный индекс сравнивает коды, дополненные нулями до 14 символов, и более длинные
+    значения обрезал бы, поэтому в поле допускаются только настоящие GTIN.
+    """
+    normalize_gtin(value)
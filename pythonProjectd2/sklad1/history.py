@@ -0,0 +1,58 @@
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import DailyFinishedGoodsBalance, DailyMaterialBalance, StockMovement
+
+# Таблицы истории: журнал движений и остатки закрытых дней не изменяются и не удаляются
+HISTORY_MODELS = (StockMovement, DailyMaterialBalance, DailyFinishedGoodsBalance)
+
+# Параметр сеанса, которым purge_history разрешает удаление в своей транзакции
+PURGE_SETTING = 'sklad1.purge_history'
+
+GUARD_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION sklad1_history_guard() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' AND coalesce(current_setting('{PURGE_SETTING}', true), '') = 'on' THEN
+        RETURN OLD;
+    END IF;
+    RAISE EXCEPTION 'Записи таблицы % нельзя изменять или удалять', TG_TABLE_NAME
+        USING ERRCODE = 'restrict_violation';
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def install_history_guard(using_connection):
+    """Создаёт на PostgreSQL триггеры, запрещающие UPDATE и DELETE строк истории.
+
+    Методы save() и delete() моделей не вызываются при QuerySet.update() и QuerySet.delete(),
+    поэтому неизменяемость истории обеспечивает сама база.
+    """
+    if using_connection.vendor != 'postgresql':
+        return
+    with using_connection.cursor() as cursor:
+        cursor.execute(GUARD_FUNCTION)
+        for model in HISTORY_MODELS:
+            table = using_connection.ops.quote_name(model._meta.db_table)
+            trigger = f'{model._meta.db_table}_guard'
+            cursor.execute(f'DROP TRIGGER IF EXISTS {trigger} ON {table}')
+            cursor.execute(
+                f'CREATE TRIGGER {trigger} BEFORE UPDATE OR DELETE ON {table} '
+                f'FOR EACH ROW EXECUTE FUNCTION sklad1_history_guard()'
+            )
+
+
+def purge_history(materials, products):
+    """Удаляет журнал движений и остатки закрытых дней материалов и продуктов.
+
+    Только для сгенерированных данных (seed_warehouse, стресс-тесты, замеры), которые
+    иначе нельзя удалить: ссылки на историю защищены от удаления (PROTECT).
+    materials и products — queryset или списки объектов.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT set_config(%s, %s, true)', [PURGE_SETTING, 'on'])
+        StockMovement.objects.filter(Q(material__in=materials) | Q(finished_goods__product__in=products)).delete()
+        DailyMaterialBalance.objects.filter(material__in=materials).delete()
+        DailyFinishedGoodsBalance.objects.filter(product__in=products).delete()
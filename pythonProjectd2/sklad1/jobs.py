@@ -0,0 +1,239 @@
+import logging
+import tempfile
+import threading
+import traceback
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .exports import EXPORT_CHUNK_SIZE, EXPORTS, csv_lines
+from .masterdata import import_masterdata
+from .models import Job
+from .services import close_day, days_to_close, rebuild_rollups
+
+logger = logging.getLogger('sklad1.jobs')
+
+JobType = namedtuple('JobType', 'title handler')
+
+# Виды задач: обработчик получает Job и возвращает итог (словарь для Job.result) или None
+JOBS = {}
+
+
+def job_type(kind, title):
+    """Регистрирует обработчик задачи вида kind"""
+    def register(handler):
+        JOBS[kind] = JobType(title, handler)
+        return handler
+    return register
+
+
+def enqueue(kind, params=None, user=None, input_file=None):
+    """Ставит задачу в очередь; input_file — загруженный файл, который понадобится обработчику"""
+    if kind not in JOBS:
+        raise ValueError(f'Неизвестный вид задачи: {kind}')
+    job = Job(
+        kind=kind, params=params or {}, max_attempts=settings.JOB_MAX_ATTEMPTS,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    return job
+
+
+def set_progress(job, done, total=100, message=''):
+    """Запоминает ход выполнения; в базу его записывает поток сигнала исполнителя.
+
+    Запись идёт отдельным соединением, поэтому ход виден на странице задачи, даже если
+    обработчик работает внутри одной долгой транзакции.
+    """
+    job.progress = min(100, done * 100 // total) if total else 100
+    if message:
+        job.progress_message = message[:255]
+
+
+class _Heartbeat(threading.Thread):
+    """Периодически отмечает задачу как живую и записывает её ход"""
+
+    def __init__(self, job):
+        super().__init__(name=f'job-{job.pk}-heartbeat', daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.JOB_HEARTBEAT):
+                _current(self.job).update(
+                    progress=self.job.progress, progress_message=self.job.progress_message, heartbeat_at=timezone.now()
+                )
+        except DatabaseError:
+            logger.exception('Не удалось записать сигнал задачи %s', self.job.pk)
+        finally:
+            connection.close()  # Соединение этого потока
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _current(job):
+    """Задача в той попытке, которую выполняет этот исполнитель (брошенную задачу мог забрать другой)"""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, attempts=job.attempts, worker=job.worker)
+
+
+def claim(worker):
+    """Забирает следующую готовую задачу или возвращает None.
+
+    SKIP LOCKED пропускает строки, которые в этот момент забирают другие исполнители,
+    поэтому исполнители не ждут друг друга и не получают одну задачу дважды.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.worker = worker
+        job.started_at = job.heartbeat_at = now
+        job.progress = 0
+        job.progress_message = ''
+        job.save(update_fields=[
+            'status', 'attempts', 'worker', 'started_at', 'heartbeat_at', 'progress', 'progress_message',
+        ])
+    return job
+
+
+def run(job):
+    """Выполняет задачу; при ошибке возвращает её в очередь с отсрочкой или отмечает неудачной"""
+    handler = JOBS.get(job.kind)
+    heartbeat = _Heartbeat(job)
+    heartbeat.start()
+    try:
+        if handler is None:
+            raise ValidationError(f'Неизвестный вид задачи: {job.kind}.')
+        result = handler.handler(job)
+    except Exception as e:
+        heartbeat.stop()
+        _fail(job, e)
+        return
+    heartbeat.stop()
+    _current(job).update(
+        status=Job.DONE, progress=100, progress_message=job.progress_message, result=result,
+        result_file=job.result_file.name or '', error='', finished_at=timezone.now(),
+    )
+    logger.info('Задача %s (%s) выполнена за попыток: %s', job.pk, job.kind, job.attempts)
+
+
+def _fail(job, error):
+    # Ошибка в данных (ValidationError) повторной попыткой не исправится
+    permanent = isinstance(error, ValidationError) or job.attempts >= job.max_attempts
+    message = ' '.join(error.messages) if isinstance(error, ValidationError) else traceback.format_exc()
+    fields = {'error': message, 'result': job.result, 'progress_message': job.progress_message}
+    if permanent:
+        fields.update(status=Job.FAILED, finished_at=timezone.now())
+        logger.error('Задача %s (%s) завершилась ошибкой: %s', job.pk, job.kind, message)
+    else:
+        delay = settings.JOB_RETRY_DELAY * 2 ** (job.attempts - 1)
+        fields.update(status=Job.QUEUED, run_after=timezone.now() + timedelta(seconds=delay))
+        logger.warning('Задача %s (%s), попытка %s: %s; повтор через %s с', job.pk, job.kind, job.attempts, message, delay)
+    _current(job).update(**fields)
+
+
+def requeue_stale():
+    """Возвращает в очередь задачи, исполнитель которых перестал подавать сигнал (процесс упал или был убит)"""
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=now - timedelta(seconds=settings.JOB_STALE_AFTER))
+    message = 'Исполнитель перестал отвечать.'
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(status=Job.QUEUED, run_after=now, error=message)
+    failed = stale.update(status=Job.FAILED, finished_at=now, error=message)
+    if requeued or failed:
+        logger.warning('Брошенные задачи: возвращено в очередь %s, отмечено неудачными %s', requeued, failed)
+
+
+def work(worker, stop, poll=1.0, once=False):
+    """Цикл исполнителя: забирает и выполняет задачи, пока не установлен stop.
+
+    once — завершиться, как только очередь опустеет.
+    """
+    try:
+        while not stop.is_set():
+            try:
+                job = claim(worker)
+                if job is None:
+                    if once:
+                        return
+                    requeue_stale()
+                    stop.wait(poll)
+                    continue
+                run(job)
+            except DatabaseError:
+                logger.exception('Исполнитель %s потерял соединение с базой', worker)
+                connection.close()  # Следующая итерация откроет новое соединение
+                stop.wait(poll)
+    finally:
+        connection.close()
+
+
+@job_type('export', 'Выгрузка в CSV')
+def export_job(job):
+    """Формирует CSV-файл выгрузки из EXPORTS (params: export, filters)"""
+    export = EXPORTS[job.params['export']]
+    rows = export.rows(job.params.get('filters', {}))
+    total = rows.count()
+
+    def counted():
+        for done, row in enumerate(rows.iterator(chunk_size=EXPORT_CHUNK_SIZE), 1):
+            if done % EXPORT_CHUNK_SIZE == 0:
+                set_progress(job, done, total, f'Выгружено строк: {done} из {total}')
+            yield row
+
+    with tempfile.TemporaryFile() as output:
+        for line in csv_lines(export.header, counted(), export.total_column):
+            output.write(line.encode('utf-8'))
+        output.seek(0)
+        job.result_file.save(export.filename, File(output), save=False)
+    set_progress(job, total, total, f'Выгружено строк: {total}')
+    return {'rows': total, 'filename': export.filename}
+
+
+@job_type('rebuild_rollups', 'Пересчёт итогов производства и отгрузок')
+def rebuild_rollups_job(job):
+    set_progress(job, 0, message='Пересчёт итогов')
+    rebuild_rollups()
+    return None
+
+
+@job_type('close_period', 'Закрытие дней')
+def close_period_job(job):
+    """Закрывает все незакрытые дни по порядку, как manage.py close_period"""
+    days = days_to_close()
+    closed = []
+    for done, day in enumerate(days):
+        set_progress(job, done, len(days), f'Закрытие {day:%d.%m.%Y}')
+        close_day(day)
+        closed.append(day.isoformat())
+    return {'days': closed}
+
+
+@job_type('import_masterdata', 'Загрузка справочника из CSV')
+def import_masterdata_job(job):
+    """Загружает справочник из сохранённого файла (params: kind, delimiter)"""
+    set_progress(job, 0, message='Загрузка файла')
+    with job.input_file.open('rb') as file:
+        result = import_masterdata(job.params['kind'], file, job.params['delimiter'])
+    if not result.ok:
+        job.result = {'rows': result.rows, 'errors': result.errors}
+        raise ValidationError(f'Импорт отменён, ошибок: {len(result.errors)}.')
+    return {'rows': result.rows}
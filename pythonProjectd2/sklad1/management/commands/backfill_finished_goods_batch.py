@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery
+
+from sklad1.models import Batch, FinishedGoodsStock
+
+
+class Command(BaseCommand):
+    help = 'Заполняет ссылку на партию у остатков готовой продукции по номеру партии'
+
+    def handle(self, *args, **options):
+        # Один UPDATE с подзапросом по уникальному номеру партии
+        updated = FinishedGoodsStock.objects.filter(batch__isnull=True).update(
+            batch=Subquery(Batch.objects.filter(batch_number=OuterRef('batch_number')).values('pk')[:1])
+        )
+        orphans = FinishedGoodsStock.objects.filter(batch__isnull=True).count()
+        self.stdout.write(self.style.SUCCESS(f'Обновлено остатков: {updated}.'))
+        if orphans:
+            self.stdout.write(self.style.WARNING(f'Без партии осталось остатков: {orphans}.'))
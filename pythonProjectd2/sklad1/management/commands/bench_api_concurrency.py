@@ -0,0 +1,99 @@
+import http.client
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_TARGETS = [
+    'wsgi=http://127.0.0.1:8000/api/stock/',
+    'asgi=http://127.0.0.1:8001/api/stock/',
+]
+
+
+def _worker(url, cookie, count):
+    """Выполняет count запросов по одному постоянному соединению и возвращает задержки"""
+    parts = urlsplit(url)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parts.netloc, timeout=60)
+    latencies, errors = [], 0
+    try:
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers={'Cookie': cookie})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()  # Следующий запрос откроет новое соединение
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return latencies, errors
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность JSON-эндпоинтов при множестве одновременных соединений '
+            'под WSGI и ASGI. Серверы запускаются отдельно, например: '
+            '"gunicorn AisbergWater1.wsgi -w 4 -b :8000" и "uvicorn AisbergWater1.asgi:application --workers 4 --port 8001"')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', action='append', dest='targets',
+                            help='Метка и адрес в виде метка=URL (можно указать несколько раз)')
+        parser.add_argument('--concurrency', type=int, default=100, help='Количество одновременных соединений')
+        parser.add_argument('--requests', type=int, default=5000, help='Количество запросов на каждый адрес')
+        parser.add_argument('--username', required=True, help='Пользователь, от имени которого выполняются запросы')
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets'] or DEFAULT_TARGETS:
+            label, sep, url = target.partition('=')
+            if not sep or not url.startswith(('http://', 'https://')):
+                raise CommandError(f'Некорректный адрес "{target}", ожидается метка=URL.')
+            targets.append((label, url))
+
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'Пользователь {options["username"]} не найден.')
+
+        # Сессия создаётся напрямую, чтобы не проходить форму входа с CSRF
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+        concurrency = options['concurrency']
+        per_worker = max(options['requests'] // concurrency, 1)
+        try:
+            self.stdout.write(f'{"Метка":<10} {"Запросов/с":>11} {"p50, мс":>9} {"p95, мс":>9} {"p99, мс":>9} {"Ошибок":>7}')
+            for label, url in targets:
+                _worker(url, cookie, 1)  # Прогрев: первое соединение и загрузка приложения сервером
+                started = time.perf_counter()
+                with ThreadPoolExecutor(concurrency) as pool:
+                    results = list(pool.map(lambda _: _worker(url, cookie, per_worker), range(concurrency)))
+                elapsed = time.perf_counter() - started
+
+                latencies = sorted(latency for result, _ in results for latency in result)
+                errors = sum(errors for _, errors in results)
+                if len(latencies) < 2:
+                    self.stdout.write(f'{label:<10} нет успешных ответов, ошибок: {errors}')
+                    continue
+                quantiles = statistics.quantiles(latencies, n=100)
+                self.stdout.write(
+                    f'{label:<10} {len(latencies) / elapsed:>11.1f} {quantiles[49] * 1000:>9.1f} '
+                    f'{quantiles[94] * 1000:>9.1f} {quantiles[98] * 1000:>9.1f} {errors:>7}'
+                )
+        finally:
+            session.delete()
@@ -0,0 +1,88 @@
+import copy
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.utils import load_backend
+
+from sklad1.models import Stock
+
+POOL_BACKEND = 'AisbergWater1.postgresql_pool'
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает стоимость установки соединения и задержку типичного запроса страницы к PostgreSQL '
+            'с пулом соединений и без него')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Количество имитируемых запросов на режим')
+        parser.add_argument('--concurrency', type=int, default=4, help='Количество одновременных потоков')
+        parser.add_argument('--pool-size', type=int, default=4, help='Максимальный размер пула в режиме с пулом')
+
+    def handle(self, *args, **options):
+        settings_dict = connections['default'].settings_dict
+        if connections['default'].vendor != 'postgresql':
+            raise CommandError('Бенчмарк пула соединений поддерживается только для PostgreSQL.')
+
+        direct = copy.deepcopy(settings_dict)
+        direct['ENGINE'] = 'django.db.backends.postgresql'
+        direct['CONN_MAX_AGE'] = 0
+        direct['OPTIONS'].pop('pool', None)
+
+        pooled = copy.deepcopy(settings_dict)
+        pooled['ENGINE'] = POOL_BACKEND
+        pooled['CONN_MAX_AGE'] = 0
+        pooled['OPTIONS']['pool'] = {
+            **settings_dict['OPTIONS'].get('pool', {}),
+            'min_size': min(options['concurrency'], options['pool_size']),
+            'max_size': options['pool_size'],
+        }
+
+        # Запрос, который выполняет страница остатков материалов
+        sql, params = Stock.objects.select_related('material').order_by('pk')[:50].query.sql_with_params()
+
+        self.stdout.write(f'{"Режим":<10} {"Подключение p50/p95, мс":>24} {"Запрос p50/p95, мс":>20} {"Запросов/с":>11}')
+        try:
+            for label, mode_settings in (('без пула', direct), ('с пулом', pooled)):
+                setup, total, elapsed = self.run_mode(label, mode_settings, sql, params, options)
+                self.stdout.write(
+                    f'{label:<10} {self.percentiles(setup):>24} {self.percentiles(total):>20} '
+                    f'{len(total) / elapsed:>11.1f}'
+                )
+        finally:
+            load_backend(POOL_BACKEND).DatabaseWrapper.close_pools()
+
+    def run_mode(self, label, settings_dict, sql, params, options):
+        backend = load_backend(settings_dict['ENGINE'])
+        local = threading.local()
+        alias = f'bench_{label}'
+
+        def request(_):
+            # Каждый поток держит свою обёртку, как рабочий поток сервера
+            if not hasattr(local, 'wrapper'):
+                local.wrapper = backend.DatabaseWrapper(copy.deepcopy(settings_dict), alias)
+            wrapper = local.wrapper
+            started = time.perf_counter()
+            wrapper.ensure_connection()
+            connected = time.perf_counter()
+            with wrapper.cursor() as cursor:
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            wrapper.close()  # Конец запроса: соединение закрывается или возвращается в пул
+            return connected - started, time.perf_counter() - started
+
+        # Прогрев: открытие пула и первое соединение не входят в замер
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            list(pool.map(request, range(options['concurrency'])))
+            started = time.perf_counter()
+            results = list(pool.map(request, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+        return [setup for setup, _ in results], [total for _, total in results], elapsed
+
+    @staticmethod
+    def percentiles(values):
+        quantiles = statistics.quantiles(values, n=100)
+        return f'{quantiles[49] * 1000:.2f} / {quantiles[94] * 1000:.2f}'
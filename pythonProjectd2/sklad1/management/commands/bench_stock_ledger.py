@@ -0,0 +1,75 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sklad1.history import purge_history
+from sklad1.models import Material, StockBalanceSnapshot, StockMovement
+from sklad1.services import balance_as_of
+
+BENCH_MATERIAL = '__ledger_benchmark__'
+START = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = 'Измеряет время запроса остатка на дату по мере роста журнала движений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Размеры журнала через запятую, на которых выполняются замеры')
+        parser.add_argument('--snapshot-every', type=int, default=10000, help='Движений между контрольными точками')
+        parser.add_argument('--queries', type=int, default=200, help='Запросов остатка на каждый замер')
+        parser.add_argument('--keep', action='store_true', help='Не удалять сгенерированные данные')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        snapshot_every = options['snapshot_every']
+
+        purge_history(Material.objects.filter(name=BENCH_MATERIAL), [])
+        Material.objects.filter(name=BENCH_MATERIAL).delete()
+        material = Material.objects.create(name=BENCH_MATERIAL, unit='pcs')
+        written = 0
+        try:
+            for size in sizes:
+                # Каждое движение +1 шт. с шагом в минуту, контрольная точка каждые snapshot_every движений
+                while written < size:
+                    chunk = min(snapshot_every - written % snapshot_every, size - written)
+                    created = StockMovement.objects.bulk_create([
+                        StockMovement(
+                            kind=StockMovement.RECEIPT,
+                            material=material,
+                            quantity=1,
+                            created_at=START + timedelta(minutes=written + i),
+                        )
+                        for i in range(chunk)
+                    ], batch_size=5000)
+                    written += chunk
+                    if written % snapshot_every == 0:
+                        StockBalanceSnapshot.objects.create(
+                            material=material,
+                            quantity=written,
+                            taken_at=created[-1].created_at,
+                            last_movement_id=created[-1].pk,
+                        )
+
+                timings = []
+                for _ in range(options['queries']):
+                    minute = random.randrange(written)
+                    started = time.perf_counter()
+                    balance = balance_as_of(START + timedelta(minutes=minute), material=material)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if balance != Decimal(minute + 1):
+                        raise CommandError(f'Неверный остаток на минуту {minute}: {balance}')
+
+                timings.sort()
+                self.stdout.write(
+                    f'{written:>12} движений: медиана {statistics.median(timings):.2f} мс, '
+                    f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} мс'
+                )
+        finally:
+            if not options['keep']:
+                purge_history([material], [])
+                material.delete()
@@ -0,0 +1,211 @@
+import json
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from sklad1.models import Batch, Counterparty, FinishedGoodsStock, Product, Shipment, StockMovement
+
+BENCH_USER = '__bench_views__'
+
+
+class Command(BaseCommand):
+    help = ('Прогоняет реальные представления через тестовый клиент Django и сохраняет в JSON '
+            'перцентили задержки и количество SQL-запросов по каждому представлению. '
+            'Изменения, сделанные POST-запросами, откатываются. Данные можно создать командой seed_warehouse')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30, help='Запросов на каждое представление')
+        parser.add_argument('--output', default='bench_views.json', help='Файл для сохранения результатов')
+        parser.add_argument('--compare', help='Файл с результатами предыдущего прогона для сравнения')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост медианы задержки при сравнении (0.2 = 20%%)')
+        parser.add_argument('--cold-cache', action='store_true', help='Очищать кэш Django перед каждым запросом')
+        parser.add_argument('--only', help='Имена сценариев через запятую')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('Нужно не меньше двух запросов на представление.')
+
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            user, _ = get_user_model().objects.get_or_create(
+                username=BENCH_USER, defaults={'role': 'finished_goods_warehouse_manager'}  # Роль из CustomUser.ROLE_CHOICES
+            )
+            client = Client()
+            client.force_login(user)
+
+            scenarios = self.scenarios()
+            if options['only']:
+                names = options['only'].split(',')
+                unknown = set(names) - {name for name, *_ in scenarios}
+                if unknown:
+                    raise CommandError(f'Неизвестные сценарии: {", ".join(sorted(unknown))}.')
+                scenarios = [scenario for scenario in scenarios if scenario[0] in names]
+
+            results = {}
+            for name, method, url, data in scenarios:
+                results[name] = self.measure(client, method, url, data, options)
+                summary = results[name]
+                self.stdout.write(
+                    f'{name:<32} p50 {summary["p50_ms"]:>8.2f} мс  p95 {summary["p95_ms"]:>8.2f} мс  '
+                    f'запросов {summary["queries_max"]:>4}  статусы {",".join(map(str, summary["statuses"]))}'
+                )
+            transaction.set_rollback(True)  # Выпуски и отгрузки, созданные замерами, не сохраняются
+
+        report = {'meta': self.meta(options), 'views': results}
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Результаты сохранены в {options["output"]}.'))
+
+        if options['compare']:
+            self.compare(options['compare'], results, options['threshold'])
+
+    def scenarios(self):
+        """Сценарии: (имя, метод, адрес, функция данных POST-запроса или None)"""
+        today = timezone.now().date()
+        period = {'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat()}
+        product_id = (
+            FinishedGoodsStock.objects.filter(quantity__gt=0).order_by('pk').values_list('product_id', flat=True).first()
+        )
+        counterparty = Counterparty.objects.order_by('pk').first()
+
+        # Каждый POST берёт следующую партию, чтобы не выпускать и не отгружать одно и то же
+        pending = iter(Batch.objects.filter(quantity=0, is_used=False).values_list('pk', flat=True)[:10000])
+        available = iter(
+            FinishedGoodsStock.objects.filter(quantity__gte=1, is_used=False, batch__isnull=False)
+            .values_list('batch_id', 'product_id')[:10000]
+        )
+
+        def release_data():
+            batch_id = next(pending, None)
+            return None if batch_id is None else {'batch': batch_id, 'quantity': '10'}
+
+        def shipment_data():
+            row = next(available, None)
+            if row is None or counterparty is None:
+                return None
+            batch_id, product_id = row
+            return {
+                'product': product_id, 'batch': batch_id, 'quantity': '1',
+                'shipment_date': today.isoformat(), 'counterparty': counterparty.pk,
+            }
+
+        reads = [
+            ('home', 'get', reverse('home'), None),
+            ('production', 'get', reverse('production'), None),
+            ('batch_list', 'get', reverse('batch_list'), None),
+            ('batch_list (период)', 'get', f'{reverse("batch_list")}?start_date={period["start_date"]}&end_date={period["end_date"]}', None),
+            ('product_list', 'get', reverse('product_list'), None),
+            ('material_list', 'get', reverse('material_list'), None),
+            ('product_material_list', 'get', reverse('product_material_list'), None),
+            ('view_stock', 'get', reverse('view_stock'), None),
+            ('view_and_edit_stock', 'get', reverse('view_and_edit_stock'), None),
+            ('check_incoming', 'get', reverse('check_incoming'), None),
+            ('finished_goods_stock_list', 'get', reverse('finished_goods_stock_list'), None),
+            ('view_shipments', 'get', reverse('view_shipments'), None),
+            ('view_shipments (период)', 'get', f'{reverse("view_shipments")}?start_date={period["start_date"]}&end_date={period["end_date"]}', None),
+            ('rollup_report', 'get', reverse('rollup_report'), None),
+            ('release_products (форма)', 'get', reverse('release_products'), None),
+            ('create_shipment (форма)', 'get', reverse('create_shipment'), None),
+            ('api_stock', 'get', reverse('api_stock'), None),
+            ('api_open_batches', 'get', reverse('api_open_batches'), None),
+        ]
+        if product_id is not None:
+            reads.append(('create_shipment (продукт)', 'get', f'{reverse("create_shipment")}?product={product_id}', None))
+        writes = [
+            ('release_products', 'post', reverse('release_products'), release_data),
+            ('create_shipment', 'post', reverse('create_shipment'), shipment_data),
+        ]
+        return reads + writes
+
+    def measure(self, client, method, url, data, options):
+        latencies, queries, statuses = [], [], set()
+        for i in range(options['iterations'] + 1):
+            payload = data() if data else None
+            if data and payload is None:
+                break  # Закончились партии для выпуска или отгрузки
+            if options['cold_cache']:
+                cache.clear()
+            connection.queries_log.clear()  # Журнал запросов ограничен 9000 записями, иначе счётчик обнулится
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, method)(url, payload)
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            if i == 0:
+                continue  # Первый запрос прогревает шаблоны и кэши
+            latencies.append(elapsed * 1000)
+            queries.append(len(captured))
+            statuses.add(response.status_code)
+
+        if len(latencies) < 2:
+            return {'url': url, 'method': method.upper(), 'requests': len(latencies), 'p50_ms': 0, 'p95_ms': 0,
+                    'p99_ms': 0, 'mean_ms': 0, 'queries_min': 0, 'queries_max': 0, 'statuses': sorted(statuses)}
+        quantiles = statistics.quantiles(latencies, n=100)
+        return {
+            'url': url,
+            'method': method.upper(),
+            'requests': len(latencies),
+            'p50_ms': round(quantiles[49], 3),
+            'p95_ms': round(quantiles[94], 3),
+            'p99_ms': round(quantiles[98], 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_min': min(queries),
+            'queries_max': max(queries),
+            'statuses': sorted(statuses),
+        }
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'cold_cache': options['cold_cache'],
+            'rows': {
+                model.__name__: model.objects.count()
+                for model in (Product, Batch, FinishedGoodsStock, Shipment, StockMovement)
+            },
+        }
+
+    def compare(self, path, results, threshold):
+        try:
+            with open(path, encoding='utf-8') as file:
+                previous = json.load(file)['views']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+        regressions = []
+        self.stdout.write(f'\nСравнение с {path}:')
+        for name, current in results.items():
+            before = previous.get(name)
+            if before is None or not before['p50_ms']:
+                continue
+            change = current['p50_ms'] / before['p50_ms'] - 1
+            queries = current['queries_max'] - before['queries_max']
+            regressed = change > threshold or queries > 0
+            self.stdout.write(
+                f'{"РЕГРЕССИЯ " if regressed else "          "}{name:<32} p50 {change:+.0%}  запросов {queries:+d}'
+            )
+            if regressed:
+                regressions.append(name)
+        if regressions:
+            raise CommandError(f'Регрессии: {", ".join(regressions)}.')
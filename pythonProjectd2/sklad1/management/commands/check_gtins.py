@@ -0,0 +1,59 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from sklad1.gtin import validate_gtin
+from sklad1.models import Product
+from sklad1.reference import invalidate_reference
+from sklad1.scanning import gtin_conflicts
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверяет GTIN продуктов перед созданием уникального индекса product_gtin_unique: '
+        'сообщает о неверных кодах и о кодах, совпадающих с точностью до ведущих нулей'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Оставить совпадающий GTIN продукту с наименьшим id, а остальным продуктам группы '
+                 'записать временное значение DUP-<id>, которое нужно заменить настоящим GTIN',
+        )
+
+    def handle(self, *args, **options):
+        invalid = []
+        for product in Product.objects.only('name', 'gtin').order_by('pk').iterator():
+            try:
+                validate_gtin(product.gtin)
+            except ValidationError:
+                invalid.append(product)
+        for product in invalid:
+            self.stdout.write(f'Неверный GTIN «{product.gtin}»: продукт {product.pk} «{product.name}»')
+
+        conflicts = gtin_conflicts()
+        for key, products in conflicts.items():
+            self.stdout.write(f'GTIN {key} совпадает у продуктов: ' + ', '.join(
+                f'{product.pk} «{product.name}» ({product.gtin})' for product in products
+            ))
+
+        if conflicts and options['fix']:
+            with transaction.atomic():
+                for products in conflicts.values():
+                    for product in products[1:]:
+                        # Не больше 14 символов, чтобы индекс не обрезал значение; GTIN таким быть не может
+                        Product.objects.filter(pk=product.pk).update(gtin=f'DUP-{product.pk}')
+                        self.stdout.write(f'Продукт {product.pk} «{product.name}»: GTIN заменён на DUP-{product.pk}')
+                invalidate_reference(Product)
+            self.stdout.write(self.style.SUCCESS(
+                'Совпадения устранены; укажите настоящие GTIN продуктов с кодом DUP-<id> в справочнике.'
+            ))
+        elif conflicts:
+            raise CommandError(
+                f'Совпадающих GTIN: {len(conflicts)}. Исправьте их в справочнике продуктов '
+                f'или запустите команду с --fix, затем выполните migrate.'
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Совпадающих GTIN нет; неверных кодов: {len(invalid)}.'
+            ))
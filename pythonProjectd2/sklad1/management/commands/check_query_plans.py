@@ -0,0 +1,89 @@
+import random
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from sklad1.models import Batch, Counterparty, Line, Product, Shipment
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу тестовым объёмом данных внутри откатываемой транзакции и проверяет через EXPLAIN, '
+            'что запросы списков партий и отгрузок используют индексы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000, help='Количество партий и отгрузок')
+        parser.add_argument('--products', type=int, default=200, help='Количество продуктов')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Проверка планов запросов поддерживается только для PostgreSQL.')
+
+        failures = []
+        with transaction.atomic():
+            product_id, start, end = self.seed(options['rows'], options['products'])
+
+            # Те же запросы, что выполняют представления и формы
+            querysets = {
+                'check_incoming / view_finished_goods_stock': Batch.objects.filter(quantity__gt=0, is_used=False),
+                'ShipmentForm': Batch.objects.filter(product_id=product_id, quantity__gt=0, is_used=False),
+                'ReleaseProductsForm': Batch.objects.filter(quantity=0, is_used=False).order_by('batch_number'),
+                'batch_list': Batch.objects.filter(production_date__range=[start, end]),
+                'batch_list (product)': Batch.objects.filter(production_date__range=[start, end], product_id=product_id),
+                'view_shipments': Shipment.objects.filter(shipment_date__range=[start, end]),
+            }
+            for name, queryset in querysets.items():
+                plan = queryset.explain()
+                uses_index = 'Index' in plan
+                self.stdout.write(f'{"OK  " if uses_index else "FAIL"} {name}')
+                if not uses_index:
+                    failures.append(name)
+                    self.stdout.write(plan)
+
+            transaction.set_rollback(True)  # Тестовые данные не сохраняются
+
+        if failures:
+            raise CommandError(f'Последовательное сканирование вместо индекса: {", ".join(failures)}.')
+        self.stdout.write(self.style.SUCCESS('Все запросы используют индексы.'))
+
+    def seed(self, rows, products):
+        """Создаёт данные с реалистичным распределением: почти все партии уже использованы"""
+        line = Line.objects.create(name='__query_plan_check__', volume=1, number=0)
+        product_ids = [
+            product.pk for product in Product.objects.bulk_create(
+                Product(name=f'plan-check-{i}', gtin=str(i), volume=1, line=line) for i in range(products)
+            )
+        ]
+        counterparty = Counterparty.objects.create(name='plan-check', address='-', contact_number='-')
+        first_day = date(2000, 1, 1)
+        days = 3650
+
+        batches = []
+        for i in range(rows):
+            state = random.random()
+            batches.append(Batch(
+                product_id=random.choice(product_ids),
+                line=line,
+                batch_number=f'plan-check-{i}',
+                production_date=first_day + timedelta(days=random.randrange(days)),
+                quantity=0 if state < 0.99 or state > 0.995 else 10,
+                is_used=state < 0.99,
+            ))
+        batches = Batch.objects.bulk_create(batches, batch_size=5000)
+        Shipment.objects.bulk_create((
+            Shipment(
+                product_id=batch.product_id,
+                batch=batch,
+                quantity=1,
+                shipment_date=batch.production_date,
+                counterparty=counterparty,
+            )
+            for batch in batches
+        ), batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Batch._meta.db_table}')
+            cursor.execute(f'ANALYZE {Shipment._meta.db_table}')
+
+        start = first_day + timedelta(days=days // 2)
+        return product_ids[0], start, start + timedelta(days=7)
@@ -0,0 +1,69 @@
+import time
+from datetime import date, datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from sklad1.services import close_day, days_to_close
+
+
+class Command(BaseCommand):
+    help = ('Закрывает дни: сохраняет остатки материалов и готовой продукции на конец дня в неизменяемые '
+            'снимки. Без параметров закрывает все незакрытые дни по вчерашний включительно; '
+            'с --schedule работает постоянно и закрывает каждый день в заданное время')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--day', type=date.fromisoformat, help='Закрыть один день (ГГГГ-ММ-ДД)')
+        parser.add_argument('--schedule', action='store_true', help='Закрывать дни по расписанию, не завершаясь')
+        parser.add_argument('--at', default='00:15', help='Время закрытия в режиме расписания, ЧЧ:ММ (по умолчанию 00:15)')
+
+    def handle(self, *args, **options):
+        if options['day']:
+            try:
+                self.close(options['day'])
+            except ValidationError as e:
+                raise CommandError(' '.join(e.messages))
+            return
+
+        if not options['schedule']:
+            self.catch_up()
+            return
+
+        try:
+            run_at = datetime.strptime(options['at'], '%H:%M').time()
+        except ValueError:
+            raise CommandError('Время закрытия указывается в формате ЧЧ:ММ.')
+        while True:
+            try:
+                self.catch_up()
+            except DatabaseError as e:
+                self.stderr.write(f'Не удалось закрыть дни, повтор при следующем запуске: {e}')
+            now = timezone.localtime()
+            next_run = timezone.make_aware(datetime.combine(now.date(), run_at))
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            self.stdout.write(f'Следующее закрытие: {next_run:%d.%m.%Y %H:%M}.')
+            connections.close_all()  # Соединение не держится открытым между запусками
+            time.sleep((next_run - now).total_seconds())
+
+    def catch_up(self):
+        """Закрывает пропущенные дни по порядку; ошибка одного дня не мешает следующим запускам"""
+        days = days_to_close()
+        if not days:
+            self.stdout.write('Незакрытых дней нет.')
+        for day in days:
+            try:
+                self.close(day)
+            except ValidationError as e:
+                self.stderr.write(' '.join(e.messages))
+                break  # Дни закрываются строго по порядку
+
+    def close(self, day):
+        started = time.perf_counter()
+        period = close_day(day)
+        self.stdout.write(self.style.SUCCESS(
+            f'День {day:%d.%m.%Y} закрыт за {time.perf_counter() - started:.2f} с: материалов {period.materials}, '
+            f'партий готовой продукции {period.finished_goods}.'
+        ))
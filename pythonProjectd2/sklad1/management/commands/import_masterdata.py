@@ -0,0 +1,45 @@
+import csv
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from sklad1.masterdata import IMPORT_COLUMNS, import_masterdata
+
+
+class Command(BaseCommand):
+    help = ('Загружает материалы, продукты, составы продуктов или начальные остатки из CSV-файла '
+            'через COPY одной транзакцией. Колонки файла: '
+            + '; '.join(f'{kind} — {",".join(columns)}' for kind, columns in IMPORT_COLUMNS.items()))
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=IMPORT_COLUMNS, help='Вид справочника')
+        parser.add_argument('path', help='Путь к CSV-файлу в кодировке UTF-8 с заголовком')
+        parser.add_argument('--delimiter', default=';', help='Разделитель колонок (по умолчанию ";")')
+        parser.add_argument('--errors-csv', help='Записать ошибки по строкам в CSV-файл')
+
+    def handle(self, *args, **options):
+        delimiter = '\t' if options['delimiter'] == '\\t' else options['delimiter']
+        started = time.perf_counter()
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_masterdata(options['kind'], file, delimiter)
+        except OSError as e:
+            raise CommandError(f'Не удалось открыть файл: {e}')
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+        elapsed = time.perf_counter() - started
+
+        if result.ok:
+            self.stdout.write(self.style.SUCCESS(f'Загружено строк: {result.rows} за {elapsed:.2f} с.'))
+            return
+
+        if options['errors_csv']:
+            with open(options['errors_csv'], 'w', newline='', encoding='utf-8-sig') as report:
+                writer = csv.writer(report, delimiter=';')
+                writer.writerow(['Строка', 'Ошибка'])
+                writer.writerows(result.errors)
+        else:
+            for row, message in result.errors:
+                self.stderr.write(f'Строка {row}: {message}' if row else message)
+        raise CommandError(f'Импорт отменён, ошибок: {len(result.errors)} (строк в файле: {result.rows}).')
@@ -0,0 +1,43 @@
+import csv
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sklad1.mrp import material_requirements
+
+
+class Command(BaseCommand):
+    help = 'Рассчитывает потребность в материалах и дефицит по плану производства из CSV (product;quantity;date)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('plan', help='CSV-файл с колонками product (id), quantity, date (ГГГГ-ММ-ДД)')
+        parser.add_argument('--all', action='store_true', help='Показывать все материалы, а не только дефицитные')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['plan'], encoding='utf-8-sig', newline='') as f:
+                plan = [
+                    (int(row['product']), Decimal(row['quantity']), date.fromisoformat(row['date']))
+                    for row in csv.DictReader(f, delimiter=';')
+                ]
+        except (OSError, KeyError, ValueError, ArithmeticError) as e:
+            raise CommandError(f'Не удалось прочитать план: {e}')
+
+        report = material_requirements(plan)
+        for day in report['days']:
+            materials = [m for m in day['materials'] if options['all'] or m['shortfall'] > 0]
+            if not materials:
+                continue
+            self.stdout.write(f'{day["date"]:%d.%m.%Y}')
+            for m in materials:
+                self.stdout.write(
+                    f'  {m["name"]}: потребность {m["demand"]}, нарастающим итогом {m["cumulative"]}, '
+                    f'остаток {m["stock"]}, дефицит {m["shortfall"]}'
+                )
+        if report['products_without_bom']:
+            self.stdout.write(self.style.WARNING(
+                f'Продукты без состава: {", ".join(map(str, report["products_without_bom"]))}'
+            ))
+        if not any(day['has_shortfall'] for day in report['days']):
+            self.stdout.write(self.style.SUCCESS('Материалов достаточно для выполнения плана.'))
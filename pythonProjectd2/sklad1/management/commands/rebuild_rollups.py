@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from sklad1.models import DailyProductionRollup, MonthlyShipmentRollup
+from sklad1.services import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает суточные итоги производства и месячные итоги отгрузок по исходным данным'
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(
+            f'Итоги пересчитаны: производство — {DailyProductionRollup.objects.count()} строк, '
+            f'отгрузки — {MonthlyShipmentRollup.objects.count()} строк.'
+        ))
@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sklad1.jobs import work
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди в базе (выгрузки, загрузку справочников, пересчёт итогов, '
+            'закрытие дней). Каждый процесс запускает несколько потоков-исполнителей; SIGTERM или Ctrl+C '
+            'дают исполнителям закончить текущие задачи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Количество процессов')
+        parser.add_argument('--threads', type=int, default=2, help='Потоков-исполнителей в каждом процессе')
+        parser.add_argument('--poll', type=float, default=1.0, help='Пауза при пустой очереди, в секундах')
+        parser.add_argument('--once', action='store_true', help='Завершиться, когда очередь опустеет')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['threads'] < 1:
+            raise CommandError('Нужен хотя бы один процесс и один поток.')
+        if options['processes'] == 1:
+            self.run_threads(options)
+        else:
+            self.run_processes(options)
+
+    def run_threads(self, options):
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        prefix = f'{socket.gethostname()}:{os.getpid()}'
+        threads = [
+            threading.Thread(
+                target=work, args=(f'{prefix}:{number}', stop, options['poll'], options['once']), name=f'worker-{number}',
+            )
+            for number in range(options['threads'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Исполнителей: {len(threads)} (процесс {os.getpid()}).')
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)  # join с таймаутом, чтобы главный поток получал Ctrl+C
+        except KeyboardInterrupt:
+            stop.set()
+            self.stdout.write('Остановка: исполнители заканчивают текущие задачи.')
+            for thread in threads:
+                thread.join()
+
+    def run_processes(self, options):
+        """Запускает процессы с потоками-исполнителями и останавливает их вместе с собой"""
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'run_workers',
+            '--threads', str(options['threads']), '--poll', str(options['poll']),
+        ] + (['--once'] if options['once'] else [])
+        workers = [subprocess.Popen(command) for _ in range(options['processes'])]
+
+        def terminate(signum=None, frame=None):
+            for worker in workers:
+                if worker.poll() is None:
+                    worker.terminate()  # SIGTERM: процесс дожидается текущих задач
+
+        signal.signal(signal.SIGTERM, terminate)
+        try:
+            for worker in workers:
+                worker.wait()
+        except KeyboardInterrupt:
+            terminate()  # Ctrl+C в терминале получают и сами процессы; повторный сигнал не мешает
+            for worker in workers:
+                worker.wait()
+        failed = [worker.pid for worker in workers if worker.returncode not in (0, -signal.SIGTERM)]
+        if failed:
+            raise CommandError(f'Процессы-исполнители завершились с ошибкой: {", ".join(map(str, failed))}.')
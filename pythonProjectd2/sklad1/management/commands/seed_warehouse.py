@@ -0,0 +1,240 @@
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from sklad1.bom import invalidate_bom
+from sklad1.gtin import gtin_check_digit
+from sklad1.caching import bump_stock_version
+from sklad1.history import purge_history
+from sklad1.models import (
+    Batch, BatchNumberSequence, Counterparty, FinishedGoodsStock, Line, Material, Product, ProductMaterial, Shipment,
+    ShipmentItem, Stock, StockMovement,
+)
+from sklad1.reference import invalidate_reference
+from sklad1.services import rebuild_rollups
+
+LINE_VOLUMES = (Decimal('0.50'), Decimal('1.50'), Decimal('5.00'), Decimal('19.00'))
+BULK_SIZE = 5000
+
+
+def _gtins(rng, count):
+    """GTIN-13 с верной контрольной цифрой, не занятые продуктами в базе"""
+    taken = {gtin.zfill(14) for gtin in Product.objects.values_list('gtin', flat=True)}
+    gtins = []
+    while len(gtins) < count:
+        base = str(rng.randrange(10 ** 11, 10 ** 12))
+        gtin = base + gtin_check_digit(base)
+        if gtin.zfill(14) not in taken:
+            taken.add(gtin.zfill(14))
+            gtins.append(gtin)
+    return gtins
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными: линии, продукты, материалы и составы, остатки, партии, '
+            'готовая продукция, отгрузки и контрагенты. Остатки согласованы с журналом движений, '
+            'итоги производства и отгрузок пересчитываются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prefix', default='seed', help='Префикс названий, по которому данные можно удалить')
+        parser.add_argument('--lines', type=int, default=5, help='Количество линий')
+        parser.add_argument('--products', type=int, default=200, help='Количество продуктов')
+        parser.add_argument('--materials', type=int, default=500, help='Количество материалов')
+        parser.add_argument('--bom-size', type=int, default=8, help='Материалов в составе одного продукта')
+        parser.add_argument('--counterparties', type=int, default=100, help='Количество контрагентов')
+        parser.add_argument('--batches', type=int, default=20000, help='Количество партий')
+        parser.add_argument('--released', type=float, default=0.9, help='Доля выпущенных партий')
+        parser.add_argument('--shipments', type=int, default=15000, help='Количество отгрузок')
+        parser.add_argument('--days', type=int, default=365, help='Глубина истории в днях')
+        parser.add_argument('--random-seed', type=int, default=None, help='Зерно генератора для воспроизводимости')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее созданные данные с этим префиксом')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        rng = random.Random(options['random_seed'])
+        if options['bom_size'] > options['materials']:
+            raise CommandError('Размер состава не может превышать количество материалов.')
+        if options['lines'] < 1 or options['products'] < 1:
+            raise CommandError('Нужна хотя бы одна линия и один продукт.')
+
+        started = time.perf_counter()
+        with transaction.atomic():
+            if options['clear']:
+                self.clear(prefix)
+            elif Line.objects.filter(name__startswith=f'{prefix} ').exists():
+                raise CommandError(f'Данные с префиксом "{prefix}" уже есть: укажите --clear или другой --prefix.')
+
+            lines, products = self.seed_products(prefix, rng, options)
+            materials, bom = self.seed_materials(prefix, rng, products, options)
+            counterparties = Counterparty.objects.bulk_create(
+                Counterparty(name=f'{prefix} контрагент {i}', address=f'ул. Складская, {i}', contact_number=f'+375{i:09d}')
+                for i in range(options['counterparties'])
+            )
+            released = self.seed_batches(rng, products, materials, bom, options)
+            self.seed_shipments(rng, released, counterparties, options)
+            rebuild_rollups()
+
+            # Данные созданы массовыми запросами без сигналов, поэтому кэши сбрасываются явно
+            bump_stock_version()
+        for model in (Line, Product, Material, Counterparty):
+            invalidate_reference(model)
+        invalidate_bom()
+
+        self.stdout.write(self.style.SUCCESS(f'Данные с префиксом "{prefix}" созданы за {time.perf_counter() - started:.1f} с.'))
+
+    def clear(self, prefix):
+        """Удаляет данные генератора; зависимые партии, остатки и отгрузки удаляются каскадно"""
+        purge_history(
+            Material.objects.filter(name__startswith=f'{prefix} '),
+            Product.objects.filter(line__name__startswith=f'{prefix} '),
+        )
+        Counterparty.objects.filter(name__startswith=f'{prefix} ').delete()
+        Line.objects.filter(name__startswith=f'{prefix} ').delete()
+        Material.objects.filter(name__startswith=f'{prefix} ').delete()
+
+    def seed_products(self, prefix, rng, options):
+        lines = Line.objects.bulk_create(
+            Line(name=f'{prefix} линия {i}', volume=LINE_VOLUMES[i % len(LINE_VOLUMES)], number=i + 1)
+            for i in range(options['lines'])
+        )
+        gtins = _gtins(rng, options['products'])
+        products = Product.objects.bulk_create((
+            Product(
+                name=f'{prefix} продукт {i}',
+                gtin=gtins[i],
+                volume=lines[i % len(lines)].volume,  # Объём продукта совпадает с объёмом линии, как требует ProductForm
+                line=lines[i % len(lines)],
+            )
+            for i in range(options['products'])
+        ), batch_size=BULK_SIZE)
+        return lines, products
+
+    def seed_materials(self, prefix, rng, products, options):
+        materials = Material.objects.bulk_create((
+            Material(name=f'{prefix} материал {i}', unit=rng.choice(('g', 'pcs', 'l')))
+            for i in range(options['materials'])
+        ), batch_size=BULK_SIZE)
+        bom = {}
+        rows = []
+        for product in products:
+            bom[product.pk] = {
+                material.pk: Decimal(rng.randrange(1, 500)) / 100
+                for material in rng.sample(materials, options['bom_size'])
+            }
+            rows.extend(
+                ProductMaterial(product=product, material_id=material_id, quantity=quantity)
+                for material_id, quantity in bom[product.pk].items()
+            )
+        ProductMaterial.objects.bulk_create(rows, batch_size=BULK_SIZE)
+        return materials, bom
+
+    def seed_batches(self, rng, products, materials, bom, options):
+        """Создаёт партии и выпускает их долю со списанием материалов; возвращает остатки готовой продукции"""
+        today = timezone.now().date()
+        first_day = today - timedelta(days=options['days'])
+        batches_by_day = defaultdict(list)
+        for _ in range(options['batches']):
+            product = rng.choice(products)
+            day = first_day + timedelta(days=rng.randrange(options['days'] + 1))
+            quantity = Decimal(rng.randrange(100, 5000)) if rng.random() < options['released'] else Decimal('0')
+            batches_by_day[day].append(
+                Batch(product=product, line_id=product.line_id, production_date=day, quantity=quantity)
+            )
+
+        # Номера выдаются из того же счётчика, что и при создании партий через формы
+        batches = []
+        for day, day_batches in sorted(batches_by_day.items()):
+            for batch, number in zip(day_batches, BatchNumberSequence.allocate(day, len(day_batches))):
+                batch.batch_number = Batch.format_batch_number(number, day)
+            batches.extend(day_batches)
+        batches = Batch.objects.bulk_create(batches, batch_size=BULK_SIZE)
+
+        released = [batch for batch in batches if batch.quantity > 0]
+        finished_goods = FinishedGoodsStock.objects.bulk_create((
+            FinishedGoodsStock(
+                product_id=batch.product_id,
+                batch=batch,
+                batch_number=batch.batch_number,
+                production_date=batch.production_date,
+                quantity=batch.quantity,
+            )
+            for batch in released
+        ), batch_size=BULK_SIZE)
+
+        consumed = defaultdict(Decimal)
+        movements = []
+        for batch, item in zip(released, finished_goods):
+            moment = self.moment(batch.production_date, rng)
+            for material_id, per_unit in bom[batch.product_id].items():
+                consumed[material_id] += per_unit * batch.quantity
+                movements.append(StockMovement(
+                    kind=StockMovement.CONSUMPTION, material_id=material_id, quantity=-per_unit * batch.quantity,
+                    created_at=moment, reference=batch.batch_number,
+                ))
+            movements.append(StockMovement(
+                kind=StockMovement.RELEASE, finished_goods=item, quantity=batch.quantity,
+                created_at=moment, reference=batch.batch_number,
+            ))
+
+        # Поступление материалов до начала истории покрывает расход и оставляет запас
+        receipt_moment = self.moment(first_day - timedelta(days=1), rng)
+        stocks = []
+        for material in materials:
+            receipt = consumed[material.pk] + Decimal(rng.randrange(1000, 100000))
+            stocks.append(Stock(material=material, quantity=receipt - consumed[material.pk]))
+            movements.append(StockMovement(
+                kind=StockMovement.RECEIPT, material=material, quantity=receipt, created_at=receipt_moment,
+            ))
+        Stock.objects.bulk_create(stocks, batch_size=BULK_SIZE)
+        StockMovement.objects.bulk_create(movements, batch_size=BULK_SIZE)
+        return finished_goods
+
+    def seed_shipments(self, rng, finished_goods, counterparties, options):
+        """Создаёт однострочные отгрузки по выпущенным партиям и уменьшает их остатки"""
+        if not finished_goods or not counterparties:
+            return
+        today = timezone.now().date()
+        shipments, lines = [], []
+        for _ in range(options['shipments']):
+            item = rng.choice(finished_goods)
+            if item.quantity <= 0:
+                continue
+            quantity = min(item.quantity, Decimal(rng.randrange(1, 1000)))
+            item.quantity -= quantity
+            item.is_used = item.quantity == 0
+            shipment_date = item.production_date + timedelta(days=rng.randrange(0, 30))
+            shipments.append(Shipment(
+                product_id=item.product_id,
+                batch_id=item.batch_id,
+                quantity=quantity,
+                shipment_date=min(shipment_date, today),
+                counterparty=rng.choice(counterparties),
+            ))
+            lines.append((item, quantity))
+
+        shipments = Shipment.objects.bulk_create(shipments, batch_size=BULK_SIZE)
+        ShipmentItem.objects.bulk_create((
+            ShipmentItem(shipment=shipment, product_id=item.product_id, batch_id=item.batch_id, quantity=quantity)
+            for shipment, (item, quantity) in zip(shipments, lines)
+        ), batch_size=BULK_SIZE)
+        StockMovement.objects.bulk_create((
+            StockMovement(
+                kind=StockMovement.SHIPMENT, finished_goods=item, quantity=-quantity,
+                created_at=self.moment(shipment.shipment_date, rng), reference=f'Отгрузка №{shipment.pk}',
+            )
+            for shipment, (item, quantity) in zip(shipments, lines)
+        ), batch_size=BULK_SIZE)
+        FinishedGoodsStock.objects.bulk_update(finished_goods, ['quantity', 'is_used'], batch_size=BULK_SIZE)
+
+    @staticmethod
+    def moment(day, rng):
+        """Случайный момент рабочего дня"""
+        return timezone.make_aware(
+            datetime.combine(day, datetime.min.time()) + timedelta(minutes=rng.randrange(480, 1200))
+        )
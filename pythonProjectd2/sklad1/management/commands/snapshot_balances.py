@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from sklad1.services import take_balance_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет контрольную точку остатков материалов и готовой продукции для запросов остатка на дату'
+
+    def handle(self, *args, **options):
+        snapshots = take_balance_snapshots()
+        self.stdout.write(self.style.SUCCESS(f'Сохранено {len(snapshots)} остатков в контрольной точке.'))
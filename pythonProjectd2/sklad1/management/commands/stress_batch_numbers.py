@@ -0,0 +1,56 @@
+import multiprocessing
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from sklad1.models import BatchNumberSequence
+
+# Отдельный день, чтобы нагрузочная проверка не затрагивала реальные номера партий
+STRESS_DAY = date(2999, 12, 31)
+
+
+def _allocate_worker(args):
+    """Выдаёт номера в отдельном процессе и возвращает полученный список"""
+    iterations, block = args
+    numbers = []
+    for _ in range(iterations):
+        with transaction.atomic():
+            numbers.extend(BatchNumberSequence.allocate(STRESS_DAY, block))
+    connections.close_all()
+    return numbers
+
+
+class Command(BaseCommand):
+    help = 'Параллельно запрашивает номера партий из нескольких процессов и проверяет отсутствие дублей и пропусков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help='Количество процессов')
+        parser.add_argument('--iterations', type=int, default=200, help='Запросов на процесс')
+        parser.add_argument('--block', type=int, default=1, help='Размер резервируемого блока')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        iterations = options['iterations']
+        block = options['block']
+
+        BatchNumberSequence.objects.filter(day=STRESS_DAY).delete()
+        # Соединение родителя не должно наследоваться дочерними процессами
+        connections.close_all()
+
+        try:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.map(_allocate_worker, [(iterations, block)] * processes)
+        finally:
+            BatchNumberSequence.objects.filter(day=STRESS_DAY).delete()
+
+        numbers = [number for result in results for number in result]
+        expected = processes * iterations * block
+        if len(numbers) != len(set(numbers)):
+            raise CommandError(f'Обнаружены дубли номеров: выдано {len(numbers)}, уникальных {len(set(numbers))}.')
+        if sorted(numbers) != list(range(1, expected + 1)):
+            raise CommandError(f'Обнаружены пропуски: ожидалось 1..{expected}, получено {len(numbers)} номеров.')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Выдано {expected} номеров из {processes} процессов без дублей и пропусков.'
+        ))
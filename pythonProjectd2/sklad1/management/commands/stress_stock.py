@@ -0,0 +1,203 @@
+import json
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from sklad1.history import purge_history
+from sklad1.models import (
+    Batch, Counterparty, FinishedGoodsStock, Line, Material, Product, ProductMaterial, ShipmentItem, Stock,
+    StockMovement,
+)
+from sklad1.services import create_shipment_document, release_batches
+
+PREFIX = '__stress__'
+RELEASE_QUANTITY = Decimal('10')  # Выпуск одной партии; материала на единицу продукции — 1
+SHIPMENT_QUANTITY = Decimal('3')  # Количество одной отгрузки
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка списаний: несколько процессов одновременно выпускают партии из одного '
+            'остатка материала и отгружают одну партию готовой продукции. Спрос вдвое больше остатка; '
+            'после прогона проверяется, что остатки не ушли в минус и сходятся с журналом движений и документами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help='Количество процессов')
+        parser.add_argument('--operations', type=int, default=50, help='Операций на процесс в каждом сценарии')
+        parser.add_argument('--keep', action='store_true', help='Не удалять тестовые данные после прогона')
+        # Служебные параметры процесса-исполнителя
+        parser.add_argument('--worker', choices=('release', 'shipment'), help='Запустить процесс-исполнитель')
+        parser.add_argument('--targets', help='JSON с идентификаторами для процесса-исполнителя')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self.work(options['worker'], json.loads(options['targets']))
+        if options['processes'] < 2:
+            raise CommandError('Нужно не меньше двух процессов.')
+
+        if Line.objects.filter(name__startswith=PREFIX).exists():
+            self.clear()  # Данные прошлого прерванного прогона
+        data = self.prepare(options['processes'] * options['operations'])
+        try:
+            problems = []
+            for scenario in ('release', 'shipment'):
+                results = self.run_workers(scenario, data, options)
+                problems += self.verify(scenario, data, results)
+        finally:
+            if not options['keep']:
+                self.clear()
+
+        if problems:
+            raise CommandError('Остатки не сходятся: ' + ' '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Остатки не ушли в минус и сходятся с журналом движений и документами.'))
+
+    def prepare(self, demand):
+        """Создаёт данные, на которых спрос вдвое превышает остаток"""
+        today = timezone.now().date()
+        with transaction.atomic():
+            line = Line.objects.create(name=f'{PREFIX} линия', volume=Decimal('1.50'), number=0)
+            product = Product.objects.create(name=f'{PREFIX} продукт', gtin=PREFIX, volume=line.volume, line=line)
+            material = Material.objects.create(name=f'{PREFIX} материал', unit='pcs')
+            ProductMaterial.objects.create(product=product, material=material, quantity=Decimal('1'))
+            counterparty = Counterparty.objects.create(name=f'{PREFIX} контрагент', address='-', contact_number='-')
+
+            material_stock = demand * RELEASE_QUANTITY / 2
+            Stock.objects.create(material=material, quantity=material_stock)
+            pending = Batch.bulk_create_numbered(
+                Batch(product=product, line=line, production_date=today) for _ in range(demand)
+            )
+
+            goods_stock = demand * SHIPMENT_QUANTITY / 2
+            shipped = Batch.bulk_create_numbered([
+                Batch(product=product, line=line, production_date=today, quantity=goods_stock)
+            ])[0]
+            finished_goods = FinishedGoodsStock.objects.create(
+                product=product, batch=shipped, batch_number=shipped.batch_number, production_date=today,
+                quantity=goods_stock,
+            )
+        return {
+            'material': material, 'material_stock': material_stock, 'pending': [batch.pk for batch in pending],
+            'finished_goods': finished_goods, 'goods_stock': goods_stock, 'counterparty': counterparty,
+        }
+
+    def run_workers(self, scenario, data, options):
+        """Запускает процессы и даёт им общий старт, когда все готовы"""
+        processes = options['processes']
+        if scenario == 'release':
+            # Каждая партия выпускается одним процессом, общий у всех только остаток материала
+            targets = [{'batches': data['pending'][i::processes]} for i in range(processes)]
+        else:
+            targets = [{
+                'batch': data['finished_goods'].batch_id, 'counterparty': data['counterparty'].pk,
+                'operations': options['operations'],
+            }] * processes
+
+        workers = [
+            subprocess.Popen(
+                [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'stress_stock',
+                 '--worker', scenario, '--targets', json.dumps(target)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            )
+            for target in targets
+        ]
+        for worker in workers:
+            if worker.stdout.readline().strip() != 'ready':
+                raise CommandError('Процесс-исполнитель не запустился.')
+        started = time.perf_counter()
+        for worker in workers:
+            worker.stdin.write('go\n')
+            worker.stdin.flush()
+        results = []
+        for worker in workers:
+            output, _ = worker.communicate()
+            if worker.returncode:
+                raise CommandError(f'Процесс-исполнитель завершился с кодом {worker.returncode}.')
+            results.append(json.loads(output))
+        elapsed = time.perf_counter() - started
+
+        totals = {key: sum(result[key] for result in results) for key in ('ok', 'rejected', 'constraint', 'errors')}
+        self.stdout.write(
+            f'{scenario:<9} процессов {processes}, успешно {totals["ok"]}, отказов {totals["rejected"]}, '
+            f'нарушений ограничений {totals["constraint"]}, ошибок {totals["errors"]} за {elapsed:.1f} с'
+        )
+        return totals
+
+    def verify(self, scenario, data, totals):
+        problems = []
+        if scenario == 'release':
+            spent = totals['ok'] * RELEASE_QUANTITY
+            remaining = Stock.objects.get(material=data['material']).quantity
+            consumed = StockMovement.objects.filter(
+                material=data['material'], kind=StockMovement.CONSUMPTION
+            ).aggregate(total=Sum('quantity'))['total'] or Decimal('0')
+            released = FinishedGoodsStock.objects.filter(batch_id__in=data['pending']).count()
+            initial, checks = data['material_stock'], [
+                (released == totals['ok'], f'выпущено партий {released}, успешных выпусков {totals["ok"]}.'),
+                (-consumed == spent, f'списано по журналу {-consumed}, по выпускам {spent}.'),
+            ]
+        else:
+            spent = totals['ok'] * SHIPMENT_QUANTITY
+            remaining = FinishedGoodsStock.objects.get(pk=data['finished_goods'].pk).quantity
+            documents = ShipmentItem.objects.filter(
+                batch_id=data['finished_goods'].batch_id
+            ).aggregate(total=Sum('quantity'))['total'] or Decimal('0')
+            movements = StockMovement.objects.filter(
+                finished_goods=data['finished_goods'], kind=StockMovement.SHIPMENT
+            ).aggregate(total=Sum('quantity'))['total'] or Decimal('0')
+            initial, checks = data['goods_stock'], [
+                (documents == spent, f'отгружено по документам {documents}, по успешным отгрузкам {spent}.'),
+                (-movements == spent, f'отгружено по журналу {-movements}, по успешным отгрузкам {spent}.'),
+            ]
+        checks += [
+            (remaining >= 0, f'{scenario}: отрицательный остаток {remaining}.'),
+            (remaining == initial - spent, f'{scenario}: остаток {remaining}, ожидался {initial - spent}.'),
+            (totals['constraint'] == 0, f'{scenario}: списания дошли до ограничения базы {totals["constraint"]} раз.'),
+        ]
+        problems += [message for passed, message in checks if not passed]
+        self.stdout.write(f'{scenario:<9} начальный остаток {initial}, конечный {remaining}, списано {spent}')
+        return problems
+
+    def work(self, scenario, targets):
+        """Процесс-исполнитель: ждёт общего старта и выполняет операции, считая исходы"""
+        counts = {'ok': 0, 'rejected': 0, 'constraint': 0, 'errors': 0}
+        if scenario == 'release':
+            batches = list(Batch.objects.filter(pk__in=targets['batches']).order_by('pk'))
+            operations = [lambda batch=batch: release_batches([(batch, RELEASE_QUANTITY)]) for batch in batches]
+        else:
+            batch = Batch.objects.get(pk=targets['batch'])
+            counterparty = Counterparty.objects.get(pk=targets['counterparty'])
+            today = timezone.now().date()
+            operations = [
+                lambda: create_shipment_document(counterparty, today, [(batch, SHIPMENT_QUANTITY)])
+            ] * targets['operations']
+
+        self.stdout.write('ready')
+        self.stdout.flush()
+        sys.stdin.readline()
+        for operation in operations:
+            try:
+                operation()
+                counts['ok'] += 1
+            except ValidationError:
+                counts['rejected'] += 1  # Остатка не хватило: штатный отказ
+            except IntegrityError:
+                counts['constraint'] += 1  # Списание обошло проверку и было остановлено CHECK-ограничением
+            except DatabaseError:
+                counts['errors'] += 1
+        self.stdout.write(json.dumps(counts))
+
+    def clear(self):
+        """Удаляет тестовые данные; партии, остатки и отгрузки удаляются каскадно после журнала движений"""
+        purge_history(
+            Material.objects.filter(name__startswith=PREFIX), Product.objects.filter(line__name__startswith=PREFIX)
+        )
+        Line.objects.filter(name__startswith=PREFIX).delete()
+        Material.objects.filter(name__startswith=PREFIX).delete()
+        Counterparty.objects.filter(name__startswith=PREFIX).delete()
@@ -0,0 +1,319 @@
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from psycopg import errors as pg_errors
+
+from .bom import invalidate_bom
+from .caching import bump_stock_version
+from .events import publish_reload
+from .models import Line, Material, Product, ProductMaterial, Stock, StockMovement
+from .reference import invalidate_reference
+
+COPY_CHUNK_SIZE = 1024 * 1024
+MAX_REPORTED_ERRORS = 10000
+
+# Колонки CSV-файла для каждого вида справочника (первая строка файла — заголовок)
+IMPORT_COLUMNS = {
+    'materials': ('name', 'unit'),
+    'products': ('line', 'name', 'gtin', 'volume'),
+    'bom': ('line', 'product', 'material', 'quantity'),
+    'stock': ('material', 'quantity'),
+}
+
+IMPORT_KIND_CHOICES = (
+    ('materials', 'Материалы'),
+    ('products', 'Продукты'),
+    ('bom', 'Составы продуктов'),
+    ('stock', 'Начальные остатки материалов'),
+)
+
+DELIMITERS = (';', ',', '\t')
+
+# Неотрицательное число, помещающееся в DecimalField(max_digits=10, decimal_places=2); допускается запятая
+DECIMAL_RE = '^[0-9]{1,8}([.,][0-9]{1,2})?$'
+
+# GTIN-8, GTIN-12, GTIN-13 или GTIN-14
+GTIN_RE = '^([0-9]{8}|[0-9]{12,14})$'
+
+
+class ImportResult:
+    """Итог импорта: число строк файла и ошибки в виде списка (номер строки, сообщение)"""
+
+    def __init__(self, kind, rows, errors):
+        self.kind = kind
+        self.rows = rows
+        self.errors = errors
+
+    @property
+    def ok(self):
+        return not self.errors
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def _number(column):
+    return f"replace(trim(s.{column}), ',', '.')::numeric"
+
+
+def _required(column, max_length, label):
+    """Проверки обязательного текстового поля"""
+    return [
+        (f"coalesce(trim(s.{column}), '') = ''", f"'{label}: значение не заполнено'"),
+        (f'length(trim(s.{column})) > {max_length}', f"'{label}: длиннее {max_length} символов'"),
+    ]
+
+
+def _decimal(column, label, positive=False):
+    checks = [(
+        f"coalesce(trim(s.{column}), '') !~ '{DECIMAL_RE}'",
+        f"format('{label}: «%s» не является неотрицательным числом с двумя знаками после запятой', s.{column})",
+    )]
+    if positive:
+        checks.append((
+            f"trim(s.{column}) ~ '{DECIMAL_RE}' AND {_number(column)} = 0",
+            f"'{label}: должно быть больше нуля'",
+        ))
+    return checks
+
+
+def _duplicates(staging, columns, label, key=None):
+    key = key or ', '.join(f'trim(s.{column})' for column in columns)
+    return (
+        f's.row_no IN (SELECT row_no FROM (SELECT s.row_no, row_number() OVER (PARTITION BY {key} ORDER BY s.row_no) AS n '
+        f'FROM {staging} s) d WHERE n > 1)',
+        f"'{label} повторяется в файле'",
+    )
+
+
+def _material_checks():
+    material = _table(Material)
+    return [
+        *_required('material', 100, 'Материал'),
+        (
+            f"trim(s.material) <> '' AND NOT EXISTS (SELECT 1 FROM {material} m WHERE m.name = trim(s.material))",
+            "format('Материал «%s» не найден', s.material)",
+        ),
+        (
+            f'EXISTS (SELECT 1 FROM (SELECT name FROM {material} GROUP BY name HAVING count(*) > 1) d '
+            f'WHERE d.name = trim(s.material))',
+            "format('Материал «%s» неоднозначен: в справочнике несколько материалов с таким названием', s.material)",
+        ),
+    ]
+
+
+def _product_checks():
+    line, product = _table(Line), _table(Product)
+    return [
+        *_required('line', 100, 'Линия'),
+        *_required('product', 100, 'Продукт'),
+        (
+            f"trim(s.product) <> '' AND NOT EXISTS (SELECT 1 FROM {product} p JOIN {line} l ON l.id = p.line_id "
+            f'WHERE l.name = trim(s.line) AND p.name = trim(s.product))',
+            "format('Продукт «%s» на линии «%s» не найден', s.product, s.line)",
+        ),
+    ]
+
+
+def _gtin_checks(staging):
+    """Те же проверки GTIN, что в валидаторе validate_gtin и уникальном индексе product_gtin_unique"""
+    line, product = _table(Line), _table(Product)
+    gtin = 'trim(s.gtin)'
+    # Контрольная цифра: веса 3 и 1 попеременно, начиная с последней цифры перед контрольной
+    check_digit = (
+        f'(10 - (SELECT sum(substr({gtin}, i, 1)::int * CASE WHEN (length({gtin}) - i) % 2 = 1 THEN 3 ELSE 1 END) '
+        f'FROM generate_series(1, length({gtin}) - 1) i) % 10) % 10'
+    )
+    return [
+        (
+            f"coalesce({gtin}, '') <> '' AND CASE WHEN {gtin} ~ '{GTIN_RE}' "
+            f'THEN right({gtin}, 1)::int <> {check_digit} ELSE true END',
+            "format('GTIN «%s» должен состоять из 8, 12, 13 или 14 цифр с верной контрольной цифрой', s.gtin)",
+        ),
+        _duplicates(staging, ('gtin',), 'GTIN', key=f"lpad({gtin}, 14, '0')"),
+        (
+            f"EXISTS (SELECT 1 FROM {product} p JOIN {line} l ON l.id = p.line_id "
+            f"WHERE lpad(p.gtin, 14, '0') = lpad({gtin}, 14, '0') AND NOT (l.name = trim(s.line) AND p.name = trim(s.name)))",
+            "format('GTIN «%s» уже присвоен другому продукту', s.gtin)",
+        ),
+    ]
+
+
+def _checks(kind, staging):
+    """Условия ошибок (в терминах строки s промежуточной таблицы) и SQL-выражения сообщений"""
+    line = _table(Line)
+    units = ', '.join(f"'{code}'" for code, _ in Material._meta.get_field('unit').choices)
+    if kind == 'materials':
+        return [
+            *_required('name', 100, 'Название'),
+            (
+                f'coalesce(trim(s.unit), \'\') NOT IN ({units})',
+                f"format('Единица измерения «%s» не поддерживается, допустимы: {units.replace(chr(39), '')}', s.unit)",
+            ),
+            _duplicates(staging, ('name',), 'Материал'),
+        ]
+    if kind == 'products':
+        return [
+            *_required('line', 100, 'Линия'),
+            *_required('name', 100, 'Название'),
+            *_required('gtin', 50, 'GTIN'),
+            *_gtin_checks(staging),
+            *_decimal('volume', 'Объем', positive=True),
+            (
+                f"trim(s.line) <> '' AND NOT EXISTS (SELECT 1 FROM {line} l WHERE l.name = trim(s.line))",
+                "format('Линия «%s» не найдена', s.line)",
+            ),
+            # Та же проверка, что в ProductForm.clean
+            (
+                f"trim(s.volume) ~ '{DECIMAL_RE}' AND EXISTS (SELECT 1 FROM {line} l "
+                f"WHERE l.name = trim(s.line) AND l.volume <> {_number('volume')})",
+                f"format('Объем продукта %s должен точно соответствовать объему линии %s', trim(s.volume), "
+                f'(SELECT l.volume FROM {line} l WHERE l.name = trim(s.line)))',
+            ),
+            _duplicates(staging, ('line', 'name'), 'Продукт'),
+        ]
+    if kind == 'bom':
+        return [
+            *_product_checks(),
+            *_material_checks(),
+            *_decimal('quantity', 'Количество', positive=True),
+            _duplicates(staging, ('line', 'product', 'material'), 'Материал продукта'),
+        ]
+    if kind == 'stock':
+        return [
+            *_material_checks(),
+            *_decimal('quantity', 'Количество'),
+            _duplicates(staging, ('material',), 'Материал'),
+        ]
+    raise ValueError(f'Неизвестный вид справочника: {kind}')
+
+
+def _apply(cursor, kind, staging):
+    """Переносит проверенные строки из промежуточной таблицы в таблицы справочников"""
+    line, material, product = _table(Line), _table(Material), _table(Product)
+    if kind == 'materials':
+        # Название материала не уникально, поэтому вместо ON CONFLICT — UPDATE существующих и INSERT новых
+        cursor.execute(f'LOCK TABLE {material} IN SHARE ROW EXCLUSIVE MODE')
+        cursor.execute(
+            f'UPDATE {material} m SET unit = trim(s.unit) FROM {staging} s '
+            f'WHERE m.name = trim(s.name) AND m.unit <> trim(s.unit)'
+        )
+        cursor.execute(
+            f'INSERT INTO {material} (name, unit) SELECT trim(s.name), trim(s.unit) FROM {staging} s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {material} m WHERE m.name = trim(s.name)) ORDER BY s.row_no'
+        )
+    elif kind == 'products':
+        cursor.execute(
+            f'INSERT INTO {product} (name, gtin, volume, line_id, picking_strategy) '
+            f"SELECT trim(s.name), trim(s.gtin), {_number('volume')}, l.id, %s FROM {staging} s "
+            f'JOIN {line} l ON l.name = trim(s.line) ORDER BY s.row_no '
+            f'ON CONFLICT (name, line_id) DO UPDATE SET gtin = EXCLUDED.gtin, volume = EXCLUDED.volume',
+            [Product._meta.get_field('picking_strategy').default],  # Значения по умолчанию Django не хранятся в базе
+        )
+    elif kind == 'bom':
+        cursor.execute(
+            f'INSERT INTO {_table(ProductMaterial)} (product_id, material_id, quantity) '
+            f"SELECT p.id, m.id, {_number('quantity')} FROM {staging} s "
+            f'JOIN {line} l ON l.name = trim(s.line) '
+            f'JOIN {product} p ON p.line_id = l.id AND p.name = trim(s.product) '
+            f'JOIN {material} m ON m.name = trim(s.material) ORDER BY s.row_no '
+            f'ON CONFLICT (product_id, material_id) DO UPDATE SET quantity = EXCLUDED.quantity'
+        )
+    elif kind == 'stock':
+        stock = _table(Stock)
+        # Остатки блокируются, чтобы разница для журнала движений не устарела до записи
+        cursor.execute(f'LOCK TABLE {stock} IN SHARE ROW EXCLUSIVE MODE')
+        source = (
+            f"SELECT m.id AS material_id, {_number('quantity')} AS quantity FROM {staging} s "
+            f'JOIN {material} m ON m.name = trim(s.material)'
+        )
+        cursor.execute(
+            f'INSERT INTO {_table(StockMovement)} (kind, material_id, quantity, created_at, reference) '
+            f'SELECT %s, src.material_id, src.quantity - coalesce(st.quantity, 0), now(), %s '
+            f'FROM ({source}) src LEFT JOIN {stock} st ON st.material_id = src.material_id '
+            f'WHERE src.quantity <> coalesce(st.quantity, 0)',
+            [StockMovement.RECEIPT, 'Импорт начальных остатков'],  # Как при добавлении остатка через add_stock
+        )
+        cursor.execute(
+            f'INSERT INTO {stock} (material_id, quantity) {source} '
+            f'ON CONFLICT (material_id) DO UPDATE SET quantity = EXCLUDED.quantity'
+        )
+
+
+def _read_header(file, delimiter):
+    line = file.readline()
+    if isinstance(line, bytes):
+        line = line.decode('utf-8-sig')
+    return [name.strip().strip('"').lower() for name in line.strip('\r\n').split(delimiter)]
+
+
+def import_masterdata(kind, file, delimiter=';'):
+    """Загружает справочник из CSV-файла (открытого в двоичном режиме) одной транзакцией.
+
+    Файл передаётся в промежуточную таблицу командой COPY, все проверки выполняются
+    SQL-запросами по всей таблице сразу, после чего строки переносятся в справочники
+    через INSERT ... SELECT (с ON CONFLICT DO UPDATE, где есть уникальный ключ).
+    При любой ошибке ничего не сохраняется, а в результате возвращаются ошибки
+    по номерам строк файла.
+    """
+    if connection.vendor != 'postgresql':
+        raise ValidationError('Импорт через COPY поддерживается только для PostgreSQL.')
+    if delimiter not in DELIMITERS:
+        raise ValidationError('Недопустимый разделитель колонок.')
+    columns = IMPORT_COLUMNS[kind]
+    header = _read_header(file, delimiter)
+    if tuple(header) != columns:
+        raise ValidationError(
+            f'Неверный заголовок файла: ожидаются колонки {delimiter.join(columns)}, получено {delimiter.join(header)}.'
+        )
+
+    staging = f'sklad1_import_{kind}'
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {staging} (row_no integer GENERATED ALWAYS AS IDENTITY, '
+                f'{", ".join(f"{column} text" for column in columns)}) ON COMMIT DROP'
+            )
+            try:
+                with cursor.copy(
+                    f"COPY {staging} ({', '.join(columns)}) FROM STDIN "
+                    f"(FORMAT csv, DELIMITER E'{delimiter.encode('unicode_escape').decode()}', ENCODING 'UTF8')"
+                ) as copy:
+                    while chunk := file.read(COPY_CHUNK_SIZE):
+                        copy.write(chunk)
+            except pg_errors.DataError as e:
+                # Ошибка формата обрывает COPY целиком; строки в контексте COPY считаются без заголовка
+                transaction.set_rollback(True)
+                line = re.search(r'line (\d+)', e.diag.context or '')
+                return ImportResult(kind, 0, [(int(line.group(1)) + 1 if line else None, e.diag.message_primary)])
+            cursor.execute(f'ANALYZE {staging}')
+            cursor.execute(f'SELECT count(*) FROM {staging}')
+            rows = cursor.fetchone()[0]
+
+            # Номер строки файла на единицу больше номера строки данных из-за заголовка
+            checks = ' UNION ALL '.join(
+                f'SELECT s.row_no + 1, {message} FROM {staging} s WHERE {condition}'
+                for condition, message in _checks(kind, staging)
+            )
+            cursor.execute(f'SELECT * FROM ({checks}) e ORDER BY 1 LIMIT {MAX_REPORTED_ERRORS}')
+            errors = cursor.fetchall()
+            if errors:
+                transaction.set_rollback(True)
+                return ImportResult(kind, rows, errors)
+
+            _apply(cursor, kind, staging)
+
+            if kind == 'stock':
+                bump_stock_version()
+                publish_reload()  # Остатки могли измениться у всех материалов
+            elif kind == 'bom':
+                invalidate_bom()  # Версия составов фиксируется вместе с ними
+
+    # Сигналы при INSERT ... SELECT не отправляются, поэтому кэши сбрасываются явно
+    if kind == 'materials':
+        invalidate_reference(Material)
+    elif kind == 'products':
+        invalidate_reference(Product)
+    return ImportResult(kind, rows, [])
@@ -0,0 +1,112 @@
+import logging
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Журнал медленных запросов и повторяющихся SQL-запросов; в настройках направлен в debug.log
+logger = logging.getLogger('sklad1.sql')
+
+
+class QueryStats:
+    """Счётчик SQL-запросов одного HTTP-запроса, подключается через connection.execute_wrapper"""
+
+    __slots__ = ('count', 'duration', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1  # Текст без параметров: запросы N+1 отличаются только параметрами
+
+    def repeated(self, threshold):
+        """Запросы, выполненные не меньше threshold раз, от самых частых"""
+        return [(sql, times) for sql, times in self.statements.most_common() if times >= threshold]
+
+
+class SQLInstrumentationMiddleware:
+    """Считает SQL-запросы и время в базе на каждый запрос, добавляет заголовок Server-Timing
+    и пишет в журнал медленные запросы и повторяющиеся одинаковые запросы (признак N+1).
+
+    Включается настройкой SQL_INSTRUMENTATION; если она выключена, Django исключает
+    промежуточный слой из цепочки и накладных расходов нет совсем.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.SQL_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_request_ms = settings.SLOW_REQUEST_MS
+        self.repeated_query_threshold = settings.REPEATED_QUERY_THRESHOLD
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats = QueryStats()
+        started = time.perf_counter()
+        with self.instrument(stats):
+            response = self.get_response(request)
+        self.report(request, response, stats, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        # Под ASGI весь синхронный код запроса, включая ORM асинхронных представлений, выполняется
+        # в одном потоке этого запроса (ThreadSensitiveContext), поэтому обёртки ставятся в нём
+        stats = QueryStats()
+        started = time.perf_counter()
+        stack = await sync_to_async(self.instrument)(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.report(request, response, stats, time.perf_counter() - started)
+        return response
+
+    @staticmethod
+    def instrument(stats):
+        """Подключает счётчик ко всем базам; соединения не открываются, пока не понадобятся"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        return stack
+
+    def report(self, request, response, stats, elapsed):
+        total_ms = elapsed * 1000
+        db_ms = stats.duration * 1000
+        response['Server-Timing'] = (
+            f'db;desc="{stats.count} queries";dur={db_ms:.1f}, '
+            f'app;dur={total_ms - db_ms:.1f}, total;dur={total_ms:.1f}'
+        )
+
+        repeated = stats.repeated(self.repeated_query_threshold)
+        if not repeated and total_ms < self.slow_request_ms:
+            return
+        match = request.resolver_match
+        view = match.view_name if match else '-'
+        if total_ms >= self.slow_request_ms:
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.0f мс, статус %s, SQL: %d запросов за %.0f мс',
+                request.method, request.get_full_path(), view, total_ms, response.status_code, stats.count, db_ms,
+            )
+        for sql, times in repeated[:3]:
+            logger.warning(
+                'Повторяющийся запрос (N+1) %s %s (%s): выполнен %d раз: %s',
+                request.method, request.get_full_path(), view, times, sql[:500],
+            )
@@ -1,11 +1,16 @@
-from datetime import timezone
+import secrets
+from datetime import timedelta, timezone
 from decimal import Decimal
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import ValidationError
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models.functions import LPad
 from django.utils import timezone  # Добавляем правильный импорт
 from psycopg import logger
 
+from .gtin import validate_gtin
+
 # Кастомная модель пользователя
 class CustomUser(AbstractUser):
     """Модель пользователя с дополнительным полем для роли"""
@@ -42,17 +47,121 @@ class Line(models.Model):
 # Модель продукта
 class Product(models.Model):
     """Модель для представления продукта"""
+    FIFO = 'fifo'
+    FEFO = 'fefo'
+    PICKING_CHOICES = (
+        (FIFO, 'FIFO — сначала ранее произведённые партии'),
+        (FEFO, 'FEFO — сначала партии с ближайшим сроком годности'),
+    )
+
     name = models.CharField(max_length=100)  # Название продукта
-    gtin = models.CharField(max_length=50)  # Код GTIN (Global Trade Item Number)
+    gtin = models.CharField(max_length=50, validators=[validate_gtin])  # Код GTIN (Global Trade Item Number)
     volume = models.DecimalField(max_digits=10, decimal_places=2)  # Объем продукта
     line = models.ForeignKey(Line, on_delete=models.CASCADE)  # Связь с линией
+    picking_strategy = models.CharField(max_length=4, choices=PICKING_CHOICES, default=FIFO)  # Порядок подбора партий при отгрузке
+    shelf_life_days = models.PositiveIntegerField(null=True, blank=True)  # Срок годности в днях (для FEFO)
 
     class Meta:
         unique_together = ('name', 'line')  # Уникальность комбинации имени и линии
+        indexes = [
+            # Триграммные индексы для поиска по части названия или GTIN (расширение pg_trgm)
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='product_name_trgm_idx'),
+            GinIndex(fields=['gtin'], opclasses=['gin_trgm_ops'], name='product_gtin_trgm_idx'),
+        ]
+        constraints = [
+            # GTIN-8/12/13 и тот же код в виде GTIN-14 с ведущими нулями — один товар; индекс служит и для сканирования
+            models.UniqueConstraint(LPad('gtin', 14, models.Value('0')), name='product_gtin_unique',
+                                    violation_error_message='Продукт с таким GTIN уже существует.'),
+        ]
 
     def __str__(self):
         return self.name  # Отображение названия продукта
 
+    def expiry_date(self, production_date):
+        """Дата окончания срока годности партии, произведённой в production_date"""
+        if self.shelf_life_days is None:
+            return None
+        return production_date + timedelta(days=self.shelf_life_days)
+
+# Модель счётчика номеров партий
+class BatchNumberSequence(models.Model):
+    """Модель для хранения последнего выданного номера партии за день"""
+    day = models.DateField(unique=True)  # День, за который выдаются номера
+    last_number = models.PositiveIntegerField(default=0)  # Последний выданный номер
+
+    def __str__(self):
+        return f'{self.day}: {self.last_number}'
+
+    @classmethod
+    def allocate(cls, day, count=1):
+        """Резервирует count последовательных номеров за день и возвращает их как range.
+
+        Счётчик увеличивается одним запросом UPDATE ... RETURNING, который блокирует строку
+        дня до конца транзакции, поэтому параллельные вызовы не получают одинаковых номеров,
+        а откат транзакции не оставляет пропусков. Строка дня создаётся первым вызовом
+        (INSERT ... ON CONFLICT DO UPDATE) и продолжает номера уже существующих партий дня,
+        выданные до появления счётчика.
+        """
+        if count < 1:
+            raise ValueError('Количество резервируемых номеров должно быть положительным.')
+
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET last_number = last_number + %s WHERE day = %s RETURNING last_number',
+                [count, day],
+            )
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute(
+                    f'INSERT INTO {table} (day, last_number) VALUES (%s, %s) '
+                    f'ON CONFLICT (day) DO UPDATE SET last_number = {table}.last_number + %s '
+                    f'RETURNING last_number',
+                    [day, cls.last_issued_number(day) + count, count],
+                )
+                row = cursor.fetchone()
+        last_number = row[0]
+        return range(last_number - count + 1, last_number + 1)
+
+    @staticmethod
+    def last_issued_number(day):
+        """Наибольший номер среди партий с номером за день day (0, если таких партий нет)"""
+        suffix = Batch.format_batch_number('', day)  # ' дд.мм.гггг'
+        numbers = Batch.objects.filter(batch_number__endswith=suffix).values_list('batch_number', flat=True)
+        return max((int(number.split()[0]) for number in numbers.iterator() if number.split()[0].isdigit()), default=0)
+
+# Модель версии данных, которые процессы кэшируют в памяти
+class DataVersion(models.Model):
+    """Модель для хранения версии данных (например, составов продуктов), общей для всех процессов"""
+    name = models.CharField(max_length=50, unique=True)  # Название данных
+    version = models.PositiveBigIntegerField(default=0)  # Версия: случайное число, новое при каждом изменении
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
+
+    @classmethod
+    def current(cls, name):
+        """Текущая версия данных name (0, если они ещё не менялись)"""
+        return cls.objects.filter(name=name).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls, name):
+        """Меняет версию данных name в текущей транзакции.
+
+        Новая версия становится видна другим процессам вместе с изменёнными данными,
+        при фиксации транзакции, поэтому процесс не может закэшировать старые данные
+        под новой версией; при откате версия не меняется. Версия — случайное число, а не
+        счётчик: данные, прочитанные в откаченной транзакции, закэшированы под версией,
+        которую следующее изменение не повторит.
+        """
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (name, version) VALUES (%s, %s) '
+                f'ON CONFLICT (name) DO UPDATE SET version = excluded.version',
+                [name, secrets.randbits(62) + 1],
+            )
+
 # Модель партии продукции
 class Batch(models.Model):
     """Модель для представления партии продукции"""
@@ -63,37 +172,63 @@ class Batch(models.Model):
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Количество
     is_used = models.BooleanField(default=False)  # Статус использования
 
+    class Meta:
+        indexes = [
+            # Фильтры списка партий по продукту и периоду
+            models.Index(fields=['product', 'production_date'], name='batch_product_date_idx'),
+            models.Index(fields=['production_date'], name='batch_production_date_idx'),
+            # Открытые партии (проверка поступлений, склад готовой продукции, отгрузка)
+            models.Index(fields=['product', 'production_date'], name='batch_open_idx',
+                         condition=models.Q(is_used=False)),
+            # Партии, ожидающие выпуска (форма выпуска продукции)
+            models.Index(fields=['batch_number'], name='batch_pending_release_idx',
+                         condition=models.Q(quantity=0, is_used=False)),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(quantity__gte=0), name='batch_quantity_non_negative',
+                                   violation_error_message='Количество в партии не может быть отрицательным.'),
+        ]
+
     def __str__(self):
         return f'Batch {self.batch_number} of product {self.product.name} on line {self.line.name}'
 
     def save(self, *args, **kwargs):
         """Переопределенный метод save для генерации номера партии"""
         if not self.batch_number:
-            self.batch_number = self.generate_batch_number()
+            # Номер выдаётся в одной транзакции с записью партии, чтобы откат не оставлял пропусков
+            with transaction.atomic():
+                self.batch_number = self.generate_batch_number()
+                super().save(*args, **kwargs)
+            return
         super().save(*args, **kwargs)
 
     def generate_batch_number(self):
         """Генерация номера партии на основе даты и последовательного номера"""
         today = timezone.now().date()
-        date_str = today.strftime('%d.%m.%Y')
-
-        with transaction.atomic():  # Обеспечиваем атомарность операции
-            last_batch = Batch.objects.filter(production_date=today).order_by('-id').first()
-            if last_batch:
-                try:
-                    last_number = int(last_batch.batch_number.split()[0])
-                except (ValueError, IndexError):
-                    last_number = 0
-            else:
-                last_number = 0
-
-            next_number = last_number + 1
-            new_batch_number = f'{next_number} {date_str}'
+        number = BatchNumberSequence.allocate(today)[0]  # Один запрос к счётчику дня
+        return self.format_batch_number(number, today)
 
-            if Batch.objects.filter(batch_number=new_batch_number).exists():
-                raise ValidationError(f'Номер партии "{new_batch_number}" уже существует.')
+    @staticmethod
+    def format_batch_number(number, day):
+        """Формирует строку номера партии вида '<номер> <дд.мм.гггг>'"""
+        return f'{number} {day.strftime("%d.%m.%Y")}'
 
-            return new_batch_number
+    @classmethod
+    def reserve_batch_numbers(cls, count):
+        """Резервирует блок из count номеров партий за текущий день"""
+        today = timezone.now().date()
+        return [cls.format_batch_number(number, today) for number in BatchNumberSequence.allocate(today, count)]
+
+    @classmethod
+    def bulk_create_numbered(cls, batches):
+        """Массовое создание партий с номерами из одного зарезервированного блока"""
+        batches = list(batches)
+        if not batches:
+            return []
+        with transaction.atomic():
+            for batch, batch_number in zip(batches, cls.reserve_batch_numbers(len(batches))):
+                batch.batch_number = batch_number
+            return cls.objects.bulk_create(batches)
 
     def clean(self):
         """Проверка уникальности номера партии и статуса использования"""
@@ -107,13 +242,18 @@ class Batch(models.Model):
         return not self.is_used and self.quantity >= quantity
 
     def release(self, quantity):
-        """Выпускает указанное количество из партии"""
-        if not self.can_release(quantity):
+        """Выпускает указанное количество из партии.
+
+        Списание выполняется одним условным UPDATE ... WHERE quantity >= x, поэтому два
+        одновременных вызова не могут выпустить больше, чем есть в партии.
+        """
+        updated = Batch.objects.filter(pk=self.pk, is_used=False, quantity__gte=quantity).update(
+            quantity=models.F('quantity') - quantity,
+            is_used=models.ExpressionWrapper(models.Q(quantity=quantity), output_field=models.BooleanField()),
+        )
+        if not updated:
             raise ValidationError('Невозможно выпустить указанное количество из этой партии.')
-        self.quantity -= quantity
-        if self.quantity == 0:
-            self.is_used = True
-        self.save()
+        self.refresh_from_db(fields=['quantity', 'is_used'])
 
 # Модель единицы измерения
 class MeasurementUnit(models.Model):
@@ -135,6 +275,11 @@ class Material(models.Model):
     name = models.CharField(max_length=100)  # Название материала
     unit = models.CharField(max_length=50, choices=[('g', 'Граммы'), ('pcs', 'Штуки'), ('l', 'Литры')])  # Единица измерения
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='material_name_trgm_idx'),  # Поиск по части названия
+        ]
+
     def __str__(self):
         return self.name  # Отображение названия материала
 
@@ -144,6 +289,12 @@ class Stock(models.Model):
     material = models.OneToOneField(Material, on_delete=models.CASCADE)  # Связь с материалом
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))  # Количество материала
 
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(quantity__gte=0), name='stock_quantity_non_negative',
+                                   violation_error_message='Остаток материала не может быть отрицательным.'),
+        ]
+
     def __str__(self):
         return f'{self.material.name}: {self.quantity} {self.material.get_unit_display()}'  # Отображение остатков
 
@@ -160,6 +311,38 @@ class ProductMaterial(models.Model):
     def __str__(self):
         return f'{self.product} - {self.material}'  # Отображение связи продукта с материалом
 
+# Модель связи продукта с полуфабрикатом
+class ProductComponent(models.Model):
+    """Модель для связи продукта с полуфабрикатом, у которого есть собственный состав"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='components')  # Продукт
+    component = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='used_in')  # Полуфабрикат
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)  # Количество полуфабриката на продукт
+
+    class Meta:
+        unique_together = ('product', 'component')  # Уникальность комбинации продукта и полуфабриката
+
+    def __str__(self):
+        return f'{self.product} - {self.component}'  # Отображение связи продукта с полуфабрикатом
+
+    def clean(self):
+        """Проверка отсутствия циклических ссылок в составе"""
+        if self.product_id is None or self.component_id is None:
+            return
+        if self.product_id == self.component_id:
+            raise ValidationError('Продукт не может входить в собственный состав.')
+        # Обход вложенных полуфабрикатов компонента: исходный продукт не должен быть достижим
+        children = {}
+        for parent_id, child_id in ProductComponent.objects.exclude(pk=self.pk).values_list('product_id', 'component_id'):
+            children.setdefault(parent_id, []).append(child_id)
+        stack, seen = [self.component_id], {self.component_id}
+        while stack:
+            for child_id in children.get(stack.pop(), []):
+                if child_id == self.product_id:
+                    raise ValidationError('Добавление этого полуфабриката создаст циклическую ссылку в составе.')
+                if child_id not in seen:
+                    seen.add(child_id)
+                    stack.append(child_id)
+
 # Модель контрагента
 class Counterparty(models.Model):
     """Модель для представления контрагента"""
@@ -167,68 +350,317 @@ class Counterparty(models.Model):
     address = models.CharField(max_length=255)  # Адрес контрагента
     contact_number = models.CharField(max_length=15)  # Контактный номер
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['name'], opclasses=['gin_trgm_ops'], name='counterparty_name_trgm_idx'),  # Поиск по части названия
+        ]
+
     def __str__(self):
         return self.name  # Отображение названия контрагента
 
 # Модель отгрузки
 class Shipment(models.Model):
-    """Модель для представления отгрузки"""
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Продукт
-    batch = models.ForeignKey(Batch, on_delete=models.CASCADE)  # Партия
-    quantity = models.DecimalField(max_digits=10, decimal_places=2)  # Количество отгрузки
+    """Модель для представления отгрузки (документа с одной или несколькими строками)"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)  # Продукт (для однострочной отгрузки)
+    batch = models.ForeignKey(Batch, on_delete=models.CASCADE, null=True, blank=True)  # Партия (для однострочной отгрузки)
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)  # Общее количество отгрузки
     shipment_date = models.DateField()  # Дата отгрузки
     counterparty = models.ForeignKey(Counterparty, on_delete=models.CASCADE)  # Контрагент
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['shipment_date'], name='shipment_date_idx'),  # Фильтр списка отгрузок по периоду
+        ]
+
     def __str__(self):
-        return f'{self.product.name} - {self.quantity} (Дата: {self.shipment_date})'  # Отображение отгрузки
+        title = self.product.name if self.product_id else f'Отгрузка №{self.pk}'
+        return f'{title} - {self.quantity} (Дата: {self.shipment_date})'  # Отображение отгрузки
 
 # Модель для готовой продукции на складе
 class FinishedGoodsStock(models.Model):
     """Модель для представления готовой продукции на складе"""
     product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Продукт
-    batch_number = models.CharField(max_length=50)  # Номер партии
+    batch = models.OneToOneField(Batch, on_delete=models.CASCADE, null=True, related_name='finished_goods')  # Партия (ключ для поиска остатка)
+    batch_number = models.CharField(max_length=50)  # Номер партии (для отображения)
     production_date = models.DateField()  # Дата производства
+    expiry_date = models.DateField(null=True, blank=True)  # Годен до (по сроку годности продукта)
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))  # Количество
     is_used = models.BooleanField(default=False)  # Статус использования
 
+    class Meta:
+        indexes = [
+            # Подбор открытых партий продукта при отгрузке (FIFO)
+            models.Index(fields=['product', 'production_date', 'id'], name='finished_goods_open_idx',
+                         condition=models.Q(is_used=False)),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(quantity__gte=0), name='finished_goods_quantity_non_negative',
+                                   violation_error_message='Остаток готовой продукции не может быть отрицательным.'),
+        ]
+
     def __str__(self):
         return f'{self.product.name} - {self.batch_number} - {self.quantity}'  # Отображение информации о готовой продукции
 
-    def update_quantity(self, quantity):
-        """Обновление количества на складе готовой продукции"""
-        if quantity < 0 and abs(quantity) > self.quantity:
-            raise ValidationError("Количество для списания превышает доступное на складе.")
+    def update_quantity(self, quantity, kind='adjustment', reference=''):
+        """Обновление количества на складе готовой продукции с записью в журнал движений.
 
-        self.quantity += quantity
-
-        if self.quantity <= 0:
-            self.quantity = 0
-            self.is_used = True
-
-        self.save()
+        Количество меняется одним условным UPDATE ... WHERE quantity >= x без чтения в Python,
+        поэтому одновременные списания не уводят остаток в минус.
+        """
+        with transaction.atomic():
+            updated = FinishedGoodsStock.objects.filter(pk=self.pk, quantity__gte=max(-quantity, 0)).update(
+                quantity=models.F('quantity') + quantity,
+                # Партия считается использованной, когда списан весь остаток
+                is_used=models.ExpressionWrapper(
+                    models.Q(is_used=True) | models.Q(quantity=-quantity), output_field=models.BooleanField()
+                ),
+            )
+            if not updated:
+                raise ValidationError("Количество для списания превышает доступное на складе.")
+            self.refresh_from_db(fields=['quantity', 'is_used'])
+            StockMovement.objects.create(kind=kind, finished_goods=self, quantity=quantity, reference=reference)
 
 # Модель для представления элемента отгрузки
 class ShipmentItem(models.Model):
-    """Модель для представления элемента отгрузки"""
+    """Модель для представления элемента отгрузки.
+
+    Строки создаются только через services.create_shipment_document, который списывает
+    остатки готовой продукции одной транзакцией для всего документа.
+    """
     shipment = models.ForeignKey('Shipment', on_delete=models.CASCADE, related_name='items')  # Отгрузка
     product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Продукт
     batch = models.ForeignKey(Batch, on_delete=models.CASCADE)  # Партия
     quantity = models.DecimalField(max_digits=10, decimal_places=2)  # Количество отгружаемого продукта
 
+# Модель движения по складу (журнал только для добавления)
+class StockMovement(models.Model):
+    """Модель для представления движения материала или готовой продукции.
+
+    Записи журнала не изменяются и не удаляются: текущий остаток хранится в Stock и
+    FinishedGoodsStock, а история позволяет восстановить остаток на любую дату. Материал
+    или партию с движениями удалить нельзя (PROTECT), массовые UPDATE и DELETE на PostgreSQL
+    останавливает триггер (history.install_history_guard).
+    """
+    RECEIPT = 'receipt'
+    CONSUMPTION = 'consumption'
+    RELEASE = 'release'
+    SHIPMENT = 'shipment'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = (
+        (RECEIPT, 'Поступление'),
+        (CONSUMPTION, 'Списание в производство'),
+        (RELEASE, 'Выпуск продукции'),
+        (SHIPMENT, 'Отгрузка'),
+        (ADJUSTMENT, 'Корректировка'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)  # Вид движения
+    material = models.ForeignKey(Material, on_delete=models.PROTECT, null=True, blank=True)  # Материал (история не удаляется вместе с ним)
+    finished_goods = models.ForeignKey(FinishedGoodsStock, on_delete=models.PROTECT, null=True, blank=True)  # Готовая продукция (так же)
+    quantity = models.DecimalField(max_digits=14, decimal_places=2)  # Изменение количества (со знаком)
+    created_at = models.DateTimeField(default=timezone.now)  # Время движения
+    reference = models.CharField(max_length=100, blank=True)  # Основание (номер партии, отгрузки)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['material', 'id']),
+            models.Index(fields=['finished_goods', 'id']),
+            models.Index(fields=['created_at'], name='stock_movement_created_idx'),  # Движения после конца закрываемого дня
+        ]
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(material__isnull=False, finished_goods__isnull=True)
+                | models.Q(material__isnull=True, finished_goods__isnull=False),
+                name='stock_movement_single_target',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.quantity} ({self.created_at:%d.%m.%Y %H:%M})'
+
     def save(self, *args, **kwargs):
-        """Переопределенный метод save для проверки наличия на складе и обновления остатков"""
-        finished_goods = FinishedGoodsStock.objects.filter(
-            product=self.product,
-            batch_number=self.batch.batch_number,
-            production_date=self.batch.production_date
-        ).first()
+        """Запрещает изменение существующих записей журнала"""
+        if self.pk is not None:
+            raise ValidationError('Записи журнала движений нельзя изменять.')
+        super().save(*args, **kwargs)
 
-        if not finished_goods or finished_goods.quantity < self.quantity:
-            raise ValidationError('Количество отгрузки превышает доступное количество на складе готовой продукции.')
+    def delete(self, *args, **kwargs):
+        """Запрещает удаление записей журнала"""
+        raise ValidationError('Записи журнала движений нельзя удалять.')
 
-        # Используем транзакцию для обеспечения целостности данных
-        with transaction.atomic():
-            super().save(*args, **kwargs)
+# Модель контрольной точки остатков
+class StockBalanceSnapshot(models.Model):
+    """Модель для хранения остатка на момент контрольной точки журнала движений"""
+    material = models.ForeignKey(Material, on_delete=models.CASCADE, null=True, blank=True)  # Материал
+    finished_goods = models.ForeignKey(FinishedGoodsStock, on_delete=models.CASCADE, null=True, blank=True)  # Готовая продукция
+    quantity = models.DecimalField(max_digits=14, decimal_places=2)  # Остаток на момент контрольной точки
+    taken_at = models.DateTimeField()  # Время контрольной точки
+    last_movement_id = models.BigIntegerField(default=0)  # Последнее движение, учтённое в остатке
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['material', 'taken_at']),
+            models.Index(fields=['finished_goods', 'taken_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} на {self.taken_at:%d.%m.%Y %H:%M}'
+
+# Модель суточного итога производства
+class DailyProductionRollup(models.Model):
+    """Модель для хранения выпуска продукции за день по линии и продукту"""
+    day = models.DateField()  # День производства
+    line = models.ForeignKey(Line, on_delete=models.CASCADE)  # Линия
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Продукт
+    quantity = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Выпущено за день
+    batches = models.PositiveIntegerField(default=0)  # Количество выпущенных партий
+
+    class Meta:
+        unique_together = ('day', 'line', 'product')  # Одна строка итога на день, линию и продукт
+
+    def __str__(self):
+        return f'{self.day}: {self.line} / {self.product} - {self.quantity}'
+
+# Модель месячного итога отгрузок
+class MonthlyShipmentRollup(models.Model):
+    """Модель для хранения отгрузок за месяц по продукту и контрагенту"""
+    month = models.DateField()  # Первый день месяца
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)  # Продукт
+    counterparty = models.ForeignKey(Counterparty, on_delete=models.CASCADE)  # Контрагент
+    quantity = models.DecimalField(max_digits=14, decimal_places=2, default=0)  # Отгружено за месяц
+    shipments = models.PositiveIntegerField(default=0)  # Количество строк отгрузок
+
+    class Meta:
+        unique_together = ('month', 'product', 'counterparty')  # Одна строка итога на месяц, продукт и контрагента
+
+    def __str__(self):
+        return f'{self.month:%m.%Y}: {self.product} / {self.counterparty} - {self.quantity}'
+
+# Модель закрытого дня
+class ClosedPeriod(models.Model):
+    """Модель закрытого дня: остатки на конец дня сохранены в снимках и больше не меняются"""
+    day = models.DateField(unique=True)  # Закрытый день
+    closed_at = models.DateTimeField(default=timezone.now)  # Время закрытия
+    materials = models.PositiveIntegerField(default=0)  # Строк в снимке остатков материалов
+    finished_goods = models.PositiveIntegerField(default=0)  # Строк в снимке остатков готовой продукции
+
+    def __str__(self):
+        return f'{self.day:%d.%m.%Y}'
+
+    def save(self, *args, **kwargs):
+        """Запрещает изменение закрытого дня"""
+        if self.pk is not None:
+            raise ValidationError('Закрытый день нельзя изменить.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Запрещает открытие закрытого дня"""
+        raise ValidationError('Закрытый день нельзя открыть повторно.')
+
+# Модель остатка материала на конец дня
+class DailyMaterialBalance(models.Model):
+    """Модель для хранения остатка материала на конец закрытого дня.
+
+    Строки создаются только services.close_day одним INSERT ... SELECT и не изменяются.
+    """
+    day = models.DateField()  # День
+    material = models.ForeignKey(Material, on_delete=models.PROTECT)  # Материал (история не удаляется вместе с ним)
+    quantity = models.DecimalField(max_digits=14, decimal_places=2)  # Остаток на конец дня
+
+    class Meta:
+        unique_together = ('day', 'material')  # Одна строка на день и материал
+
+    def __str__(self):
+        return f'{self.day:%d.%m.%Y}: {self.material} - {self.quantity}'
+
+    def save(self, *args, **kwargs):
+        """Запрещает изменение снимка закрытого дня"""
+        if self.pk is not None:
+            raise ValidationError('Остатки закрытого дня нельзя изменять.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Запрещает удаление снимка закрытого дня"""
+        raise ValidationError('Остатки закрытого дня нельзя удалять.')
+
+# Модель остатка готовой продукции на конец дня
+class DailyFinishedGoodsBalance(models.Model):
+    """Модель для хранения остатка партии готовой продукции на конец закрытого дня.
+
+    Строки создаются только services.close_day одним INSERT ... SELECT и не изменяются.
+    """
+    day = models.DateField()  # День
+    finished_goods = models.ForeignKey(FinishedGoodsStock, on_delete=models.PROTECT)  # Партия на складе (партию с остатками закрытых дней удалить нельзя)
+    product = models.ForeignKey(Product, on_delete=models.PROTECT)  # Продукт (для итогов по продуктам)
+    quantity = models.DecimalField(max_digits=14, decimal_places=2)  # Остаток на конец дня
+
+    class Meta:
+        unique_together = ('day', 'finished_goods')  # Одна строка на день и партию
+        indexes = [
+            models.Index(fields=['day', 'product'], name='daily_fg_balance_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.day:%d.%m.%Y}: {self.finished_goods} - {self.quantity}'
+
+    def save(self, *args, **kwargs):
+        """Запрещает изменение снимка закрытого дня"""
+        if self.pk is not None:
+            raise ValidationError('Остатки закрытого дня нельзя изменять.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        """Запрещает удаление снимка закрытого дня"""
+        raise ValidationError('Остатки закрытого дня нельзя удалять.')
+
+# Модель фоновой задачи
+class Job(models.Model):
+    """Модель задачи, которую выполняют процессы manage.py run_workers (см. sklad1/jobs.py).
+
+    Очередь — сама таблица: исполнитель забирает задачу через SELECT ... FOR UPDATE SKIP LOCKED,
+    поэтому несколько исполнителей не получают одну задачу и не ждут друг друга.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    kind = models.CharField(max_length=50)  # Вид задачи (ключ в sklad1.jobs.JOBS)
+    params = models.JSONField(default=dict, blank=True)  # Параметры задачи
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)  # Состояние
+    attempts = models.PositiveIntegerField(default=0)  # Сделано попыток
+    max_attempts = models.PositiveIntegerField(default=3)  # Допустимо попыток
+    run_after = models.DateTimeField(default=timezone.now)  # Не запускать раньше (отсрочка повторной попытки)
+    progress = models.PositiveSmallIntegerField(default=0)  # Выполнено, %
+    progress_message = models.CharField(max_length=255, blank=True)  # Текущий этап
+    input_file = models.FileField(upload_to='jobs/input/', blank=True)  # Исходный файл (импорт)
+    result_file = models.FileField(upload_to='jobs/results/', blank=True)  # Файл результата (выгрузка)
+    result = models.JSONField(null=True, blank=True)  # Итог задачи
+    error = models.TextField(blank=True)  # Ошибка последней попытки
+    worker = models.CharField(max_length=100, blank=True)  # Исполнитель последней попытки
+    created_by = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, blank=True)  # Автор
+    created_at = models.DateTimeField(auto_now_add=True)  # Время постановки в очередь
+    started_at = models.DateTimeField(null=True, blank=True)  # Начало последней попытки
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Последний сигнал исполнителя
+    finished_at = models.DateTimeField(null=True, blank=True)  # Время завершения
+
+    class Meta:
+        indexes = [
+            # Выбор следующей задачи: только ожидающие, в порядке готовности
+            models.Index(fields=['run_after', 'id'], name='job_queue_idx', condition=models.Q(status='queued')),
+            # Поиск задач, исполнитель которых перестал отвечать
+            models.Index(fields=['heartbeat_at'], name='job_running_idx', condition=models.Q(status='running')),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.get_status_display()})'
 
-            # Обновляем количество на складе готовой продукции
-            finished_goods.update_quantity(-self.quantity)
\ No newline at end of file
+    @property
+    def active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
@@ -0,0 +1,99 @@
+import threading
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+from .bom import current_bom_version, flat_bom
+from .models import Material, Stock
+
+BomMatrix = namedtuple('BomMatrix', 'version product_index material_ids matrix')
+
+_bom_lock = threading.Lock()
+_bom_matrix = None
+
+
+def get_bom_matrix():
+    """Возвращает плотную матрицу продукт × материал (количество сырья на единицу продукта).
+
+    Матрица строится по развёрнутым до сырья составам и кэшируется в процессе до
+    изменения любого уровня состава.
+    """
+    global _bom_matrix
+    version = current_bom_version()
+    with _bom_lock:
+        if _bom_matrix is not None and _bom_matrix.version == version:
+            return _bom_matrix
+
+        flat = flat_bom()
+        product_ids = sorted(flat)
+        material_ids = sorted({material_id for materials in flat.values() for material_id in materials})
+        product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+        material_index = {material_id: i for i, material_id in enumerate(material_ids)}
+
+        matrix = np.zeros((len(product_ids), len(material_ids)))
+        for product_id, materials in flat.items():
+            for material_id, quantity in materials.items():
+                matrix[product_index[product_id], material_index[material_id]] = float(quantity)
+
+        _bom_matrix = BomMatrix(version, product_index, material_ids, matrix)
+        return _bom_matrix
+
+
+def _to_decimal(value):
+    return Decimal(str(round(float(value), 2))).quantize(Decimal('0.01'))
+
+
+def material_requirements(plan):
+    """Рассчитывает потребность в материалах по плану производства и дефицит по дням.
+
+    plan — список кортежей (id продукта, количество, дата). План сворачивается в матрицу
+    дата × продукт и умножается на матрицу составов, поэтому потребность по всем дням
+    считается одним матричным произведением. Дефицит — нарастающая потребность сверх
+    текущего остатка на складе.
+    """
+    bom = get_bom_matrix()
+    days = sorted({day for _, _, day in plan})
+    day_index = {day: i for i, day in enumerate(days)}
+
+    planned = np.zeros((len(days), len(bom.product_index)))
+    without_bom = set()
+    rows, cols, quantities = [], [], []
+    for product_id, quantity, day in plan:
+        column = bom.product_index.get(product_id)
+        if column is None:
+            without_bom.add(product_id)
+            continue
+        rows.append(day_index[day])
+        cols.append(column)
+        quantities.append(float(quantity))
+    np.add.at(planned, (rows, cols), quantities)
+
+    demand = planned @ bom.matrix  # дата × материал
+    cumulative = np.cumsum(demand, axis=0)
+
+    stock_by_material = dict(Stock.objects.filter(material_id__in=bom.material_ids).values_list('material_id', 'quantity'))
+    stock = np.array([float(stock_by_material.get(material_id, 0)) for material_id in bom.material_ids])
+    shortfall = np.maximum(cumulative - stock, 0)
+
+    names = dict(Material.objects.filter(id__in=bom.material_ids).values_list('id', 'name'))
+
+    report = []
+    for i, day in enumerate(days):
+        materials = [
+            {
+                'material': bom.material_ids[j],
+                'name': names.get(bom.material_ids[j]),
+                'demand': _to_decimal(demand[i, j]),
+                'cumulative': _to_decimal(cumulative[i, j]),
+                'stock': _to_decimal(stock[j]),
+                'shortfall': _to_decimal(shortfall[i, j]),
+            }
+            for j in np.flatnonzero((demand[i] > 0) | (shortfall[i] > 0))
+        ]
+        report.append({
+            'date': day,
+            'materials': materials,
+            'has_shortfall': bool((shortfall[i] > 0).any()),
+        })
+    return {'days': report, 'products_without_bom': sorted(without_bom)}
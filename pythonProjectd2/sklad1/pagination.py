@@ -0,0 +1,129 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+CURSOR_PARAM = 'cursor'
+
+
+class KeysetPage:
+    """Страница результатов с курсором на следующую страницу"""
+
+    def __init__(self, object_list, next_cursor, query_params, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+        self._query_params = query_params
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or not self.is_first
+
+    def next_query(self):
+        """Строка запроса следующей страницы с сохранением фильтров"""
+        params = self._query_params.copy()
+        params[CURSOR_PARAM] = self.next_cursor
+        return params.urlencode()
+
+    def first_query(self):
+        """Строка запроса первой страницы с сохранением фильтров"""
+        params = self._query_params.copy()
+        params.pop(CURSOR_PARAM, None)
+        return params.urlencode()
+
+
+def _encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor, fields, model):
+    """Разбирает курсор в значения полей сортировки; при ошибке возвращает None"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(fields):
+            return None
+        return [model._meta.get_field(name).to_python(value) for (name, _), value in zip(fields, values)]
+    except (ValueError, TypeError, ValidationError):
+        return None
+
+
+def _parse_ordering(ordering, model):
+    fields = []
+    for item in ordering:
+        descending = item.startswith('-')
+        name = item.lstrip('-')
+        fields.append((model._meta.pk.name if name == 'pk' else name, descending))
+    if fields[-1][0] != model._meta.pk.name:
+        fields.append((model._meta.pk.name, fields[-1][1]))  # Первичный ключ делает порядок однозначным
+    return fields
+
+
+def _keyset_queryset(request, queryset, ordering):
+    """Упорядочивает queryset и отбрасывает строки до позиции курсора"""
+    model = queryset.model
+    fields = _parse_ordering(ordering, model)
+    queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in fields])
+
+    cursor = request.GET.get(CURSOR_PARAM)
+    values = _decode_cursor(cursor, fields, model) if cursor else None
+    if values is not None:
+        # (a, b, pk) > (x, y, z) раскрывается в a > x OR (a = x AND b > y) OR ...
+        condition = Q()
+        for i, (name, descending) in enumerate(fields):
+            step = Q(**{f'{name}__{"lt" if descending else "gt"}': values[i]})
+            for j in range(i):
+                step &= Q(**{fields[j][0]: values[j]})
+            condition |= step
+        queryset = queryset.filter(condition)
+    return queryset, fields, values is None
+
+
+def _make_page(request, rows, fields, per_page, is_first):
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = _encode_cursor([
+            last._meta.get_field(name).value_to_string(last) for name, _ in fields
+        ])
+    return KeysetPage(rows, next_cursor, request.GET, is_first=is_first)
+
+
+def keyset_page(request, queryset, ordering=('-pk',), per_page=50):
+    """Возвращает страницу queryset после позиции из параметра cursor.
+
+    Вместо OFFSET используется условие на значения полей сортировки последней строки
+    предыдущей страницы, поэтому любая страница стоит столько же, сколько первая,
+    и выбирается одним запросом.
+    """
+    queryset, fields, is_first = _keyset_queryset(request, queryset, ordering)
+    rows = list(queryset[:per_page + 1])
+    return _make_page(request, rows, fields, per_page, is_first)
+
+
+async def akeyset_page(request, queryset, ordering=('-pk',), per_page=50):
+    """Асинхронный вариант keyset_page для асинхронных представлений"""
+    queryset, fields, is_first = _keyset_queryset(request, queryset, ordering)
+    rows = [obj async for obj in queryset[:per_page + 1]]
+    return _make_page(request, rows, fields, per_page, is_first)
+
+
+class KeysetPaginationMixin:
+    """Подключает keyset-пагинацию к ListView вместо постраничной через OFFSET"""
+    paginate_by = 50
+    keyset_ordering = ('-pk',)
+
+    def paginate_queryset(self, queryset, page_size):
+        page = keyset_page(self.request, queryset, self.keyset_ordering, page_size)
+        return None, page, page.object_list, page.has_other_pages
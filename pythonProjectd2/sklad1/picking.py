@@ -0,0 +1,45 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Sum, Window
+
+from .models import FinishedGoodsStock, Product
+
+Pick = namedtuple('Pick', 'finished_goods quantity')
+
+# Порядок подбора открытых партий; id в конце делает нарастающий итог однозначным
+PICKING_ORDER = {
+    Product.FIFO: (F('production_date').asc(), F('id').asc()),
+    Product.FEFO: (F('expiry_date').asc(nulls_last=True), F('production_date').asc(), F('id').asc()),
+}
+
+
+def pick_batches(product, quantity, strategy=None):
+    """Распределяет количество по открытым партиям продукта в порядке FIFO или FEFO.
+
+    Нарастающий итог остатков считается оконной функцией в базе, и одним упорядоченным
+    запросом возвращаются только партии, которые войдут в отгрузку, сколько бы открытых
+    партий ни было у продукта. Остатки не блокируются: списание по подбору выполняет
+    create_shipment_document условным UPDATE. Возвращает список Pick.
+    """
+    quantity = Decimal(quantity)
+    if quantity <= 0:
+        raise ValidationError('Количество для отгрузки должно быть положительным.')
+    order = PICKING_ORDER[strategy or product.picking_strategy]
+
+    rows = (
+        FinishedGoodsStock.objects.filter(product=product, is_used=False, quantity__gt=0, batch__isnull=False)
+        .select_related('batch')
+        .annotate(before=Window(Sum('quantity'), order_by=order) - F('quantity'))  # Остаток предыдущих партий
+        .filter(before__lt=quantity)
+        .order_by(*order)
+    )
+    picks = [Pick(item, min(item.quantity, quantity - item.before)) for item in rows]
+
+    available = sum((pick.quantity for pick in picks), Decimal('0'))
+    if available < quantity:
+        raise ValidationError(
+            f'Недостаточно продукции {product.name} на складе: доступно {available}, требуется {quantity}.'
+        )
+    return picks
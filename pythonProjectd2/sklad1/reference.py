@@ -0,0 +1,121 @@
+from django import forms
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.forms.models import ModelChoiceIterator
+
+from .models import Counterparty, Line, Material, Product
+
+# Справочники, которые меняются редко и нужны почти каждой форме
+REFERENCE_QUERYSETS = {
+    Line: lambda: Line.objects.order_by('number', 'pk'),
+    Product: lambda: Product.objects.select_related('line').order_by('name', 'pk'),
+    Material: lambda: Material.objects.order_by('name', 'pk'),
+    Counterparty: lambda: Counterparty.objects.order_by('name', 'pk'),
+}
+
+# Справочники, кэш которых зависит от другого справочника (продукты хранятся вместе с линией)
+REFERENCE_DEPENDENTS = {
+    Line: (Product,),
+}
+
+
+def _version_key(model):
+    return f'sklad1:ref:{model._meta.label_lower}:version'
+
+
+def reference_version(model):
+    """Текущая версия справочника; меняется при любом его изменении"""
+    return cache.get_or_set(_version_key(model), 1, timeout=None)
+
+
+def reference_list(model):
+    """Возвращает список объектов справочника из кэша Django.
+
+    Ключ данных включает номер версии, который увеличивается сигналами при изменении
+    справочника, поэтому на «тёплом» запросе к базе не обращаемся вовсе. Версия общая
+    для процессов только при общем кэше (Redis); с локальным кэшем другие процессы
+    увидят изменение, когда истечёт REFERENCE_CACHE_TIMEOUT.
+    """
+    version = reference_version(model)
+    key = f'sklad1:ref:{model._meta.label_lower}:{version}'
+    objects = cache.get(key)
+    if objects is None:
+        objects = list(REFERENCE_QUERYSETS[model]())
+        cache.set(key, objects, settings.REFERENCE_CACHE_TIMEOUT)
+    return objects
+
+
+def _increment_reference_version(model):
+    for target in (model,) + REFERENCE_DEPENDENTS.get(model, ()):
+        try:
+            cache.incr(_version_key(target))
+        except ValueError:
+            cache.set(_version_key(target), 1, timeout=None)
+
+
+def invalidate_reference(model):
+    """Увеличивает версию справочника и зависящих от него справочников после фиксации транзакции.
+
+    Если увеличить версию до фиксации, параллельный запрос успеет закэшировать
+    старый список уже под новой версией.
+    """
+    transaction.on_commit(lambda: _increment_reference_version(model))
+
+
+class CachedModelChoiceIterator(ModelChoiceIterator):
+    """Варианты выбора из закэшированного справочника вместо запроса к базе"""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in self.field.cached_objects():
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(self.field.cached_objects()) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or bool(self.field.cached_objects())
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """Поле выбора объекта справочника, построенное по кэшу.
+
+    cache_filter — необязательное условие отбора (например, продукты одной линии);
+    queryset поля при этом нужно ограничить тем же условием, он используется только
+    если значение не найдено в кэше.
+    """
+    iterator = CachedModelChoiceIterator
+
+    def __init__(self, queryset, *args, cache_filter=None, **kwargs):
+        self.cache_filter = cache_filter
+        super().__init__(queryset, *args, **kwargs)
+
+    def __deepcopy__(self, memo):
+        result = super().__deepcopy__(memo)
+        result.__dict__.pop('_cached', None)
+        return result
+
+    def cached_objects(self):
+        if '_cached' not in self.__dict__:
+            objects = reference_list(self.queryset.model)
+            if self.cache_filter is not None:
+                objects = [obj for obj in objects if self.cache_filter(obj)]
+            self._cached = objects
+        return self._cached
+
+    def limit(self, queryset, cache_filter):
+        """Ограничивает варианты выбора одновременно в кэше и в queryset"""
+        self.cache_filter = cache_filter
+        self.__dict__.pop('_cached', None)
+        self.queryset = queryset
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        key = self.to_field_name or 'pk'
+        for obj in self.cached_objects():
+            if str(getattr(obj, key)) == str(value):
+                return obj
+        return super().to_python(value)  # Объект мог появиться после построения кэша
@@ -0,0 +1,142 @@
+import calendar
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+from datetime import date
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Value
+from django.db.models.functions import LPad
+
+from .gtin import GTIN_LENGTHS, normalize_gtin
+from .models import Product
+from .reference import reference_version
+
+GS = '\x1d'  # Разделитель FNC1 после элементов переменной длины
+
+# Поддерживаемые идентификаторы применения GS1: длина данных фиксированная или наибольшая для переменной
+GS1_FIXED = {'00': 18, '01': 14, '02': 14, '11': 6, '13': 6, '15': 6, '16': 6, '17': 6}
+GS1_VARIABLE = {'10': 20, '21': 20, '37': 8}
+SYMBOLOGY_RE = re.compile(r'^\][A-Za-z][0-9]')  # Префикс символики, который добавляют сканеры: ]C1, ]d2, ]Q3
+BRACKETED_RE = re.compile(r'\((\d{2,4})\)([^(]*)')
+
+Scan = namedtuple('Scan', 'gtin batch_number production_date expiry_date')
+
+
+def _gs1_date(value, ai):
+    """Дата ГГММДД элемента GS1; день 00 означает последний день месяца"""
+    if not value.isdigit() or len(value) != 6:
+        raise ValidationError(f'Некорректная дата в элементе ({ai}).')
+    year, month, day = int(value[:2]), int(value[2:4]), int(value[4:])
+    # Век выбирается так, чтобы год был не дальше 49 лет назад и 50 лет вперёд от текущего
+    current = date.today().year
+    year += current - current % 100
+    if year - current > 50:
+        year -= 100
+    elif year - current < -49:
+        year += 100
+    try:
+        return date(year, month, day or calendar.monthrange(year, month)[1])
+    except ValueError:
+        raise ValidationError(f'Некорректная дата в элементе ({ai}).')
+
+
+def _gs1_elements(code):
+    """Разбирает строку GS1 (с идентификаторами в скобках или с разделителями FNC1) на элементы"""
+    if code.startswith('('):
+        elements = BRACKETED_RE.findall(code)
+        if ''.join(f'({ai}){data}' for ai, data in elements) != code:
+            raise ValidationError('Не удалось разобрать строку GS1.')
+        return dict(elements)  # Длины здесь заданы скобками, неподдерживаемые элементы пропускаются
+
+    elements, position = {}, 0
+    while position < len(code):
+        ai = code[position:position + 2]
+        position += 2
+        if ai in GS1_FIXED:
+            data = code[position:position + GS1_FIXED[ai]]
+            if len(data) != GS1_FIXED[ai]:
+                raise ValidationError(f'Элемент ({ai}) строки GS1 короче {GS1_FIXED[ai]} символов.')
+            position += len(data)
+        elif ai in GS1_VARIABLE:
+            end = code.find(GS, position)
+            end = len(code) if end == -1 else end
+            data = code[position:end]
+            if not data or len(data) > GS1_VARIABLE[ai]:
+                raise ValidationError(f'Некорректная длина элемента ({ai}) строки GS1.')
+            position = end
+        else:
+            raise ValidationError(f'Идентификатор применения ({ai}) не поддерживается.')
+        elements[ai] = data
+        if code[position:position + 1] == GS:
+            position += 1
+    return elements
+
+
+def parse_scan(code):
+    """Разбирает отсканированный код: GTIN или строку GS1 с партией (10), датой производства (11)
+    и сроком годности (17, либо «годен до» 15). Возвращает Scan с GTIN из 14 цифр."""
+    code = SYMBOLOGY_RE.sub('', code.strip())
+    if code.isdigit() and len(code) in GTIN_LENGTHS:
+        return Scan(normalize_gtin(code), None, None, None)
+
+    elements = _gs1_elements(code)
+    if '01' not in elements:
+        raise ValidationError('В строке GS1 нет GTIN (01).')
+    expiry = elements.get('17') or elements.get('15')
+    return Scan(
+        normalize_gtin(elements['01']),
+        elements.get('10'),
+        _gs1_date(elements['11'], '11') if '11' in elements else None,
+        _gs1_date(expiry, '17' if '17' in elements else '15') if expiry else None,
+    )
+
+
+# Словарь GTIN -> продукт в памяти процесса, версия справочника продуктов, по которой он построен,
+# и время построения
+_products_by_gtin = (None, 0, {})
+_products_lock = threading.Lock()
+
+
+def product_for_gtin(gtin):
+    """Продукт по GTIN из 14 цифр или None.
+
+    Словарь строится один раз на процесс и перестраивается, когда сигналы меняют версию
+    справочника продуктов, поэтому сканирование известного кода не обращается к базе.
+    Изменения, сделанные другим процессом при локальном кэше, словарь подхватывает не позже
+    чем через REFERENCE_CACHE_TIMEOUT; не найденный код сразу проверяется по уникальному
+    индексу — продукт мог быть создан в другом процессе.
+    """
+    global _products_by_gtin
+    version = reference_version(Product)
+    built_for, built_at, products = _products_by_gtin
+    if built_for != version or time.monotonic() - built_at > settings.REFERENCE_CACHE_TIMEOUT:
+        with _products_lock:
+            built_for, built_at, products = _products_by_gtin
+            if built_for != version or time.monotonic() - built_at > settings.REFERENCE_CACHE_TIMEOUT:
+                products = {product.gtin.zfill(14): product for product in Product.objects.select_related('line')}
+                _products_by_gtin = (version, time.monotonic(), products)
+    product = products.get(gtin)
+    if product is None:
+        product = Product.objects.select_related('line').alias(
+            normalized_gtin=LPad('gtin', 14, Value('0'))
+        ).filter(normalized_gtin=gtin).first()
+    return product
+
+
+def gtin_conflicts(using='default'):
+    """Продукты, GTIN которых совпадают в уникальном индексе product_gtin_unique.
+
+    Индекс сравнивает коды, дополненные нулями слева до 14 символов (более длинные значения
+    lpad обрезает до 14), поэтому «4601234567890» и «04601234567890» — один код.
+    Возвращает словарь «ключ индекса -> продукты по возрастанию id».
+    """
+    products = Product.objects.using(using).annotate(gtin_key=LPad('gtin', 14, Value('0')))
+    repeated = products.values('gtin_key').annotate(count=Count('pk')).filter(count__gt=1).values('gtin_key')
+    conflicts = defaultdict(list)
+    # Только нужные поля: проверка выполняется и до миграций, когда новых колонок ещё нет
+    for product in products.filter(gtin_key__in=repeated).only('name', 'gtin').order_by('pk'):
+        conflicts[product.gtin_key].append(product)
+    return dict(conflicts)
@@ -0,0 +1,172 @@
+from collections import namedtuple
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Case, F, FloatField, Lookup, Q, Value, When
+from django.db.models.functions import Greatest
+from django.urls import reverse_lazy
+
+from .models import Counterparty, Material, Product
+
+# Строке короче трёх символов не соответствует ни одна триграмма, и индекс не используется
+MIN_QUERY_LENGTH = 3
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+
+SearchKind = namedtuple('SearchKind', 'queryset fields serialize')
+
+# Справочники, по которым работает поиск: поля поиска (с триграммными GIN-индексами) и вид результата
+SEARCH_KINDS = {
+    'product': SearchKind(
+        lambda: Product.objects.select_related('line'),
+        ('name', 'gtin'),
+        lambda product: {
+            'text': f'{product.name} ({product.line.name})', 'name': product.name, 'gtin': product.gtin,
+            'line': product.line_id,
+        },
+    ),
+    'material': SearchKind(
+        lambda: Material.objects.all(),
+        ('name',),
+        lambda material: {'text': material.name, 'name': material.name, 'unit': material.unit},
+    ),
+    'counterparty': SearchKind(
+        lambda: Counterparty.objects.all(),
+        ('name',),
+        lambda counterparty: {'text': counterparty.name, 'name': counterparty.name},
+    ),
+}
+
+
+class ILikeContains(Lookup):
+    """Подстрока без учёта регистра через ILIKE.
+
+    Стандартный icontains на PostgreSQL строится как UPPER(поле) LIKE UPPER(...),
+    и триграммный индекс по самому полю для него не подходит, а ILIKE индекс выполняет.
+    """
+    lookup_name = 'ilike_contains'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} ILIKE {rhs}', lhs_params + rhs_params
+
+
+def _field_matches(query, field):
+    if connection.vendor == 'postgresql':
+        pattern = f'%{connection.ops.prep_for_like_query(query)}%'
+        # trigram_word_similar (оператор %>) находит и слова с опечатками
+        return Q(ILikeContains(F(field), pattern)) | Q(**{f'{field}__trigram_word_similar': query})
+    return Q(**{f'{field}__icontains': query})
+
+
+def _field_rank(query, field):
+    if connection.vendor == 'postgresql':
+        return TrigramWordSimilarity(query, field)
+    # Без pg_trgm: совпадение с начала строки выше совпадения в середине
+    return Case(
+        When(**{f'{field}__istartswith': query}, then=Value(1.0)),
+        When(**{f'{field}__icontains': query}, then=Value(0.5)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+
+def search_queryset(kind, query):
+    """Записи справочника, похожие на query, по убыванию похожести.
+
+    На PostgreSQL условия ILIKE и %> выполняются по GIN-индексам gin_trgm_ops,
+    поэтому запрос не просматривает весь справочник, а ранг — похожесть строки
+    запроса на слово в названии или GTIN.
+    """
+    search_kind = SEARCH_KINDS[kind]
+    condition = Q()
+    for field in search_kind.fields:
+        condition |= _field_matches(query, field)
+    ranks = [_field_rank(query, field) for field in search_kind.fields]
+    return (
+        search_kind.queryset()
+        .filter(condition)
+        .annotate(rank=Greatest(*ranks) if len(ranks) > 1 else ranks[0])
+        .order_by('-rank', 'name', 'pk')
+    )
+
+
+def search(query, kinds=None, limit=DEFAULT_LIMIT):
+    """Ищет по названиям продуктов, материалов и контрагентов и по GTIN продуктов.
+
+    Возвращает не больше limit результатов (словарей с kind, id, rank и полями
+    справочника) по всем запрошенным справочникам, лучшие первыми. Слишком короткий
+    запрос возвращает пустой список.
+    """
+    query = query.strip()
+    if len(query) < MIN_QUERY_LENGTH:
+        return []
+    results = []
+    for kind in kinds or SEARCH_KINDS:
+        serialize = SEARCH_KINDS[kind].serialize
+        results += [
+            {'kind': kind, 'id': obj.pk, 'rank': round(obj.rank, 3), **serialize(obj)}
+            for obj in search_queryset(kind, query)[:limit]
+        ]
+    results.sort(key=lambda result: -result['rank'])  # Сортировка устойчива: порядок внутри справочника сохраняется
+    return results[:limit]
+
+
+class SearchSelect(forms.Select):
+    """Выпадающий список справочника с поиском: в HTML выводится только выбранный вариант.
+
+    Остальные варианты подгружает static/js/search_select.js из /api/search/ по мере
+    ввода, поэтому размер страницы не зависит от размера справочника.
+    """
+
+    class Media:
+        js = ('js/search_select.js',)
+
+    def __init__(self, kind, attrs=None):
+        super().__init__(attrs)
+        self.attrs.update({
+            'data-search-url': reverse_lazy('api_search'), 'data-search-kind': kind,
+            'data-search-min-length': MIN_QUERY_LENGTH,
+        })
+
+    def optgroups(self, name, value, attrs=None):
+        selected = {str(item) for item in value if item not in (None, '')}
+        field = self.choices.field
+        choices = [('', field.empty_label)] if field.empty_label is not None else []
+        keys = self._valid_keys(field, selected)
+        if keys:
+            key_name = field.to_field_name or 'pk'
+            choices += [self.choices.choice(obj) for obj in field.queryset.filter(**{f'{key_name}__in': keys})]
+        return [
+            (None, [self.create_option(name, option_value, label, str(option_value) in selected, index)], index)
+            for index, (option_value, label) in enumerate(choices)
+        ]
+
+    @staticmethod
+    def _valid_keys(field, values):
+        """Значения ключа из отправленной формы; значения не того типа (например, id=abc) отбрасываются.
+
+        Форма с таким значением не проходит проверку и выводится снова, поэтому запрос
+        выбранного варианта не должен падать на нём.
+        """
+        model = field.queryset.model
+        key_field = model._meta.get_field(field.to_field_name) if field.to_field_name else model._meta.pk
+        keys = []
+        for value in values:
+            try:
+                keys.append(key_field.to_python(value))
+            except (ValidationError, ValueError, TypeError):
+                continue
+        return keys
+
+
+class SearchModelChoiceField(forms.ModelChoiceField):
+    """Поле выбора записи справочника через поиск вместо полного списка"""
+
+    def __init__(self, kind, **kwargs):
+        kwargs.setdefault('widget', SearchSelect(kind, attrs={'class': 'form-control'}))
+        super().__init__(SEARCH_KINDS[kind].queryset(), **kwargs)
@@ -0,0 +1,466 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import BooleanField, Case, Count, DecimalField, ExpressionWrapper, F, Max, Q, Sum, Value, When
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .bom import flat_bom
+from .caching import bump_stock_version
+from .events import publish
+from .picking import pick_batches
+from .models import (
+    Batch, ClosedPeriod, DailyFinishedGoodsBalance, DailyMaterialBalance, DailyProductionRollup, FinishedGoodsStock,
+    Material, MonthlyShipmentRollup, Product, Shipment, ShipmentItem, Stock, StockBalanceSnapshot, StockMovement,
+)
+
+
+class _Shortage(Exception):
+    """Условное списание затронуло не все строки; транзакция откатывается до точки сохранения"""
+
+
+# Условное списание остатков
+def _conditional_decrement(queryset, key, amounts, **extra):
+    """Списывает количества одним UPDATE ... SET quantity = quantity - x WHERE quantity >= x.
+
+    amounts — словарь {значение поля key: количество}, extra — функции, строящие выражения
+    для других полей по выражению списываемого количества. Проверка и списание выполняются базой
+    в одном запросе, поэтому одновременные списания не могут увести остаток в минус.
+    Возвращает False, если хотя бы одной строки нет или её остатка не хватает; тогда
+    ни одна строка не изменяется.
+    """
+    condition = Q()
+    for value, amount in amounts.items():
+        condition |= Q(**{key: value, 'quantity__gte': amount})
+    delta = Case(
+        *(When(**{key: value}, then=Value(amount)) for value, amount in amounts.items()),
+        output_field=DecimalField(),
+    )
+    try:
+        with transaction.atomic():
+            if len(amounts) > 1:
+                # Строки блокируются по порядку ключа, чтобы встречные многострочные списания не взаимоблокировались
+                list(queryset.filter(**{f'{key}__in': amounts}).order_by('pk').select_for_update().values_list('pk'))
+            updated = queryset.filter(condition).update(
+                quantity=F('quantity') - delta,
+                **{field: expression(delta) for field, expression in extra.items()},
+            )
+            if updated != len(amounts):
+                raise _Shortage
+    except _Shortage:
+        return False
+    return True
+
+
+def _used_up(amount):
+    """Выражение для поля is_used: строка использована, если списан весь остаток"""
+    return ExpressionWrapper(Q(quantity__lte=amount), output_field=BooleanField())
+
+
+# Выпуск продукции и списание материалов
+def release_batches(releases):
+    """Выпускает несколько партий в одной транзакции.
+
+    releases — список пар (партия, количество). Число запросов не зависит ни от
+    количества партий, ни от количества материалов в составе продукта: партии
+    блокируются одним SELECT ... FOR UPDATE, а материалы списываются одним условным
+    UPDATE, который сам проверяет достаточность остатков.
+    """
+    quantities = {}
+    for batch, quantity in releases:
+        if batch.pk in quantities:
+            raise ValidationError(f'Партия {batch.batch_number} указана несколько раз.')
+        quantities[batch.pk] = Decimal(quantity)
+    if not quantities:
+        return []
+
+    with transaction.atomic():
+        # Блокируем выпускаемые партии, чтобы их нельзя было выпустить повторно
+        batches = list(
+            Batch.objects.select_for_update(of=('self',)).select_related('product').filter(pk__in=quantities).order_by('pk')
+        )
+        for batch in batches:
+            if batch.is_used or batch.quantity != 0:
+                raise ValidationError(f'Партия {batch.batch_number} уже выпущена.')
+
+        # Суммарная потребность в материалах по всем партиям
+        product_quantities = defaultdict(Decimal)
+        for batch in batches:
+            product_quantities[batch.product_id] += quantities[batch.pk]
+        # Составы берутся из кэша развёрнутых до сырья составов, без запросов к базе
+        bom = flat_bom(product_quantities)
+        needed = defaultdict(Decimal)
+        for product_id, materials in bom.items():
+            for material_id, per_unit in materials.items():
+                needed[material_id] += per_unit * product_quantities[product_id]
+
+        # Списываем все материалы одним условным запросом
+        if needed and not _conditional_decrement(Stock.objects.all(), 'material_id', needed):
+            available = dict(Stock.objects.filter(material_id__in=needed).values_list('material_id', 'quantity'))
+            short = [
+                material_id for material_id, total_needed in needed.items()
+                if available.get(material_id, Decimal('0')) < total_needed
+            ]
+            names = Material.objects.filter(pk__in=short).order_by('name').values_list('name', flat=True)
+            raise ValidationError(
+                [f'Недостаточно {name} на складе.' for name in names]
+                or ['Остатки изменились во время выпуска, повторите попытку.']
+            )
+
+        # Фиксируем выпущенное количество в партиях
+        for batch in batches:
+            batch.quantity = quantities[batch.pk]
+            batch.is_used = batch.quantity == 0
+        Batch.objects.bulk_update(batches, ['quantity', 'is_used'])
+
+        # Зачисляем продукцию на склад готовой продукции
+        existing = {
+            item.batch_id: item
+            for item in FinishedGoodsStock.objects.select_for_update().filter(batch_id__in=quantities)
+        }
+        to_create = []
+        to_update = []
+        for batch in batches:
+            item = existing.get(batch.pk)
+            if item is None:
+                to_create.append(FinishedGoodsStock(
+                    product_id=batch.product_id,
+                    batch=batch,
+                    batch_number=batch.batch_number,
+                    production_date=batch.production_date,
+                    expiry_date=batch.product.expiry_date(batch.production_date),
+                    quantity=batch.quantity,
+                    is_used=batch.quantity <= 0,
+                ))
+            else:
+                item.quantity = F('quantity') + batch.quantity
+                to_update.append(item)
+        FinishedGoodsStock.objects.bulk_create(to_create)
+        FinishedGoodsStock.objects.bulk_update(to_update, ['quantity'])
+
+        # Записываем списание материалов и выпуск продукции в журнал движений
+        finished_goods = {item.batch_id: item for item in to_create + to_update}
+        movements = []
+        for batch in batches:
+            for material_id, per_unit in bom[batch.product_id].items():
+                movements.append(StockMovement(
+                    kind=StockMovement.CONSUMPTION,
+                    material_id=material_id,
+                    quantity=-per_unit * batch.quantity,
+                    reference=batch.batch_number,
+                ))
+            movements.append(StockMovement(
+                kind=StockMovement.RELEASE,
+                finished_goods=finished_goods[batch.pk],
+                quantity=batch.quantity,
+                reference=batch.batch_number,
+            ))
+        StockMovement.objects.bulk_create(movements)
+
+        production = defaultdict(lambda: [Decimal('0'), 0])
+        for batch in batches:
+            totals = production[(batch.production_date, batch.line_id, batch.product_id)]
+            totals[0] += batch.quantity
+            totals[1] += 1
+        _increment_rollup(DailyProductionRollup, ('day', 'line', 'product'), 'batches', production)
+        bump_stock_version()  # bulk_update не отправляет сигналы, сбрасываем таблицы остатков явно
+        publish(stock=needed, batch=quantities, finished_goods=[item.pk for item in to_create + to_update])
+
+    return batches
+
+
+# Создание документа отгрузки
+def create_shipment_document(counterparty, shipment_date, items):
+    """Создаёт отгрузку из нескольких строк и списывает остатки готовой продукции.
+
+    items — список пар (партия, количество). Остатки списываются одним условным
+    UPDATE ... WHERE quantity >= x, строки создаются одним bulk_create, так что число
+    запросов не зависит от количества строк документа.
+    """
+    items = [(batch, Decimal(quantity)) for batch, quantity in items]
+    if not items:
+        raise ValidationError('Отгрузка должна содержать хотя бы одну строку.')
+
+    requested = defaultdict(Decimal)
+    batch_numbers = {}
+    for batch, quantity in items:
+        if quantity <= 0:
+            raise ValidationError(f'Количество для партии {batch.batch_number} должно быть положительным.')
+        requested[batch.pk] += quantity
+        batch_numbers[batch.pk] = batch.batch_number
+
+    with transaction.atomic():
+        open_stock = FinishedGoodsStock.objects.filter(is_used=False)
+        if not _conditional_decrement(open_stock, 'batch_id', requested, is_used=_used_up):
+            available = dict(open_stock.filter(batch_id__in=requested).values_list('batch_id', 'quantity'))
+            errors = []
+            for batch_id, quantity in requested.items():
+                batch_number = batch_numbers[batch_id]
+                if batch_id not in available:
+                    errors.append(f'Партия {batch_number} не найдена на складе или уже использована.')
+                elif available[batch_id] < quantity:
+                    errors.append(
+                        f'Количество отгрузки по партии {batch_number} превышает доступное на складе ({available[batch_id]}).'
+                    )
+            raise ValidationError(errors or ['Остаток изменился во время отгрузки, повторите попытку.'])
+        stocks = dict(FinishedGoodsStock.objects.filter(batch_id__in=requested).values_list('batch_id', 'pk'))
+
+        # Продукт в шапке документа — если все строки одного продукта, партия — если строки одной партии
+        products = {batch.product_id for batch, _ in items}
+        shipment = Shipment.objects.create(
+            product_id=products.pop() if len(products) == 1 else None,
+            batch=items[0][0] if len(requested) == 1 else None,
+            quantity=sum(requested.values()),
+            shipment_date=shipment_date,
+            counterparty=counterparty,
+        )
+        ShipmentItem.objects.bulk_create([
+            ShipmentItem(shipment=shipment, product_id=batch.product_id, batch=batch, quantity=quantity)
+            for batch, quantity in items
+        ])
+
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                kind=StockMovement.SHIPMENT,
+                finished_goods_id=stocks[batch.pk],
+                quantity=-quantity,
+                reference=f'Отгрузка №{shipment.pk}',
+            )
+            for batch, quantity in items
+        ])
+
+        month = shipment_date.replace(day=1)
+        shipped = defaultdict(lambda: [Decimal('0'), 0])
+        for batch, quantity in items:
+            totals = shipped[(month, batch.product_id, counterparty.pk)]
+            totals[0] += quantity
+            totals[1] += 1
+        _increment_rollup(MonthlyShipmentRollup, ('month', 'product', 'counterparty'), 'shipments', shipped)
+        bump_stock_version()
+        publish(finished_goods=stocks.values())  # Событие об отгрузке отправляет сигнал post_save
+
+    return shipment
+
+
+# Отгрузка с автоматическим подбором партий
+def create_picked_shipment(counterparty, shipment_date, products, attempts=3):
+    """Создаёт отгрузку, подбирая партии продуктов по FIFO или FEFO (настройка продукта).
+
+    products — список пар (продукт, количество). Подбор читает остатки без блокировок,
+    а create_shipment_document списывает их условным UPDATE; если параллельная отгрузка
+    успела забрать подобранный остаток, подбор повторяется по свежим остаткам.
+    """
+    if len({product.pk for product, _ in products}) != len(products):
+        raise ValidationError('Продукт указан в отгрузке несколько раз.')
+    for attempt in range(attempts):
+        # Недостаток продукции обнаруживается при подборе и не повторяется
+        items = [
+            (pick.finished_goods.batch, pick.quantity)
+            for product, quantity in products
+            for pick in pick_batches(product, quantity)
+        ]
+        try:
+            return create_shipment_document(counterparty, shipment_date, items)
+        except ValidationError:
+            if attempt == attempts - 1:
+                raise
+
+
+# Установка остатка материала
+def set_stock_quantity(material, quantity, kind=StockMovement.ADJUSTMENT, reference=''):
+    """Устанавливает остаток материала и записывает разницу в журнал движений"""
+    quantity = Decimal(quantity)
+    with transaction.atomic():
+        stock, created = Stock.objects.select_for_update().get_or_create(material=material)
+        delta = quantity - stock.quantity
+        if delta:
+            stock.quantity = quantity
+            stock.save(update_fields=['quantity'])
+            StockMovement.objects.create(kind=kind, material=material, quantity=delta, reference=reference)
+    return stock
+
+
+# Контрольные точки журнала движений
+def take_balance_snapshots():
+    """Сохраняет текущие остатки материалов и готовой продукции как контрольную точку.
+
+    Остатки блокируются на время снимка, поэтому незавершённые движения не попадут
+    в снимок частично: каждый снимок точно соответствует своему last_movement_id.
+    """
+    taken_at = timezone.now()
+    with transaction.atomic():
+        snapshots = []
+        for model, field in ((Stock, 'material'), (FinishedGoodsStock, 'finished_goods')):
+            key = 'material_id' if model is Stock else 'id'
+            rows = list(model.objects.select_for_update().order_by('pk').values_list(key, 'quantity'))
+            last_ids = dict(
+                StockMovement.objects.filter(**{f'{field}__isnull': False})
+                .values_list(f'{field}_id')
+                .annotate(last_id=Max('id'))
+            )
+            snapshots.extend(
+                StockBalanceSnapshot(
+                    quantity=quantity, taken_at=taken_at, last_movement_id=last_ids.get(item_id, 0),
+                    **{f'{field}_id': item_id},
+                )
+                for item_id, quantity in rows
+            )
+        return StockBalanceSnapshot.objects.bulk_create(snapshots)
+
+
+# Остаток на дату
+def balance_as_of(moment, material=None, finished_goods=None):
+    """Возвращает остаток материала или готовой продукции на момент moment.
+
+    Читается ближайшая предыдущая контрольная точка и только движения после неё
+    (ограниченные следующей контрольной точкой), поэтому время запроса не зависит
+    от длины всей истории.
+    """
+    if (material is None) == (finished_goods is None):
+        raise ValueError('Нужно указать либо материал, либо готовую продукцию.')
+    target = {'material': material} if material is not None else {'finished_goods': finished_goods}
+
+    snapshots = StockBalanceSnapshot.objects.filter(**target)
+    base = snapshots.filter(taken_at__lte=moment).order_by('-taken_at').values_list(
+        'quantity', 'last_movement_id'
+    ).first()
+    upper = snapshots.filter(taken_at__gt=moment).order_by('taken_at').values_list(
+        'last_movement_id', flat=True
+    ).first()
+    quantity, last_movement_id = base or (Decimal('0'), 0)
+
+    movements = StockMovement.objects.filter(id__gt=last_movement_id, created_at__lte=moment, **target)
+    if upper is not None:
+        movements = movements.filter(id__lte=upper)
+    return quantity + (movements.aggregate(total=Sum('quantity'))['total'] or Decimal('0'))
+
+
+# Закрытие дня
+def close_day(day):
+    """Сохраняет остатки материалов и готовой продукции на конец дня и закрывает день.
+
+    Остаток на конец дня — текущий остаток минус движения после конца дня. Каждый снимок
+    записывается одним INSERT ... SELECT, который видит остатки и журнал движений
+    в одном согласованном состоянии базы, поэтому параллельные выпуски и отгрузки
+    не искажают снимок. Нулевые остатки не сохраняются. Возвращает ClosedPeriod.
+    """
+    if day >= timezone.localdate():
+        raise ValidationError('Закрыть можно только завершившийся день.')
+    if ClosedPeriod.objects.filter(day=day).exists():
+        raise ValidationError(f'День {day:%d.%m.%Y} уже закрыт.')
+
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+    quote = connection.ops.quote_name
+    movements = quote(StockMovement._meta.db_table)
+    finished_goods = quote(FinishedGoodsStock._meta.db_table)
+    params = [connection.ops.adapt_datefield_value(day), connection.ops.adapt_datetimefield_value(end)]
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Строки вставляются в порядке названий, поэтому страницы истории по первичному ключу упорядочены
+            cursor.execute(
+                f'INSERT INTO {quote(DailyMaterialBalance._meta.db_table)} (day, material_id, quantity) '
+                f'SELECT %s, s.material_id, s.quantity - coalesce(m.total, 0) FROM {quote(Stock._meta.db_table)} s '
+                f'JOIN {quote(Material._meta.db_table)} mat ON mat.id = s.material_id '
+                f'LEFT JOIN (SELECT material_id, sum(quantity) AS total FROM {movements} '
+                f'WHERE created_at >= %s AND material_id IS NOT NULL GROUP BY material_id) m '
+                f'ON m.material_id = s.material_id '
+                f'WHERE s.quantity - coalesce(m.total, 0) <> 0 ORDER BY mat.name, s.material_id',
+                params,
+            )
+            materials = cursor.rowcount
+            cursor.execute(
+                f'INSERT INTO {quote(DailyFinishedGoodsBalance._meta.db_table)} '
+                f'(day, finished_goods_id, product_id, quantity) '
+                f'SELECT %s, f.id, f.product_id, f.quantity - coalesce(m.total, 0) FROM {finished_goods} f '
+                f'JOIN {quote(Product._meta.db_table)} p ON p.id = f.product_id '
+                f'LEFT JOIN (SELECT finished_goods_id, sum(quantity) AS total FROM {movements} '
+                f'WHERE created_at >= %s AND finished_goods_id IS NOT NULL GROUP BY finished_goods_id) m '
+                f'ON m.finished_goods_id = f.id '
+                f'WHERE f.quantity - coalesce(m.total, 0) <> 0 ORDER BY p.name, f.production_date, f.id',
+                params,
+            )
+            return ClosedPeriod.objects.create(day=day, materials=materials, finished_goods=cursor.rowcount)
+    except IntegrityError:
+        # День закрыл параллельный процесс: уникальные ключи снимков не дали записать его второй раз
+        raise ValidationError(f'День {day:%d.%m.%Y} уже закрыт.')
+
+
+def days_to_close():
+    """Незакрытые дни от последнего закрытого (или вчерашнего, если закрытых нет) до вчерашнего"""
+    yesterday = timezone.localdate() - timedelta(days=1)
+    last = ClosedPeriod.objects.order_by('-day').values_list('day', flat=True).first()
+    first = last + timedelta(days=1) if last else yesterday
+    return [first + timedelta(days=offset) for offset in range((yesterday - first).days + 1)]
+
+
+# Итоги производства и отгрузок
+def _increment_rollup(model, key_fields, counter_field, totals):
+    """Прибавляет количества к строкам итогов одним INSERT ... ON CONFLICT DO UPDATE.
+
+    totals — словарь {ключ: [количество, число записей]}, ключ соответствует key_fields.
+    """
+    if not totals:
+        return
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    key_columns = [quote(model._meta.get_field(name).column) for name in key_fields]
+    counter = quote(counter_field)
+    columns = key_columns + [quote('quantity'), counter]
+    row = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    params = [value for key, (quantity, count) in totals.items() for value in (*key, quantity, count)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join([row] * len(totals))} '
+            f'ON CONFLICT ({", ".join(key_columns)}) DO UPDATE SET '
+            f'quantity = {table}.quantity + EXCLUDED.quantity, {counter} = {table}.{counter} + EXCLUDED.{counter}',
+            params,
+        )
+
+
+def rebuild_rollups():
+    """Пересчитывает итоги производства и отгрузок по исходным данным"""
+    with transaction.atomic():
+        DailyProductionRollup.objects.all().delete()
+        MonthlyShipmentRollup.objects.all().delete()
+
+        # Выпущенные партии — те, что попали на склад готовой продукции
+        production = (
+            Batch.objects.filter(finished_goods__isnull=False)
+            .values('production_date', 'line_id', 'product_id')
+            .annotate(total=Sum('quantity'), count=Count('id'))
+        )
+        DailyProductionRollup.objects.bulk_create([
+            DailyProductionRollup(
+                day=row['production_date'], line_id=row['line_id'], product_id=row['product_id'],
+                quantity=row['total'], batches=row['count'],
+            )
+            for row in production
+        ], batch_size=5000)
+
+        shipped = defaultdict(lambda: [Decimal('0'), 0])
+        item_rows = (
+            ShipmentItem.objects.values(
+                'product_id', month=TruncMonth('shipment__shipment_date'), counterparty_id=F('shipment__counterparty_id')
+            )
+            .annotate(total=Sum('quantity'), count=Count('id'))
+        )
+        # Отгрузки, созданные до появления строк документа, хранят продукт в шапке
+        legacy_rows = (
+            Shipment.objects.filter(items__isnull=True, product__isnull=False)
+            .values('product_id', 'counterparty_id', month=TruncMonth('shipment_date'))
+            .annotate(total=Sum('quantity'), count=Count('id'))
+        )
+        for rows in (item_rows, legacy_rows):
+            for row in rows:
+                totals = shipped[(row['month'], row['product_id'], row['counterparty_id'])]
+                totals[0] += row['total']
+                totals[1] += row['count']
+        MonthlyShipmentRollup.objects.bulk_create([
+            MonthlyShipmentRollup(
+                month=month, product_id=product_id, counterparty_id=counterparty_id, quantity=quantity, shipments=count,
+            )
+            for (month, product_id, counterparty_id), (quantity, count) in shipped.items()
+        ], batch_size=5000)
@@ -0,0 +1,100 @@
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_migrate
+from django.dispatch import receiver
+
+from .bom import invalidate_bom
+from .caching import bump_stock_version
+from .events import publish_instance
+from .history import install_history_guard
+from .models import (
+    Batch, Counterparty, FinishedGoodsStock, Line, Material, Product, ProductComponent, ProductMaterial, Shipment, Stock,
+)
+from .reference import invalidate_reference
+from .scanning import gtin_conflicts
+
+
+# Триграммные индексы поиска требуют расширения pg_trgm; создаём его до миграций приложения
+@receiver(pre_migrate)
+def create_search_extension(sender, using, **kwargs):
+    if sender.name != 'sklad1' or connections[using].vendor != 'postgresql':
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+# Уникальный индекс GTIN не создаётся, пока в базе есть совпадающие коды: миграция останавливается
+# до изменений с понятным сообщением вместо ошибки базы посреди миграции
+@receiver(pre_migrate)
+def check_gtin_conflicts(sender, using, **kwargs):
+    if sender.name != 'sklad1':
+        return
+    connection = connections[using]
+    if Product._meta.db_table not in connection.introspection.table_names():
+        return
+    conflicts = gtin_conflicts(using)
+    if conflicts:
+        raise CommandError(
+            f'У продуктов есть совпадающие GTIN ({len(conflicts)}), уникальный индекс не может быть создан. '
+            f'Выполните python manage.py check_gtins и исправьте их (или check_gtins --fix).'
+        )
+
+
+# Журнал движений и остатки закрытых дней защищаются от изменения триггерами базы
+@receiver(post_migrate)
+def create_history_guard(sender, using, **kwargs):
+    if sender.name == 'sklad1':
+        install_history_guard(connections[using])
+
+
+# Сброс кэша составов продуктов при изменении любого уровня состава
+@receiver([post_save, post_delete], sender=ProductMaterial)
+@receiver([post_save, post_delete], sender=ProductComponent)
+def product_material_changed(sender, **kwargs):
+    invalidate_bom()
+
+
+# Смена версии кэша справочников при их изменении
+@receiver([post_save, post_delete], sender=Line)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Material)
+@receiver([post_save, post_delete], sender=Counterparty)
+def reference_changed(sender, **kwargs):
+    invalidate_reference(sender)
+    if sender is not Counterparty:
+        bump_stock_version()  # Названия материалов, продуктов и линий выводятся в таблицах остатков
+
+
+# Сброс закэшированных таблиц остатков при изменении остатков и партий
+@receiver([post_save, post_delete], sender=Stock)
+@receiver([post_save, post_delete], sender=FinishedGoodsStock)
+@receiver([post_save, post_delete], sender=Batch)
+def stock_changed(sender, **kwargs):
+    bump_stock_version()
+
+
+# События для складских экранов при сохранении и удалении отдельных записей: строка события
+# строится по самому объекту и отправляется после фиксации (массовые изменения в services.py
+# публикуют события сами)
+@receiver([post_save, post_delete], sender=Stock)
+def stock_event(sender, instance, signal, raw=False, **kwargs):
+    if not raw:
+        publish_instance('stock', instance, deleted=signal is post_delete)
+
+
+@receiver([post_save, post_delete], sender=Batch)
+def batch_event(sender, instance, signal, raw=False, **kwargs):
+    if not raw:
+        publish_instance('batch', instance, deleted=signal is post_delete)
+
+
+@receiver([post_save, post_delete], sender=FinishedGoodsStock)
+def finished_goods_event(sender, instance, signal, raw=False, **kwargs):
+    if not raw:
+        publish_instance('finished_goods', instance, deleted=signal is post_delete)
+
+
+@receiver(post_save, sender=Shipment)
+def shipment_event(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        publish_instance('shipment', instance)
@@ -0,0 +1,42 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+
+from sklad1.caching import CACHED_FRAGMENTS, record_hit, stock_version
+
+register = template.Library()
+
+
+class StockCacheNode(template.Node):
+    def __init__(self, name, nodelist):
+        self.name = name
+        self.nodelist = nodelist
+
+    def render(self, context):
+        key = f'sklad1:fragment:{self.name}:{stock_version()}'
+        value = cache.get(key)
+        record_hit(f'fragment:{self.name}', value is not None)
+        if value is None:
+            value = self.nodelist.render(context)
+            cache.set(key, value, settings.FRAGMENT_CACHE_TIMEOUT)
+        return value
+
+
+@register.tag
+def stock_cache(parser, token):
+    """Кэширует фрагмент шаблона до следующего изменения остатков.
+
+    Использование: {% stock_cache stock_table %} ... {% endstock_cache %}
+
+    Ключ включает версию остатков, поэтому после выпуска, отгрузки или правки
+    остатка фрагмент перестраивается. Содержимое фрагмента не должно зависеть
+    от пользователя и параметров запроса.
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1] not in CACHED_FRAGMENTS:
+        raise template.TemplateSyntaxError(
+            f'{bits[0]}: укажите имя фрагмента из CACHED_FRAGMENTS ({", ".join(CACHED_FRAGMENTS)}).'
+        )
+    nodelist = parser.parse(('endstock_cache',))
+    parser.delete_first_token()
+    return StockCacheNode(bits[1], nodelist)
@@ -1,3 +1,281 @@
-from django.test import TestCase
+import csv
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .bom import flat_bom
+from .forms import ProductForm, ProductMaterialForm
+from .gtin import gtin_check_digit
+from .models import (
+    Batch, BatchNumberSequence, Counterparty, CustomUser, FinishedGoodsStock, Line, Material, Product,
+    ProductComponent, ProductMaterial, Shipment, ShipmentItem,
+)
+from .pagination import CURSOR_PARAM, keyset_page
+from .picking import pick_batches
+from .scanning import GS, parse_scan
+
+
+def _gtin(digits):
+    """GTIN с правильной контрольной цифрой"""
+    return digits + gtin_check_digit(digits)
+
+
+class ParseScanTests(TestCase):
+    """Разбор отсканированных кодов: GTIN и строки GS1"""
+    gtin = _gtin('460123456789')  # GTIN-13
+
+    def test_plain_gtin_is_padded_to_14_digits(self):
+        self.assertEqual(parse_scan(self.gtin), (self.gtin.zfill(14), None, None, None))
+
+    def test_gs1_with_fnc1_separator(self):
+        # Префикс символики ]C1, партия переменной длины завершается разделителем FNC1
+        code = f']C101{self.gtin.zfill(14)}10L-42{GS}1125030117260315'
+        self.assertEqual(parse_scan(code), (self.gtin.zfill(14), 'L-42', date(2025, 3, 1), date(2026, 3, 15)))
+
+    def test_gs1_bracketed_form(self):
+        scan = parse_scan(f'(01){self.gtin.zfill(14)}(10)L-42(11)250301(17)260300')
+        self.assertEqual(scan.batch_number, 'L-42')
+        self.assertEqual(scan.production_date, date(2025, 3, 1))
+        self.assertEqual(scan.expiry_date, date(2026, 3, 31))  # День 00 — последний день месяца
+
+    def test_bad_check_digit(self):
+        wrong = self.gtin[:-1] + str((int(self.gtin[-1]) + 1) % 10)
+        with self.assertRaises(ValidationError):
+            parse_scan(wrong)
+        with self.assertRaises(ValidationError):
+            parse_scan(f'01{wrong.zfill(14)}10L-42')
+
+    def test_gs1_without_gtin(self):
+        with self.assertRaises(ValidationError):
+            parse_scan('10L-42')
+
+    def test_unsupported_application_identifier(self):
+        with self.assertRaises(ValidationError):
+            parse_scan(f'01{self.gtin.zfill(14)}99ABC')
+
+
+class ProductGtinTests(TestCase):
+    """Проверка GTIN продукта в модели и форме"""
+
+    def test_only_scannable_gtins_are_accepted(self):
+        line = Line.objects.create(name='Линия GTIN', volume=Decimal('0.50'), number=1)
+        data = {'line': line.pk, 'name': 'Вода', 'volume': '0.50', 'picking_strategy': Product.FIFO}
+        # Длиннее 14 символов (индекс сравнивал бы только первые 14), не цифры, неверная контрольная цифра
+        for gtin in ('12345678901234567', '46012345678O5', _gtin('460123456789')[:-1] + 'X', '4601234567891'):
+            form = ProductForm(data={**data, 'gtin': gtin})
+            self.assertFalse(form.is_valid(), gtin)
+            self.assertIn('gtin', form.errors)
+        self.assertTrue(ProductForm(data={**data, 'gtin': _gtin('460123456789')}).is_valid())
+
+
+class KeysetPaginationTests(TestCase):
+    """Keyset-пагинация: переход по курсорам и испорченный курсор"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # Одинаковые названия проверяют, что первичный ключ делает порядок однозначным
+        for name in ['Б', 'А', 'В', 'А', 'Г', 'Б', 'Д']:
+            Counterparty.objects.create(name=name, address='-', contact_number='-')
+
+    def page(self, cursor=None):
+        request = RequestFactory().get('/', {CURSOR_PARAM: cursor} if cursor else {})
+        return keyset_page(request, Counterparty.objects.all(), ordering=('name',), per_page=3)
+
+    def test_cursor_round_trip(self):
+        expected = list(Counterparty.objects.order_by('name', 'pk').values_list('pk', flat=True))
+        seen, cursor, pages = [], None, 0
+        while True:
+            page = self.page(cursor)
+            self.assertEqual(page.is_first, cursor is None)
+            seen += [counterparty.pk for counterparty in page]
+            pages += 1
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 3)
+
+    def test_tampered_cursor_returns_first_page(self):
+        first = [counterparty.pk for counterparty in self.page()]
+        for cursor in ('не-курсор', 'WyJhIl0=', 'eyJhIjogMX0='):  # Мусор, одно поле вместо двух, не список
+            page = self.page(cursor)
+            self.assertTrue(page.is_first)
+            self.assertEqual([counterparty.pk for counterparty in page], first)
+
+
+class ProductFixtureMixin:
+    """Линия и продукты для тестов составов и подбора партий"""
+
+    @classmethod
+    def create_product(cls, name, **kwargs):
+        line, _ = Line.objects.get_or_create(name='Тестовая линия', defaults={'volume': Decimal('1.50'), 'number': 1})
+        gtin = _gtin(f'4600000000{Product.objects.count():02d}')  # GTIN продуктов уникальны
+        return Product.objects.create(name=name, gtin=gtin, volume=line.volume, line=line, **kwargs)
+
+
+class FlatBomTests(ProductFixtureMixin, TestCase):
+    """Развёртывание многоуровневых составов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.water = Material.objects.create(name='Вода', unit='l')
+        cls.cap = Material.objects.create(name='Крышка', unit='pcs')
+        cls.syrup = cls.create_product('Сироп')
+        cls.drink = cls.create_product('Напиток')
+        ProductMaterial.objects.create(product=cls.syrup, material=cls.water, quantity=Decimal('0.20'))
+        ProductMaterial.objects.create(product=cls.drink, material=cls.water, quantity=Decimal('1.00'))
+        ProductMaterial.objects.create(product=cls.drink, material=cls.cap, quantity=Decimal('1.00'))
+        ProductComponent.objects.create(product=cls.drink, component=cls.syrup, quantity=Decimal('0.50'))
+
+    def test_nested_components_are_exploded(self):
+        self.assertEqual(flat_bom([self.drink.pk])[self.drink.pk], {
+            self.water.pk: Decimal('1.10'),
+            self.cap.pk: Decimal('1.00'),
+        })
+
+    def test_change_is_visible_after_save(self):
+        flat_bom()
+        ProductMaterial.objects.filter(product=self.syrup).update(quantity=Decimal('0.40'))
+        ProductMaterial.objects.get(product=self.syrup).save()  # Сигнал сохранения меняет версию составов
+        self.assertEqual(flat_bom([self.drink.pk])[self.drink.pk][self.water.pk], Decimal('1.20'))
+
+    def test_warm_cache_does_not_query_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductMaterial.objects.get(product=self.syrup).save()  # Изменение состава зафиксировано
+        flat_bom()
+        with self.assertNumQueries(0):
+            flat_bom([self.drink.pk])
+        with override_settings(BOM_VERSION_CHECK_INTERVAL=0), self.assertNumQueries(1):
+            flat_bom([self.drink.pk])  # Пора сверить версию: составы не изменились и не перечитываются
+
+    def test_cycle_is_rejected_by_clean(self):
+        with self.assertRaises(ValidationError):
+            ProductComponent(product=self.syrup, component=self.drink, quantity=1).clean()
+
+    def test_cycle_is_reported_on_explosion(self):
+        ProductComponent.objects.create(product=self.syrup, component=self.drink, quantity=1)  # Минуя clean()
+        with self.assertRaises(ValidationError):
+            flat_bom([self.drink.pk])
+
+
+class PickBatchesTests(ProductFixtureMixin, TestCase):
+    """Подбор партий для отгрузки по FIFO и FEFO"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = cls.create_product('Вода 1,5 л')
+        start = date(2025, 1, 1)
+        # Раньше произведённая партия годна дольше: FIFO и FEFO выбирают разные партии
+        cls.items = []
+        for days, shelf_life, quantity in [(0, 300, 5), (10, 100, 5), (20, 200, 5)]:
+            batch = Batch.objects.create(
+                product=cls.product, line=cls.product.line, production_date=start + timedelta(days=days), quantity=quantity,
+            )
+            cls.items.append(FinishedGoodsStock.objects.create(
+                product=cls.product, batch=batch, batch_number=batch.batch_number,
+                production_date=batch.production_date, expiry_date=batch.production_date + timedelta(days=shelf_life),
+                quantity=quantity,
+            ))
+
+    def picks(self, quantity, strategy):
+        return [(pick.finished_goods.pk, pick.quantity) for pick in pick_batches(self.product, quantity, strategy)]
+
+    def test_fifo_splits_across_batches(self):
+        first, second, _ = self.items
+        self.assertEqual(self.picks(8, Product.FIFO), [(first.pk, Decimal('5')), (second.pk, Decimal('3'))])
+
+    def test_fefo_takes_nearest_expiry_first(self):
+        _, second, third = self.items
+        self.assertEqual(self.picks(8, Product.FEFO), [(second.pk, Decimal('5')), (third.pk, Decimal('3'))])
+
+    def test_used_batches_are_skipped(self):
+        first, second, third = self.items
+        FinishedGoodsStock.objects.filter(pk=first.pk).update(quantity=0, is_used=True)
+        self.assertEqual(self.picks(7, Product.FIFO), [(second.pk, Decimal('5')), (third.pk, Decimal('2'))])
+
+    def test_shortage(self):
+        with self.assertRaises(ValidationError):
+            pick_batches(self.product, 16)
+        with self.assertRaises(ValidationError):
+            pick_batches(self.product, 0)
+
+
+class SearchSelectTests(TestCase):
+    """Выпадающие списки с поиском в отправленных формах"""
+
+    def test_form_with_malformed_id_is_rendered_again(self):
+        material = Material.objects.create(name='Преформа', unit='pcs')
+        form = ProductMaterialForm(data={'product': 'abc', 'material': str(material.pk), 'quantity': '1'})
+        self.assertFalse(form.is_valid())
+        self.assertIn('product', form.errors)
+        html = form.as_p()
+        self.assertNotIn('abc', html)
+        self.assertInHTML(f'<option value="{material.pk}" selected>Преформа</option>', html)
+
+
+class BatchNumberTests(ProductFixtureMixin, TestCase):
+    """Номера партий из счётчика дня"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = cls.create_product('Вода 5 л')
+
+    def create_batch(self, batch_number=''):
+        return Batch.objects.create(
+            product=self.product, line=self.product.line, production_date=date(2025, 1, 1), batch_number=batch_number,
+        )
+
+    def test_numbers_continue_batches_issued_before_the_counter(self):
+        today = timezone.now().date()
+        # Партии, пронумерованные до появления счётчика: строки дня в счётчике ещё нет
+        for number in (1, 3):
+            self.create_batch(Batch.format_batch_number(number, today))
+        self.assertFalse(BatchNumberSequence.objects.filter(day=today).exists())
+        self.assertEqual(self.create_batch().batch_number, Batch.format_batch_number(4, today))
+        self.assertEqual(Batch.reserve_batch_numbers(2), [Batch.format_batch_number(number, today) for number in (5, 6)])
+
+
+class ShipmentListTests(ProductFixtureMixin, TestCase):
+    """Список и выгрузка отгрузок: документы со строками и старые отгрузки без строк"""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = cls.create_product('Вода 0,5 л')
+        counterparty = Counterparty.objects.create(name='Магазин', address='-', contact_number='-')
+        cls.old_batch, cls.new_batch = [
+            Batch.objects.create(product=product, line=product.line, production_date=date(2025, 1, day), quantity=10)
+            for day in (1, 2)
+        ]
+        # Отгрузка, созданная до появления строк документа: партия и количество только в шапке
+        cls.legacy = Shipment.objects.create(
+            product=product, batch=cls.old_batch, quantity=3, shipment_date=date(2025, 1, 5), counterparty=counterparty,
+        )
+        cls.document = Shipment.objects.create(
+            product=product, quantity=4, shipment_date=date(2025, 1, 6), counterparty=counterparty,
+        )
+        for batch, quantity in ((cls.old_batch, 1), (cls.new_batch, 3)):
+            ShipmentItem.objects.create(shipment=cls.document, product=product, batch=batch, quantity=quantity)
+        cls.user = CustomUser.objects.create_user('shipments', role='finished_goods_warehouse_manager')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_export_includes_shipments_without_items(self):
+        response = self.client.get(reverse('export_shipments'))
+        content = b''.join(response.streaming_content).decode('utf-8').lstrip('\ufeff')
+        rows = list(csv.reader(content.splitlines(), delimiter=';'))
+        self.assertEqual([row[:4] + row[5:] for row in rows[1:]], [
+            [str(self.document.pk), '2025-01-06', 'Вода 0,5 л', self.old_batch.batch_number, '1.00'],
+            [str(self.document.pk), '2025-01-06', 'Вода 0,5 л', self.new_batch.batch_number, '3.00'],
+            [str(self.legacy.pk), '2025-01-05', 'Вода 0,5 л', self.old_batch.batch_number, '3.00'],
+            ['Итого', '', '', '', '7.00'],
+        ])
+
+    def test_list_shows_header_batch_of_shipments_without_items(self):
+        response = self.client.get(reverse('view_shipments'))
+        self.assertContains(response, f'{self.old_batch.batch_number} — 3,00')  # Из шапки старой отгрузки
+        self.assertContains(response, f'{self.new_batch.batch_number} — 3,00')  # Из строки документа
@@ -1,5 +1,8 @@
+import json
+from datetime import date, timedelta
+
 from django.contrib import messages
-from django.db.models import Max
+from django.db.models import Max, Sum
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
@@ -9,13 +12,25 @@ from .models import *
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.utils import timezone
+from django.views.decorators.http import require_POST
 from django.db.models import Max
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, JsonResponse, QueryDict
 from django.shortcuts import render, redirect
 from django.contrib.auth import login, authenticate
 from django.views.generic import ListView
 from .forms import *
 from .models import *
+from .caching import cache_per_role, cache_stats, stock_version
+from .exports import (
+    EXPORT_CHUNK_SIZE, EXPORTS, filter_batches, filter_shipments, shipment_items, stream_csv, stream_export,
+)
+from .jobs import JOBS, enqueue
+from .mrp import material_requirements
+from .pagination import KeysetPaginationMixin, keyset_page
+from .reference import reference_list
+from .picking import pick_batches
+from .services import create_picked_shipment, create_shipment_document, release_batches, set_stock_quantity
 
 
 # Регистрация нового пользователя
@@ -66,6 +81,7 @@ def login_view(request):
 
 
 # Главная страница
+@cache_per_role
 def home(request):
     """Отображает главную страницу."""
     return render(request, 'page_web/home.html')
@@ -73,16 +89,19 @@ def home(request):
 
 # Представления для страниц склада и производства
 @login_required
+@cache_per_role
 def warehouse_view(request):
     """Отображает страницу склада."""
     return render(request, 'warehause_page/warehouse.html')
 
 @login_required
+@cache_per_role
 def production_view(request):
     """Отображает страницу производства."""
     return render(request, 'warehause_page/production.html')
 
 @login_required
+@cache_per_role
 def finished_goods_warehouse_view(request):
     """Отображает страницу склада готовой продукции."""
     return render(request, 'warehause_page/finished_goods_warehouse.html')
@@ -94,6 +113,7 @@ def finished_goods_stock(request):
     return render(request, 'warehause_page/finished_goods_stock_list.html', {'batches': batches})
 
 @login_required
+@cache_per_role
 def production_main(request):
     """Отображает главную страницу производства."""
     return render(request, 'warehause_page/production_main.html')
@@ -117,12 +137,12 @@ def create_line(request):
 
 
 # Список всех линий
-class LineListView(ListView):
+class LineListView(KeysetPaginationMixin, ListView):
     """Отображает список всех производственных линий."""
     model = Line
     template_name = 'lines/line_list.html'
     context_object_name = 'lines'
-    ordering = ['number']
+    keyset_ordering = ('number',)
 
 
 # Добавление продукта на линию
@@ -146,8 +166,8 @@ def add_product_to_line(request):
 @login_required
 def product_list(request):
     """Отображает список всех продуктов и линий."""
-    products = Product.objects.all()
-    lines = Line.objects.all()
+    products = reference_list(Product)
+    lines = reference_list(Line)
     return render(request, 'lines/product_list.html', {'products': products, 'lines': lines})
 
 
@@ -170,7 +190,7 @@ def create_batch(request):
         line_id = request.GET.get('line')
         form = BatchForm(line_id=line_id)
 
-    lines = Line.objects.all()
+    lines = reference_list(Line)
     return render(request, 'lines/create_batch.html', {'form': form, 'lines': lines, 'selected_line_id': line_id})
 
 
@@ -179,23 +199,24 @@ def create_batch(request):
 @login_required
 def batch_list(request):
     """Отображает список партий продукции с возможностью фильтрации по дате и продукту."""
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    product_id = request.GET.get('product_id')
+    batches = (
+        filter_batches(request.GET)
+        .select_related('product', 'line')
+        .only('batch_number', 'production_date', 'quantity', 'product__name', 'line__name')
+    )
+    page = keyset_page(request, batches, ordering=('-production_date', '-pk'))
 
-    # Фильтрация по дате и продукту
-    filters = {}
-    if start_date and end_date:
-        filters['production_date__range'] = [start_date, end_date]
-    if product_id:
-        filters['product_id'] = product_id
+    # Получаем список продуктов для фильтрации
+    products = reference_list(Product)
 
-    batches = Batch.objects.filter(**filters)
+    return render(request, 'lines/batch_list.html', {'batches': page, 'page': page, 'products': products})
 
-    # Получаем список продуктов для фильтрации
-    products = Product.objects.all()
 
-    return render(request, 'lines/batch_list.html', {'batches': batches, 'products': products})
+# Экспорт списка партий
+@login_required
+def export_batches(request):
+    """Выгружает отфильтрованный список партий в CSV с итоговым количеством."""
+    return stream_export('batches', request.GET)
 
 
 # Загрузка продуктов по линии
@@ -218,9 +239,9 @@ def warehouse(request):
 
 @login_required
 def view_stock(request):
-    """Отображает список всех материалов на складе."""
-    materials = Material.objects.all()
-    return render(request, 'materials/view_stock.html', {'materials': materials})
+    """Отображает остатки всех материалов на складе (таблица кэшируется до изменения остатков)."""
+    stocks = Stock.objects.select_related('material').order_by('material__name', 'pk')
+    return render(request, 'materials/view_stock.html', {'stocks': stocks})
 
 @login_required
 def view_finished_goods_stock(request):
@@ -263,6 +284,23 @@ def create_product_material(request):
     return render(request, 'materials/create_product_material.html', {'form': form})
 
 
+# Добавление полуфабриката к продукту
+@login_required
+def create_product_component(request):
+    """Обрабатывает добавление полуфабриката (продукта с собственным составом) к продукту."""
+    if request.method == 'POST':
+        form = ProductComponentForm(request.POST)
+        if form.is_valid():
+            form.save()
+            messages.success(request, 'Полуфабрикат успешно добавлен к продукту!')
+            return redirect('product_material_list')
+        else:
+            messages.error(request, 'Пожалуйста, исправьте ошибки ниже.')
+    else:
+        form = ProductComponentForm()
+    return render(request, 'materials/create_product_component.html', {'form': form})
+
+
 # Список всех материалов
 @login_required
 def material_list(request):
@@ -275,8 +313,11 @@ def material_list(request):
 @login_required
 def product_material_list(request):
     """Отображает список всех связей продуктов и материалов."""
-    product_materials = ProductMaterial.objects.all()
-    return render(request, 'materials/product_material_list.html', {'product_materials': product_materials})
+    product_materials = ProductMaterial.objects.select_related('product', 'material').only(
+        'quantity', 'product__name', 'material__name'
+    )
+    page = keyset_page(request, product_materials, ordering=('pk',))
+    return render(request, 'materials/product_material_list.html', {'product_materials': page, 'page': page})
 
 
 # Выпуск продукции и списание материалов
@@ -289,44 +330,14 @@ def release_products(request):
             batch = form.cleaned_data['batch']
             quantity = Decimal(form.cleaned_data['quantity'])  # Конвертируем в Decimal
 
-            # Получаем партию по её ID
-            batch_instance = get_object_or_404(Batch, id=batch.id)
-
-            # Проверяем, достаточно ли материала на складе
-            product_materials = ProductMaterial.objects.filter(product=batch_instance.product)
-            for pm in product_materials:
-                total_needed = pm.quantity * quantity
-                stock_item = get_object_or_404(Stock, material=pm.material)
-
-                if stock_item.quantity < total_needed:
-                    return render(request, 'materials/release_products.html', {
-                        'form': form,
-                        'error': f'Недостаточно {pm.material.name} на складе.'
-                    })
-
-            # Если проверка пройдена, обновляем количество на складе
-            for pm in product_materials:
-                total_needed = pm.quantity * quantity
-                stock_item = get_object_or_404(Stock, material=pm.material)
-                stock_item.quantity -= total_needed
-                stock_item.save()
-
-            # Обновляем количество в партии
-            batch_instance.quantity = quantity
-            batch_instance.save()
-
-            # Если количество в партии стало 0, отметить её как использованную
-            if batch_instance.quantity == 0:
-                batch_instance.is_used = True
-                batch_instance.save()
-
-            # Создаем запись в складе готовой продукции
-            finished_goods, created = FinishedGoodsStock.objects.get_or_create(
-                product=batch_instance.product,
-                batch_number=batch_instance.batch_number,
-                production_date=batch_instance.production_date,
-            )
-            finished_goods.update_quantity(quantity)  # Обновляем количество на складе готовой продукции
+            # Списываем материалы и зачисляем продукцию одной транзакцией
+            try:
+                release_batches([(batch, quantity)])
+            except ValidationError as e:
+                return render(request, 'materials/release_products.html', {
+                    'form': form,
+                    'error': e.messages[0]
+                })
 
             messages.success(request, 'Продукция успешно выпущена.')
             return redirect('finished_goods_warehouse')
@@ -343,58 +354,158 @@ def create_shipment(request):
     if request.method == 'POST':
         form = ShipmentForm(request.POST)
         if form.is_valid():
-            shipment = form.save(commit=False)
-            product = shipment.product
-            batch = shipment.batch
-            quantity = shipment.quantity
-
+            counterparty = form.cleaned_data['counterparty']
+            shipment_date = form.cleaned_data['shipment_date']
+            batch = form.cleaned_data['batch']
+            quantity = form.cleaned_data['quantity']
             try:
-                # Получаем запись о складе для продукта
-                stock = FinishedGoodsStock.objects.get(
-                    product=product,
-                    batch_number=batch.batch_number,
-                    production_date=batch.production_date,
-                    is_used=False
-                )
-
-                # Обновляем количество на складе
-                stock.update_quantity(-quantity)
-
-                # Создаем запись об отгрузке
-                shipment.save()
-                messages.success(request, 'Отгрузка успешно создана.')
+                # Создаем отгрузку и списываем остаток одной транзакцией
+                if batch is None:
+                    shipment = create_picked_shipment(counterparty, shipment_date, [(form.cleaned_data['product'], quantity)])
+                else:
+                    shipment = create_shipment_document(counterparty, shipment_date, [(batch, quantity)])
+                batch_numbers = shipment.items.values_list('batch__batch_number', flat=True)
+                messages.success(request, f'Отгрузка успешно создана, партии: {", ".join(batch_numbers)}.')
                 return redirect('view_shipments')
 
-            except FinishedGoodsStock.DoesNotExist:
-                messages.error(request, 'Продукт не найден на складе или партия уже использована.')
+            except ValidationError as e:
+                for error in e.messages:
+                    messages.error(request, error)
                 return render(request, 'warehause_page/create_shipment.html', {'form': form})
 
     else:
         form = ShipmentForm()
 
-    # Обновите форму с отфильтрованными партиями
-    form.fields['batch'].queryset = FinishedGoodsStock.objects.filter(quantity__gt=0, is_used=False)
     return render(request, 'warehause_page/create_shipment.html', {'form': form})
 
 
+# Создание многострочной отгрузки (JSON API)
+@login_required
+@require_POST
+def api_create_shipment(request):
+    """Создаёт отгрузку из нескольких строк по JSON-документу.
+
+    Формат: {"counterparty": id, "shipment_date": "ГГГГ-ММ-ДД", "items": [{"batch": id, "quantity": "10"}]}.
+    Вместо партий строки могут указывать продукты ({"product": id, "quantity": "10"}),
+    тогда партии подбираются автоматически по FIFO или FEFO.
+    """
+    try:
+        data = json.loads(request.body)
+        counterparty = Counterparty.objects.get(pk=data['counterparty'])
+        shipment_date = date.fromisoformat(data['shipment_date'])
+        by_product = bool(data['items']) and all('product' in item for item in data['items'])
+        key = 'product' if by_product else 'batch'
+        lines = [(int(item[key]), Decimal(str(item['quantity']))) for item in data['items']]
+    except (ValueError, KeyError, TypeError, ArithmeticError, Counterparty.DoesNotExist):
+        return JsonResponse({'errors': ['Некорректный документ отгрузки.']}, status=400)
+
+    if by_product:
+        products = Product.objects.in_bulk({product_id for product_id, _ in lines})
+        missing = sorted({product_id for product_id, _ in lines if product_id not in products})
+        if missing:
+            return JsonResponse({'errors': [f'Продукт с id {product_id} не найден.' for product_id in missing]}, status=400)
+        try:
+            shipment = create_picked_shipment(
+                counterparty, shipment_date, [(products[product_id], quantity) for product_id, quantity in lines]
+            )
+        except ValidationError as e:
+            return JsonResponse({'errors': e.messages}, status=400)
+        return JsonResponse({'id': shipment.pk, 'quantity': str(shipment.quantity), 'items': shipment.items.count()}, status=201)
+
+    # Все партии документа загружаются одним запросом
+    batches = Batch.objects.in_bulk({batch_id for batch_id, _ in lines})
+    missing = sorted({batch_id for batch_id, _ in lines if batch_id not in batches})
+    if missing:
+        return JsonResponse({'errors': [f'Партия с id {batch_id} не найдена.' for batch_id in missing]}, status=400)
+
+    try:
+        shipment = create_shipment_document(
+            counterparty, shipment_date, [(batches[batch_id], quantity) for batch_id, quantity in lines]
+        )
+    except ValidationError as e:
+        return JsonResponse({'errors': e.messages}, status=400)
+
+    return JsonResponse({'id': shipment.pk, 'quantity': str(shipment.quantity), 'items': len(lines)}, status=201)
+
+
+# Предварительный подбор партий для отгрузки (JSON API)
+@login_required
+def api_pick_batches(request):
+    """Показывает, из каких партий будет отгружено количество продукта, ничего не списывая.
+
+    Параметры: product, quantity и необязательный strategy (fifo или fefo, по умолчанию — настройка продукта).
+    """
+    try:
+        product = Product.objects.get(pk=int(request.GET['product']))
+        quantity = Decimal(request.GET['quantity'])
+    except (ValueError, KeyError, ArithmeticError, Product.DoesNotExist):
+        return JsonResponse({'errors': ['Укажите продукт и количество.']}, status=400)
+    strategy = request.GET.get('strategy') or product.picking_strategy
+    if strategy not in dict(Product.PICKING_CHOICES):
+        return JsonResponse({'errors': ['Неизвестный порядок подбора.']}, status=400)
+
+    try:
+        picks = pick_batches(product, quantity, strategy)
+    except ValidationError as e:
+        return JsonResponse({'errors': e.messages}, status=400)
+    return JsonResponse({
+        'product': product.pk,
+        'strategy': strategy,
+        'items': [
+            {
+                'batch': pick.finished_goods.batch_id,
+                'batch_number': pick.finished_goods.batch.batch_number,
+                'production_date': pick.finished_goods.production_date,
+                'expiry_date': pick.finished_goods.expiry_date,
+                'available': pick.finished_goods.quantity,
+                'quantity': pick.quantity,
+            }
+            for pick in picks
+        ],
+    })
+
+
+# Расчёт потребности в материалах по плану производства (JSON API)
+@login_required
+@require_POST
+def api_mrp(request):
+    """Рассчитывает потребность в материалах и дефицит по дням для плана производства.
+
+    Формат: {"plan": [{"product": id, "quantity": "1000", "date": "ГГГГ-ММ-ДД"}]}
+    """
+    try:
+        data = json.loads(request.body)
+        plan = [
+            (int(item['product']), Decimal(str(item['quantity'])), date.fromisoformat(item['date']))
+            for item in data['plan']
+        ]
+    except (ValueError, KeyError, TypeError, ArithmeticError):
+        return JsonResponse({'errors': ['Некорректный план производства.']}, status=400)
+
+    return JsonResponse(material_requirements(plan))
+
+
 # Просмотр всех отгрузок
 @login_required
 def view_shipments(request):
     """Отображает список всех отгрузок с возможностью фильтрации по дате."""
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
+    shipments = filter_shipments(request.GET).select_related('product', 'batch', 'counterparty').only(
+        'quantity', 'shipment_date', 'product__name', 'batch__batch_number', 'counterparty__name'
+    ).prefetch_related(shipment_items())  # Строки документа: партии и количества; у старых отгрузок — партия в шапке
+    page = keyset_page(request, shipments, ordering=('-shipment_date', '-pk'))
+    return render(request, 'warehause_page/view_shipments.html', {'shipments': page, 'page': page})
 
-    if start_date and end_date:
-        shipments = Shipment.objects.filter(shipment_date__range=[start_date, end_date])
-    else:
-        shipments = Shipment.objects.all()
 
-    return render(request, 'warehause_page/view_shipments.html', {'shipments': shipments})
+# Экспорт списка отгрузок
+@login_required
+def export_shipments(request):
+    """Выгружает отфильтрованный список отгрузок в CSV с итоговым количеством."""
+    return stream_export('shipments', request.GET)
 
 @login_required
 def check_incoming(request):
-    """Отображает страницу проверки поступлений товаров на склад."""
-    batches = Batch.objects.filter(quantity__gt=0, is_used=False)
+    """Отображает страницу проверки поступлений товаров на склад (таблица кэшируется до изменения остатков)."""
+    batches = Batch.objects.filter(quantity__gt=0, is_used=False).select_related('product', 'line')
     return render(request, 'warehause_page/check_incoming.html', {'batches': batches})
 
 @login_required
@@ -430,6 +541,27 @@ def counterparty_list(request):
     return render(request, 'warehause_page/counterparty_list.html', {'counterparties': counterparties})
 
 
+# Загрузка справочников из CSV-файла
+@login_required
+def import_masterdata_view(request):
+    """Ставит загрузку материалов, продуктов, составов или остатков из CSV в очередь фоновых задач;
+    ход загрузки и ошибки по строкам показывает страница задачи."""
+    if request.method == 'POST':
+        form = MasterDataImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            job = enqueue(
+                'import_masterdata',
+                {'kind': form.cleaned_data['kind'], 'delimiter': form.cleaned_data['delimiter']},
+                request.user,
+                input_file=form.cleaned_data['file'],
+            )
+            messages.success(request, 'Файл принят, загрузка выполняется в фоне.')
+            return redirect('job_detail', job_id=job.pk)
+    else:
+        form = MasterDataImportForm()
+    return render(request, 'materials/import_masterdata.html', {'form': form})
+
+
 # Представление для добавления остатка
 @login_required
 def add_stock(request):
@@ -437,7 +569,8 @@ def add_stock(request):
     if request.method == 'POST':
         form = StockForm(request.POST)
         if form.is_valid():
-            form.save()
+            # Начальный остаток записывается в журнал как поступление
+            set_stock_quantity(form.cleaned_data['material'], form.cleaned_data['quantity'], kind=StockMovement.RECEIPT)
             return redirect('view_stock')
     else:
         form = StockForm()
@@ -452,11 +585,13 @@ def edit_stock(request, stock_id):
     stock = get_object_or_404(Stock, id=stock_id)
     if request.method == 'POST':
         form = StockForm(request.POST, instance=stock)
+        form.fields['material'].disabled = True  # Материал остатка не меняется
         if form.is_valid():
-            form.save()
+            set_stock_quantity(stock.material, form.cleaned_data['quantity'])
             return redirect('view_stock')
     else:
         form = StockForm(instance=stock)
+        form.fields['material'].disabled = True
 
     return render(request, 'materials/edit_stock.html', {'form': form})
 
@@ -468,15 +603,12 @@ def view_and_edit_stock(request):
     if request.method == 'POST':
         form = StockForm(request.POST)
         if form.is_valid():
-            stock_id = form.cleaned_data.get('id')
-            stock_item = get_object_or_404(Stock, id=stock_id)
-            stock_item.quantity = form.cleaned_data['quantity']
-            stock_item.save()
+            set_stock_quantity(form.cleaned_data['material'], form.cleaned_data['quantity'])
             return redirect('view_and_edit_stock')
     else:
         form = StockForm()
 
-    stocks = Stock.objects.all()
+    stocks = Stock.objects.select_related('material').order_by('material__name', 'pk')
     return render(request, 'materials/view_and_edit_stock.html', {'stocks': stocks, 'form': form})
 
 
@@ -484,5 +616,187 @@ def view_and_edit_stock(request):
 @login_required
 def finished_goods_stock_list(request):
     """Отображает список всех остатков готовой продукции."""
-    stock = FinishedGoodsStock.objects.all()
-    return render(request, 'warehause_page/finished_goods_stock_list.html', {'stock': stock})
+    stock = FinishedGoodsStock.objects.select_related('product').only(
+        'batch_number', 'production_date', 'quantity', 'product__name'
+    )
+    page = keyset_page(request, stock, ordering=('-production_date', '-pk'))
+    return render(request, 'warehause_page/finished_goods_stock_list.html', {'stock': page, 'page': page})
+
+
+# Экспорт остатков материалов
+@login_required
+def export_stock(request):
+    """Выгружает остатки материалов в CSV (без итога: единицы измерения различаются)."""
+    return stream_export('stock', request.GET)
+
+
+def _closed_day(request):
+    """Закрытый день из GET-параметра day или последний закрытый; None, если день не закрыт"""
+    try:
+        day = date.fromisoformat(request.GET.get('day') or '')
+    except ValueError:
+        return ClosedPeriod.objects.order_by('-day').first()
+    return ClosedPeriod.objects.filter(day=day).first()
+
+
+# Остатки на конец закрытого дня
+@login_required
+def stock_history(request):
+    """Отображает остатки материалов или готовой продукции на конец закрытого дня из неизменяемых снимков."""
+    period = _closed_day(request)
+    finished_goods = request.GET.get('kind') == 'finished_goods'
+    if period is None:
+        rows = DailyMaterialBalance.objects.none()
+    elif finished_goods:
+        rows = DailyFinishedGoodsBalance.objects.filter(day=period.day).select_related('product', 'finished_goods')
+    else:
+        rows = DailyMaterialBalance.objects.filter(day=period.day).select_related('material')
+    page = keyset_page(request, rows, ordering=('pk',))  # Строки снимка записаны в порядке названий
+    return render(request, 'materials/stock_history.html', {
+        'period': period,
+        'closed_days': ClosedPeriod.objects.order_by('-day').values_list('day', flat=True)[:366],
+        'finished_goods': finished_goods,
+        'rows': page,
+        'page': page,
+    })
+
+
+# Экспорт остатков на конец закрытого дня
+@login_required
+def export_stock_history(request):
+    """Выгружает снимок остатков закрытого дня в CSV; итог — только для готовой продукции."""
+    period = _closed_day(request)
+    if period is None:
+        messages.error(request, 'День не закрыт.')
+        return redirect('stock_history')
+    if request.GET.get('kind') == 'finished_goods':
+        rows = (
+            DailyFinishedGoodsBalance.objects.filter(day=period.day).order_by('pk')
+            .values_list('product__name', 'finished_goods__batch_number', 'finished_goods__production_date', 'quantity')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        return stream_csv(
+            f'finished_goods_{period.day}.csv', ['Продукт', 'Номер партии', 'Дата производства', 'Количество'], rows,
+            total_column=3,
+        )
+    rows = (
+        DailyMaterialBalance.objects.filter(day=period.day).order_by('pk')
+        .values_list('material__name', 'quantity', 'material__unit')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    return stream_csv(f'stock_{period.day}.csv', ['Материал', 'Количество', 'Единица измерения'], rows)
+
+
+# Экспорт остатков готовой продукции
+@login_required
+def export_finished_goods(request):
+    """Выгружает остатки готовой продукции в CSV с итоговым количеством."""
+    return stream_export('finished_goods', request.GET)
+
+
+# Отчёт по итогам производства и отгрузок
+@login_required
+def rollup_report(request):
+    """Отображает выпуск по линиям за день и отгрузки по контрагентам за месяц из таблиц итогов."""
+    today = timezone.localdate()  # Текущий день в часовом поясе проекта, как у close_day
+    try:
+        start_date = date.fromisoformat(request.GET.get('start_date') or '')
+    except ValueError:
+        start_date = today - timedelta(days=30)
+    try:
+        end_date = date.fromisoformat(request.GET.get('end_date') or '')
+    except ValueError:
+        end_date = today
+
+    production = (
+        DailyProductionRollup.objects.filter(day__range=[start_date, end_date])
+        .select_related('line', 'product')
+        .order_by('-day', 'line__number', 'product__name')
+    )
+    shipments = (
+        MonthlyShipmentRollup.objects.filter(month__range=[start_date.replace(day=1), end_date])
+        .select_related('product', 'counterparty')
+        .order_by('-month', 'counterparty__name', 'product__name')
+    )
+    return render(request, 'warehause_page/rollup_report.html', {
+        'production': production,
+        'production_total': production.aggregate(total=Sum('quantity'))['total'] or 0,
+        'shipments': shipments,
+        'shipments_total': shipments.aggregate(total=Sum('quantity'))['total'] or 0,
+        'start_date': start_date,
+        'end_date': end_date,
+    })
+
+
+@login_required
+def cache_statistics(request):
+    """Возвращает число попаданий и промахов кэша страниц и таблиц остатков в формате JSON"""
+    return JsonResponse({'stock_version': stock_version(), 'caches': cache_stats()})
+
+
+# Фоновые задачи
+@login_required
+def job_list(request):
+    """Отображает последние фоновые задачи и позволяет запустить пересчёт итогов и закрытие дней в фоне."""
+    page = keyset_page(request, Job.objects.select_related('created_by'), ordering=('-pk',))
+    for job in page:
+        job.title = JOBS[job.kind].title if job.kind in JOBS else job.kind
+    return render(request, 'warehause_page/job_list.html', {
+        'jobs': page,
+        'page': page,
+        'active': any(job.active for job in page),
+    })
+
+
+@login_required
+def job_detail(request, job_id):
+    """Отображает состояние, ход выполнения и итог фоновой задачи."""
+    job = get_object_or_404(Job.objects.select_related('created_by'), id=job_id)
+    job.title = JOBS[job.kind].title if job.kind in JOBS else job.kind
+    return render(request, 'warehause_page/job_detail.html', {'job': job})
+
+
+@login_required
+@require_POST
+def enqueue_job(request):
+    """Ставит в очередь выгрузку (export и строка фильтров filters) или пересчёт итогов и закрытие дней."""
+    kind = request.POST.get('kind')
+    if kind == 'export' and request.POST.get('export') in EXPORTS:
+        params = {
+            'export': request.POST['export'],
+            'filters': QueryDict(request.POST.get('filters', '')).dict(),  # Фильтры страницы списка
+        }
+    elif kind in ('rebuild_rollups', 'close_period'):
+        params = {}
+    else:
+        messages.error(request, 'Неизвестная задача.')
+        return redirect('job_list')
+    job = enqueue(kind, params, request.user)
+    messages.success(request, f'Задача «{JOBS[kind].title}» поставлена в очередь.')
+    return redirect('job_detail', job_id=job.pk)
+
+
+@login_required
+def download_job_result(request, job_id):
+    """Отдаёт файл, сформированный фоновой задачей."""
+    job = get_object_or_404(Job, id=job_id, status=Job.DONE)
+    if not job.result_file:
+        raise Http404('У задачи нет файла результата.')
+    filename = (job.result or {}).get('filename') or job.result_file.name.rsplit('/', 1)[-1]
+    return FileResponse(job.result_file.open('rb'), as_attachment=True, filename=filename)
+
+
+@login_required
+def api_job(request, job_id):
+    """Состояние фоновой задачи в формате JSON (для опроса хода выполнения)"""
+    job = get_object_or_404(Job, id=job_id)
+    return JsonResponse({
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'message': job.progress_message,
+        'attempts': job.attempts,
+        'error': job.error,
+        'result': job.result,
+    })
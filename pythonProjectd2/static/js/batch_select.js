@@ -0,0 +1,50 @@
+// Список партий, зависящий от выбранного продукта (select с атрибутом data-batches-url).
+// При смене продукта варианты списка заменяются открытыми партиями этого продукта
+// из /api/finished_goods/; пустой вариант «Подобрать автоматически» сохраняется.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-batches-url]').forEach(function (select) {
+        var product = document.getElementById(select.dataset.productField);
+        if (!product) {
+            return;
+        }
+        var current = product.value;
+        var request = null;
+
+        // Список продуктов с поиском (search_select.js) тоже сообщает о смене выбора событием change
+        product.addEventListener('change', function () {
+            if (product.value === current) {
+                return;
+            }
+            current = product.value;
+            if (request) {
+                request.abort();
+            }
+            fill([]);
+            if (!current) {
+                return;
+            }
+            request = new AbortController();
+            var url = select.dataset.batchesUrl + '?product=' + encodeURIComponent(current) + '&limit=500';
+            fetch(url, {signal: request.signal, credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (data) { fill(data.results || []); })
+                .catch(function () {});
+        });
+
+        function fill(items) {
+            Array.from(select.options).forEach(function (option) {
+                if (option.value !== '') {
+                    option.remove();
+                }
+            });
+            var seen = {};
+            items.forEach(function (item) {
+                if (item.batch && !seen[item.batch]) {
+                    seen[item.batch] = true;
+                    select.add(new Option(item.batch_number, item.batch));
+                }
+            });
+            select.value = '';
+        }
+    });
+});
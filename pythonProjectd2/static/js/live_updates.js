@@ -0,0 +1,70 @@
+// Живое обновление складских экранов через поток событий /api/events/ (server-sent events).
+// Таблица с атрибутом data-live-type получает события своего типа: строки tr[data-live-id]
+// обновляются по ячейкам [data-live-field], закрытые или удалённые строки убираются,
+// а новые строятся по <template> таблицы (если задан data-live-insert: top или bottom).
+// data-live-open-only — показывать только открытые строки (ненулевой остаток, партия не использована).
+document.addEventListener('DOMContentLoaded', function () {
+    var tables = Array.from(document.querySelectorAll('table[data-live-type]'));
+    if (!tables.length || !window.EventSource) {
+        return;
+    }
+    var types = [];
+    tables.forEach(function (table) {
+        if (types.indexOf(table.dataset.liveType) === -1) {
+            types.push(table.dataset.liveType);
+        }
+    });
+
+    // Пропущенные при переподключении события сервер повторяет по Last-Event-ID сам
+    var source = new EventSource(tables[0].dataset.liveUrl + '?types=' + encodeURIComponent(types.join(',')));
+    types.forEach(function (type) {
+        source.addEventListener(type, function (event) {
+            var rows = JSON.parse(event.data).rows;
+            tables.forEach(function (table) {
+                if (table.dataset.liveType === type) {
+                    rows.forEach(function (row) { apply(table, row); });
+                }
+            });
+        });
+    });
+    // Изменений слишком много или часть событий потеряна — перечитываем страницу
+    source.addEventListener('reload', function () {
+        source.close();
+        window.location.reload();
+    });
+
+    function apply(table, row) {
+        var body = table.tBodies[0];
+        var tr = body.querySelector('tr[data-live-id="' + row.id + '"]');
+        var visible = !row.deleted && (row.open || !table.hasAttribute('data-live-open-only'));
+        if (!visible) {
+            if (tr) {
+                tr.remove();
+            }
+            return;
+        }
+        if (!tr) {
+            var template = table.querySelector('template');
+            if (!template || !table.dataset.liveInsert) {
+                return;
+            }
+            tr = template.content.firstElementChild.cloneNode(true);
+            tr.dataset.liveId = row.id;
+            var empty = body.querySelector('tr[data-live-empty]');
+            if (empty) {
+                empty.remove();
+            }
+            if (table.dataset.liveInsert === 'top') {
+                body.insertBefore(tr, body.firstChild);
+            } else {
+                body.appendChild(tr);
+            }
+        }
+        tr.querySelectorAll('[data-live-field]').forEach(function (cell) {
+            cell.textContent = row[cell.dataset.liveField];
+        });
+        tr.querySelectorAll('[data-live-href]').forEach(function (link) {
+            link.href = row[link.dataset.liveHref];
+        });
+    }
+});
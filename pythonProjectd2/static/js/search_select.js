@@ -0,0 +1,56 @@
+// Поиск по справочнику для выпадающих списков с атрибутом data-search-url.
+// Над списком появляется поле ввода; по мере ввода варианты списка заменяются
+// результатами /api/search/, выбранное значение отправляется формой как обычно.
+document.addEventListener('DOMContentLoaded', function () {
+    document.querySelectorAll('select[data-search-url]').forEach(function (select) {
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control';
+        input.placeholder = 'Начните вводить название' + (select.dataset.searchKind === 'product' ? ' или GTIN' : '');
+        select.parentNode.insertBefore(input, select);
+
+        var minLength = parseInt(select.dataset.searchMinLength, 10) || 1;
+        var timer = null;
+        var request = null;
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            var query = input.value.trim();
+            if (query.length < minLength) {
+                return;
+            }
+            // Запрос отправляется после паузы в наборе; незавершённый предыдущий отменяется
+            timer = setTimeout(function () {
+                if (request) {
+                    request.abort();
+                }
+                request = new AbortController();
+                var url = select.dataset.searchUrl + '?kind=' + encodeURIComponent(select.dataset.searchKind) +
+                    '&q=' + encodeURIComponent(query);
+                fetch(url, {signal: request.signal, credentials: 'same-origin'})
+                    .then(function (response) { return response.json(); })
+                    .then(function (data) { fill(select, data.results || []); })
+                    .catch(function () {});
+            }, 250);
+        });
+    });
+
+    function fill(select, results) {
+        var selected = select.value;
+        // Пустой вариант («---------» или «Подобрать автоматически») сохраняется
+        Array.from(select.options).forEach(function (option) {
+            if (option.value !== '') {
+                option.remove();
+            }
+        });
+        results.forEach(function (result) {
+            var option = new Option(result.text, result.id);
+            option.selected = String(result.id) === selected;
+            select.add(option);
+        });
+        if (results.length && !select.value) {
+            select.value = results[0].id;
+        }
+        select.dispatchEvent(new Event('change'));
+    }
+});